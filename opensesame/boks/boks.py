@@ -55,6 +55,7 @@ class boks(item.item, generic_response.generic_response):
 		self.dev = u'autodetect'	
 		self._dummy = u'no'
 		self.process_feedback = True
+		self._settings_cache = {}
 		item.item.__init__(self, name, experiment, script)
 
 	def prepare(self):
@@ -65,47 +66,124 @@ class boks(item.item, generic_response.generic_response):
 		
 		self._keyboard = keyboard(self.experiment)
 
-		# Prepare the device string
-		if self.get(u'_dummy') == u'yes':
+		# Prepare the device string. Setting _dummy to 'simulate', or setting
+		# the BOKS_SIMULATE environment variable, replaces the participant by a
+		# simulated participant, which is useful for fast dry runs.
+		participant = None
+		if self.get(u'_dummy') == u'simulate' or \
+			os.environ.get(u'BOKS_SIMULATE'):
+			dev = u'dummy'
+			if self.has(u'boks_seed'):
+				seed = self.get(u'boks_seed')
+			else:
+				seed = None
+			participant = libboks.simulated_participant(
+				rt_mu=self.get_check(u'boks_rt_mu', 400),
+				rt_sigma=self.get_check(u'boks_rt_sigma', 50),
+				rt_tau=self.get_check(u'boks_rt_tau', 100),
+				accuracy=self.get_check(u'boks_accuracy', .95),
+				hold_mean=self.get_check(u'boks_hold_mean', 150),
+				hold_sd=self.get_check(u'boks_hold_sd', 30),
+				seed=seed)
+		elif self.get(u'_dummy') == u'yes':
 			dev = u'dummy'
 		else:
 			dev = self.get(u'dev')
 			if dev == u'autodetect':
 				dev = None
 
-		# Dynamically load a boks instance
+		# Dynamically load a boks instance. Setting boks_debounce to a duration
+		# in milliseconds suppresses bouncing responses, and setting
+		# boks_calibration to yes applies the calibration profile of the boks.
 		if not hasattr(self.experiment, u'boks'):
+			if self.has(u'boks_debounce'):
+				debounce = libboks.debounce_filter( \
+					self.get(u'boks_debounce'))
+			else:
+				debounce = None
 			self.experiment.boks = libboks.libboks(dev, experiment= \
-				self.experiment)
+				self.experiment, participant=participant, wait_strategy= \
+				self.get_check(u'boks_wait_strategy', u'block', \
+				libboks.wait_strategies), debounce=debounce, calibration= \
+				self.get_check(u'boks_calibration', u'no', [u'yes', u'no']) \
+				== u'yes')
 			self.experiment.cleanup_functions.append(self.close)
 		model, firmware_version = self.experiment.boks.info()
 		self.experiment.set(u'boks_model', model)
 		self.experiment.set(u'boks_firmware_version', firmware_version)
-			
-		# Prepare the allowed responses
+
+		# Prepare the timeout
+		self.prepare_timeout()
+
+		# Compile the allowed responses and the timeout into a command packet,
+		# so that the run phase only needs to send it. Compiled settings are
+		# memoised on the variable values.
 		if self.has(u"allowed_responses"):
-			self._allowed_responses = []
-			for r in self.unistr(self.get(u"allowed_responses")).split(u";"):
+			allowed_responses = self.unistr(self.get(u"allowed_responses"))
+		else:
+			allowed_responses = None
+		key = allowed_responses, self._timeout
+		if key not in self._settings_cache:
+			self._settings_cache[key] = self.compile_settings( \
+				allowed_responses, self._timeout)
+		self._allowed_responses, self._settings = self._settings_cache[key]
+		debug.msg(u"allowed responses set to %s" % self._allowed_responses)
+
+		# Setting boks_latch to 'onset' or 'offset' starts the response interval
+		# on the photodiode, rather than on the onset of the current item.
+		if self.has(u'boks_latch'):
+			self._latch = self.get_check(u'boks_latch', None, \
+				libboks.latch_edges)
+		else:
+			self._latch = None
+
+		# Tell a simulated participant what the correct response is
+		if getattr(self.experiment.boks, u'participant', None) != None:
+			try:
+				self._correct_response = int(self.get(u'correct_response'))
+			except:
+				self._correct_response = None
+
+	def compile_settings(self, allowed_responses, timeout):
+
+		"""
+		Parses the allowed responses, and compiles them together with the
+		timeout into a command packet.
+
+		Arguments:
+		allowed_responses	--	A semicolon-separated string of responses, or
+								None to allow all responses.
+		timeout				--	The timeout.
+
+		Returns:
+		An (allowed responses, settings packet) tuple.
+		"""
+
+		if allowed_responses != None:
+			_allowed_responses = []
+			for r in allowed_responses.split(u";"):
 				if r.strip() != u"":
 					try:
 						r = int(r)
 					except:
 						raise exceptions.runtime_error( \
-							u"'%s' is not a valid response in boks '%s'. Expecting a number in the range 1 .. 4." \
+							u"'%s' is not a valid response in boks '%s'. Expecting a number in the range 1 .. 8." \
 							% (r, self.name))
 					if r not in range(1,9):
 						raise exceptions.runtime_error( \
 							u"'%s' is not a valid response in boks '%s'. Expecting a number in the range 1 .. 8." \
 							% (r, self.name))
-					self._allowed_responses.append(r)
-			if len(self._allowed_responses) == 0:
-				self._allowed_responses = None
+					_allowed_responses.append(r)
+			if len(_allowed_responses) == 0:
+				_allowed_responses = None
 		else:
-			self._allowed_responses = None			
-		debug.msg(u"allowed responses set to %s" % self._allowed_responses)
-			
-		# Prepare the timeout
-		self.prepare_timeout()
+			_allowed_responses = None
+		try:
+			settings = libboks.compile_settings(_allowed_responses, timeout)
+		except libboks.boks_exception as e:
+			raise exceptions.runtime_error( \
+				u"Invalid settings in boks '%s': %s" % (self.name, e))
+		return _allowed_responses, settings
 
 	def run(self):
 
@@ -120,13 +198,25 @@ class boks(item.item, generic_response.generic_response):
 			self.experiment.start_response_interval = self.get(u"time_%s" \
 				% self.name)
 				
-		# Send the timeout and allowed responses to the boks
-		self.experiment.boks.set_timeout(self._timeout)
-		self.experiment.boks.set_buttons(self._allowed_responses)
+		# Send the pre-compiled timeout and allowed responses to the boks
+		self.experiment.boks.apply_settings(self._settings)
+		if getattr(self.experiment.boks, u'participant', None) != None:
+			self.experiment.boks.participant.correct = self._correct_response
+			# The simulated participant responds on the simulated clock, which
+			# runs ahead of the experiment clock
+			self.experiment.start_response_interval += \
+				self.experiment.boks.lead
 				
-		# Get the response
-		self.experiment.response, self.experiment.end_response_interval = \
-			self.experiment.boks.get_button_press()
+		# Get the response. If the response interval is latched on the
+		# photodiode, the measured onset becomes the start of the interval.
+		if self._latch != None:
+			self.experiment.response, self.experiment.end_response_interval, \
+				onset = self.experiment.boks.get_button_press(latch=self._latch)
+			if onset != None:
+				self.experiment.start_response_interval = onset
+		else:
+			self.experiment.response, self.experiment.end_response_interval = \
+				self.experiment.boks.get_button_press()
 
 		debug.msg(u"received %s" % self.experiment.response)		
 		generic_response.generic_response.response_bookkeeping(self)
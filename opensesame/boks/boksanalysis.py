@@ -0,0 +1,596 @@
+#-*- coding:utf-8 -*-
+
+"""
+This file is part of Boks.
+
+Boks is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+Boks is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with Boks.  If not, see <http://www.gnu.org/licenses/>.
+"""
+
+import os
+import sys
+import numpy as np
+
+# First try to load libboks from source, from the plug-in folder. If this fails,
+# try a plain import statement. The imp module has been removed from Python
+# 3.12, so importlib is used where it is available.
+try:
+	path = os.path.join(os.path.dirname(__file__), 'libboks.py')
+	if sys.version_info >= (3, 5):
+		import importlib.util
+		spec = importlib.util.spec_from_file_location('libboks', path)
+		libboks = importlib.util.module_from_spec(spec)
+		sys.modules['libboks'] = libboks
+		spec.loader.exec_module(libboks)
+	else:
+		import imp
+		libboks = imp.load_source('libboks', path)
+except:
+	import libboks
+
+# The photodiode is button 8, all other buttons are response buttons
+photodiode = 8
+response_buttons = list(range(1, 8))
+
+# The tables that are produced by the summary functions
+button_summary_dtype = np.dtype([('button', 'u1'), ('n_presses', 'i8'),
+	('n_responses', 'i8'), ('n_errors', 'i8'), ('error_rate', 'f8'),
+	('mean_rt', 'f8'), ('median_rt', 'f8'), ('sd_rt', 'f8'),
+	('mean_hold', 'f8'), ('sd_hold', 'f8')])
+session_summary_dtype = np.dtype([('path', 'U256'), ('sid', 'U6'),
+	('n_events', 'i8'), ('n_trials', 'i8'), ('n_responses', 'i8'),
+	('n_misses', 'i8'), ('n_errors', 'i8'), ('error_rate', 'f8'),
+	('mean_rt', 'f8'), ('median_rt', 'f8'), ('sd_rt', 'f8'),
+	('mean_hold', 'f8'), ('n_photodiode_onsets', 'i8')])
+
+def host_times(events, clock_sync):
+
+	"""
+	desc:
+		Converts the device timestamps of events to host time, using the
+		clock-sync parameters from the header of a session log. If the clock
+		was not synchronized, the host timestamps that were recorded with the
+		events are returned instead.
+
+	arguments:
+		events:
+			desc:	A record array of events.
+			type:	ndarray
+		clock_sync:
+			desc:	A (device_ref, host_ref, rate) tuple.
+			type:	tuple
+
+	returns:
+		desc:	An array of host timestamps in milliseconds.
+		type:	ndarray
+	"""
+
+	device_ref, host_ref, rate = clock_sync
+	if host_ref == 0:
+		return np.asarray(events['host_time'], dtype=float)
+	return host_ref + .001 * rate * device_delta(events['device_time'],
+		device_ref)
+
+def device_delta(device_time, device_ref):
+
+	"""
+	desc:
+		Computes the differences between device timestamps and reference
+		timestamps, corrected for the wrap-around of the device clock.
+
+	arguments:
+		device_time:
+			desc:	An array of device timestamps in microseconds.
+			type:	ndarray
+		device_ref:
+			desc:	A reference timestamp, or an array of reference timestamps,
+					in microseconds.
+			type:	[int, ndarray]
+
+	returns:
+		desc:	An array of differences in microseconds.
+		type:	ndarray
+	"""
+
+	dt = np.asarray(device_time, dtype=np.int64) - np.asarray(device_ref,
+		dtype=np.int64)
+	return (dt + 2**31) % 2**32 - 2**31
+
+def unreleased(events):
+
+	"""
+	desc:
+		Finds the presses that have not been released by the end of a number
+		of events.
+
+	arguments:
+		events:
+			desc:	A record array of events.
+			type:	ndarray
+
+	returns:
+		desc:	A record array with the last press of each button that is
+				still pressed.
+		type:	ndarray
+	"""
+
+	button = np.asarray(events['button'])
+	last = len(button) - 1 - np.unique(button[::-1], return_index=True)[1]
+	return events[last[np.asarray(events['edge'])[last] == \
+		libboks.edge_press]]
+
+def pair_presses(events):
+
+	"""
+	desc:
+		Pairs each press with the subsequent release of the same button, in
+		a single vectorised pass.
+
+	arguments:
+		events:
+			desc:	A record array of events.
+			type:	ndarray
+
+	returns:
+		desc:	A dict with the arrays `button`, `trial`, `press` and
+				`release` (event indices), and `hold` (the hold duration in
+				milliseconds). Presses without a release are not included.
+		type:	dict
+	"""
+
+	button = np.asarray(events['button'])
+	# A stable sort groups events by button, while keeping them in temporal
+	# order within each button.
+	order = np.argsort(button, kind='mergesort')
+	b = button[order]
+	edge = np.asarray(events['edge'])[order]
+	paired = (b[:-1] == b[1:]) & (edge[:-1] == libboks.edge_press) & \
+		(edge[1:] == libboks.edge_release)
+	press = order[:-1][paired]
+	release = order[1:][paired]
+	device_time = events['device_time']
+	return {
+		'button': button[press],
+		'trial': np.asarray(events['trial'])[press],
+		'press': press,
+		'release': release,
+		'hold': .001 * device_delta(device_time[release], device_time[press])
+		}
+
+def first_per_trial(mask, trial):
+
+	"""
+	desc:
+		Finds the first event in each trial that matches a mask.
+
+	arguments:
+		mask:
+			desc:	A boolean array that indicates which events match.
+			type:	ndarray
+		trial:
+			desc:	An array with the trial number of each event.
+			type:	ndarray
+
+	returns:
+		desc:	A (trials, indices) tuple of arrays, with one element per
+				trial that has at least one matching event.
+		type:	tuple
+	"""
+
+	i = np.nonzero(mask)[0]
+	trials, first = np.unique(trial[i], return_index=True)
+	return trials, i[first]
+
+def response_times(events, trials, clock_sync, use_photodiode=True):
+
+	"""
+	desc: |
+		Determines the first response in each trial, and its response time
+		relative to the stimulus onset.
+
+		If `use_photodiode` is True, the stimulus onset of a trial is the first
+		photodiode press of that trial, and response times are computed
+		entirely on the device clock. For trials without a photodiode onset,
+		the onset from the trial index is used, and response times are
+		computed on the host clock after applying the clock-sync correction.
+		Responses that precede the onset are ignored.
+
+	arguments:
+		events:
+			desc:	A record array of events.
+			type:	ndarray
+		trials:
+			desc:	A record array of the trial index.
+			type:	ndarray
+		clock_sync:
+			desc:	A (device_ref, host_ref, rate) tuple.
+			type:	tuple
+
+	keywords:
+		use_photodiode:
+			desc:	Indicates whether photodiode onsets should be used.
+			type:	bool
+
+	returns:
+		desc:	A dict with the arrays `trial`, `button`, `index` (the event
+				index of the response), `rt` (in milliseconds), and
+				`photodiode` (whether the onset was measured by the
+				photodiode), with one element per trial with a response.
+		type:	dict
+	"""
+
+	button = np.asarray(events['button'])
+	edge = np.asarray(events['edge'])
+	trial = np.asarray(events['trial'])
+	device_time = np.asarray(events['device_time'])
+	press = edge == libboks.edge_press
+	resp = np.nonzero(press & (button != photodiode))[0]
+	resp_trial = trial[resp]
+	# Look up the trial-index onset of the trial of each response. If a trial
+	# number occurs more than once, the last occurrence wins.
+	index_trials = np.asarray(trials['trial'])
+	last = len(index_trials) - 1 - np.unique(index_trials[::-1],
+		return_index=True)[1]
+	found, j = _match(index_trials[last], resp_trial)
+	onset_host = np.full(len(resp), np.nan)
+	onset_host[found] = np.asarray(trials['onset'])[last][j[found]]
+	rt = host_times(events[resp], clock_sync) - onset_host
+	# Look up the photodiode onset of the trial of each response
+	if use_photodiode:
+		pd_trials, pd_index = first_per_trial(press & (button == photodiode),
+			trial)
+		trial_has_pd, j = _match(pd_trials, resp_trial)
+		onset_index = np.where(trial_has_pd, pd_index[j] if len(pd_index)
+			else 0, 0)
+	else:
+		trial_has_pd = np.zeros(len(resp), dtype=bool)
+		onset_index = np.zeros(len(resp), dtype=np.int64)
+	has_pd = trial_has_pd & (resp > onset_index)
+	rt[has_pd] = .001 * device_delta(device_time[resp[has_pd]],
+		device_time[onset_index[has_pd]])
+	# Only keep the first response after the onset of each trial
+	valid = has_pd | (~trial_has_pd & (rt >= 0))
+	first_trials, first = np.unique(resp_trial[valid], return_index=True)
+	keep = np.nonzero(valid)[0][first]
+	return {
+		'trial': first_trials,
+		'button': button[resp[keep]],
+		'index': resp[keep],
+		'rt': rt[keep],
+		'photodiode': has_pd[keep]
+		}
+
+def correct_buttons(correct, trial):
+
+	"""
+	desc:
+		Looks up the correct button for a number of trials.
+
+	arguments:
+		correct:
+			desc:	A dict that maps trial numbers to correct buttons.
+			type:	dict
+		trial:
+			desc:	An array of trial numbers.
+			type:	ndarray
+
+	returns:
+		desc:	An array with the correct button for each trial, or 0 if the
+				trial is not in `correct`.
+		type:	ndarray
+	"""
+
+	keys = np.array(sorted(correct), dtype=np.int64)
+	values = np.array([correct[k] for k in keys], dtype=np.int64)
+	found, j = _match(keys, trial)
+	return np.where(found, values[j] if len(values) else 0, 0)
+
+def iter_chunks(log, chunk_size):
+
+	"""
+	desc:
+		Splits the events of a session log into chunks of approximately
+		`chunk_size` events, such that no trial is split across chunks. A
+		trial with more than `chunk_size` events is therefore a chunk by
+		itself. The chunks are views on the memory-mapped log, so that large
+		logs are processed without loading them into memory at once.
+
+	arguments:
+		log:
+			desc:	A session log.
+			type:	session_log_reader
+		chunk_size:
+			desc:	The approximate number of events per chunk.
+			type:	int
+
+	returns:
+		desc:	A generator of (events, trials) tuples.
+		type:	generator
+	"""
+
+	first_event = np.asarray(log.trials['first_event'], dtype=np.int64)
+	n = len(log.events)
+	start = 0
+	while start < n:
+		stop = min(n, start + chunk_size)
+		if stop < n:
+			# Move the boundary back to the start of a trial, or, if the
+			# chunk falls within a single trial (or before the first trial),
+			# forward to the end of it
+			k = np.searchsorted(first_event, stop, side='right') - 1
+			if k >= 0 and first_event[k] > start:
+				stop = int(first_event[k])
+			elif k+1 < len(first_event):
+				stop = int(first_event[k+1])
+			else:
+				stop = n
+		t0 = np.searchsorted(first_event, start, side='left')
+		t1 = np.searchsorted(first_event, stop, side='left')
+		yield log.events[start:stop], log.trials[t0:t1]
+		start = stop
+
+def summarize_log(path, correct=None, use_photodiode=True,
+	chunk_size=1000000):
+
+	"""
+	desc:
+		Computes per-button and per-session summaries for a session log. The
+		log is processed in chunks, so that logs that do not fit into memory
+		can be analyzed as well.
+
+	arguments:
+		path:
+			desc:	The path of a session log.
+			type:	[str, unicode]
+
+	keywords:
+		correct:
+			desc:	A dict that maps trial numbers to correct buttons, or
+					`None` if accuracy should not be determined.
+			type:	[dict, NoneType]
+		use_photodiode:
+			desc:	Indicates whether photodiode onsets should be used. See
+					[response_times].
+			type:	bool
+		chunk_size:
+			desc:	The approximate number of events per chunk.
+			type:	int
+
+	returns:
+		desc:	A (button_summary, session_summary) tuple of record arrays,
+				with the dtypes `button_summary_dtype` and
+				`session_summary_dtype`.
+		type:	tuple
+	"""
+
+	log = libboks.session_log_reader(path)
+	rts = []
+	rt_buttons = []
+	errors = []
+	holds = []
+	hold_buttons = []
+	press_counts = np.zeros(256, dtype=np.int64)
+	n_pd = 0
+	held = log.events[:0]
+	for events, trials in iter_chunks(log, chunk_size):
+		button = np.asarray(events['button'])
+		press = np.asarray(events['edge']) == libboks.edge_press
+		press_counts += np.bincount(button[press], minlength=256)
+		# Buttons that are held across trials, and thus across chunks, are
+		# paired with their release in a later chunk
+		events_held = _concatenate([held, events], events.dtype)
+		pairs = pair_presses(events_held)
+		held = unreleased(events_held)
+		holds.append(pairs['hold'])
+		hold_buttons.append(pairs['button'])
+		r = response_times(events, trials, log.clock_sync, use_photodiode)
+		rts.append(r['rt'])
+		rt_buttons.append(r['button'])
+		n_pd += int(r['photodiode'].sum())
+		if correct is not None:
+			errors.append(correct_buttons(correct, r['trial']) != r['button'])
+	rt = _concatenate(rts, float)
+	rt_button = _concatenate(rt_buttons, np.uint8)
+	hold = _concatenate(holds, float)
+	hold_button = _concatenate(hold_buttons, np.uint8)
+	error = _concatenate(errors, bool)
+	buttons = [b for b in response_buttons + [photodiode] \
+		if press_counts[b] > 0 or b in rt_button]
+	button_summary = np.zeros(len(buttons), dtype=button_summary_dtype)
+	for i, b in enumerate(buttons):
+		m = rt_button == b
+		h = hold[hold_button == b]
+		row = button_summary[i]
+		row['button'] = b
+		row['n_presses'] = press_counts[b]
+		row['n_responses'] = m.sum()
+		row['mean_rt'], row['median_rt'], row['sd_rt'] = _describe(rt[m])
+		row['mean_hold'], _, row['sd_hold'] = _describe(h)
+		if correct is not None:
+			row['n_errors'] = error[m].sum()
+			row['error_rate'] = error[m].mean() if m.any() else np.nan
+		else:
+			row['n_errors'] = -1
+			row['error_rate'] = np.nan
+	session_summary = np.zeros(1, dtype=session_summary_dtype)
+	row = session_summary[0]
+	row['path'] = path
+	row['sid'] = libboks._text(log.sid)
+	row['n_events'] = len(log.events)
+	row['n_trials'] = len(np.unique(log.trials['trial']))
+	row['n_responses'] = len(rt)
+	row['n_misses'] = row['n_trials'] - len(rt)
+	row['mean_rt'], row['median_rt'], row['sd_rt'] = _describe(rt)
+	row['mean_hold'] = _describe(hold)[0]
+	row['n_photodiode_onsets'] = n_pd
+	if correct is not None:
+		row['n_errors'] = error.sum()
+		row['error_rate'] = error.mean() if len(error) else np.nan
+	else:
+		row['n_errors'] = -1
+		row['error_rate'] = np.nan
+	return button_summary, session_summary
+
+def summarize_logs(paths, correct=None, use_photodiode=True, processes=None):
+
+	"""
+	desc:
+		Computes the session summaries for multiple session logs, optionally
+		using a pool of worker processes.
+
+	arguments:
+		paths:
+			desc:	A list of paths of session logs.
+			type:	list
+
+	keywords:
+		correct:
+			desc:	A dict that maps trial numbers to correct buttons, or
+					`None` if accuracy should not be determined. The same
+					mapping is used for all logs.
+			type:	[dict, NoneType]
+		use_photodiode:
+			desc:	Indicates whether photodiode onsets should be used. See
+					[response_times].
+			type:	bool
+		processes:
+			desc:	The number of worker processes, or `None` to analyze all
+					logs in the current process.
+			type:	[int, NoneType]
+
+	returns:
+		desc:	A record array with one row per log, with the dtype
+				`session_summary_dtype`.
+		type:	ndarray
+	"""
+
+	args = [(path, correct, use_photodiode) for path in paths]
+	if processes is None:
+		results = [_summarize_session(a) for a in args]
+	else:
+		import multiprocessing
+		pool = multiprocessing.Pool(processes)
+		try:
+			results = pool.map(_summarize_session, args)
+		finally:
+			pool.close()
+			pool.join()
+	if len(results) == 0:
+		return np.zeros(0, dtype=session_summary_dtype)
+	return np.concatenate(results)
+
+def markdown_table(table):
+
+	"""
+	desc:
+		Formats a summary table as a Markdown table, in the same format as the
+		test report of the Boks test suite.
+
+	arguments:
+		table:
+			desc:	A record array.
+			type:	ndarray
+
+	returns:
+		desc:	A Markdown table.
+		type:	str
+	"""
+
+	names = table.dtype.names
+	lines = ['|' + '|'.join(['*%s*' % name for name in names]) + '|']
+	for row in table:
+		cells = []
+		for name in names:
+			value = row[name]
+			if isinstance(value, (float, np.floating)):
+				cells.append('%.2f' % value)
+			else:
+				cells.append('%s' % value)
+		lines.append('|' + '|'.join(cells) + '|')
+	return '\n'.join(lines) + '\n'
+
+def _summarize_session(args):
+
+	"""
+	visible:
+		False
+
+	desc:
+		Computes the session summary of a single log. This is a module-level
+		function, so that it can be used by a process pool.
+
+	arguments:
+		args:
+			desc:	A (path, correct, use_photodiode) tuple.
+			type:	tuple
+
+	returns:
+		desc:	A record array with a single row.
+		type:	ndarray
+	"""
+
+	path, correct, use_photodiode = args
+	return summarize_log(path, correct, use_photodiode)[1]
+
+def _match(keys, query):
+
+	"""
+	visible:
+		False
+
+	desc:
+		Looks up values in a sorted array of unique keys.
+
+	returns:
+		desc:	A (found, j) tuple, where `found` indicates whether each value
+				is in `keys`, and `j` is its position in `keys` (0 if it was
+				not found).
+		type:	tuple
+	"""
+
+	if len(keys) == 0:
+		return np.zeros(len(query), dtype=bool), np.zeros(len(query),
+			dtype=np.int64)
+	j = np.minimum(np.searchsorted(keys, query), len(keys)-1)
+	found = keys[j] == query
+	return found, np.where(found, j, 0)
+
+def _concatenate(arrays, dtype):
+
+	"""
+	visible:
+		False
+
+	desc:
+		Concatenates a list of arrays, which may be empty.
+	"""
+
+	if len(arrays) == 0:
+		return np.zeros(0, dtype=dtype)
+	return np.concatenate(arrays).astype(dtype)
+
+def _describe(a):
+
+	"""
+	visible:
+		False
+
+	desc:
+		Gets the mean, median, and standard deviation of an array, ignoring
+		NaNs, or NaNs if the array contains no other values.
+	"""
+
+	a = a[~np.isnan(a)]
+	if len(a) == 0:
+		return np.nan, np.nan, np.nan
+	return a.mean(), np.median(a), a.std()
@@ -17,51 +17,3261 @@ You should have received a copy of the GNU General Public License
 along with Boks.  If not, see <http://www.gnu.org/licenses/>.
 """
 
+import collections
+import ctypes
+import ctypes.util
+import functools
+import glob
+import json
 import os
+import platform
+import random
+import re
 import serial
+import socket
 import struct
+import threading
 import time
+import warnings
+try:
+	import queue
+except ImportError:
+	import Queue as queue
+try:
+	from serial.tools import list_ports
+except ImportError:
+	list_ports = None
+
+def _byte(i):
+
+	"""
+	visible:
+		False
+
+	desc:
+		Converts an integer to a single byte, which is a `str` in Python 2 and
+		`bytes` in Python 3.
+	"""
+
+	return struct.pack('B', i)
 
 # The command byes that are used to communicate with the Arduino
-CMD_RESET			= chr(1)
-CMD_IDENTIFY 		= chr(2)
-CMD_WAIT_PRESS 		= chr(3)
-CMD_WAIT_RELEASE 	= chr(4)
-CMD_WAIT_SLEEP		= chr(5)
-CMD_BUTTON_STATE	= chr(6)
-CMD_SET_T1			= chr(7)
-CMD_SET_T2			= chr(8)
-CMD_SET_TIMEOUT		= chr(9)
-CMD_SET_BUTTONS		= chr(10)
-CMD_SET_CONTINUOUS	= chr(11)
-CMD_GET_T1			= chr(12)
-CMD_GET_T2			= chr(13)
-CMD_GET_TD			= chr(14)
-CMD_GET_TIME		= chr(15)
-CMD_GET_TIMEOUT		= chr(16)
-CMD_GET_BUTTONS		= chr(17)
-CMD_LED_ON			= chr(18)
-CMD_LED_OFF			= chr(19)
-CMD_GET_BTNCNT		= chr(20)
-CMD_GET_SID			= chr(21)
-CMD_LINK_LED		= chr(22)
+CMD_RESET			= _byte(1)
+CMD_IDENTIFY 		= _byte(2)
+CMD_WAIT_PRESS 		= _byte(3)
+CMD_WAIT_RELEASE 	= _byte(4)
+CMD_WAIT_SLEEP		= _byte(5)
+CMD_BUTTON_STATE	= _byte(6)
+CMD_SET_T1			= _byte(7)
+CMD_SET_T2			= _byte(8)
+CMD_SET_TIMEOUT		= _byte(9)
+CMD_SET_BUTTONS		= _byte(10)
+CMD_SET_CONTINUOUS	= _byte(11)
+CMD_GET_T1			= _byte(12)
+CMD_GET_T2			= _byte(13)
+CMD_GET_TD			= _byte(14)
+CMD_GET_TIME		= _byte(15)
+CMD_GET_TIMEOUT		= _byte(16)
+CMD_GET_BUTTONS		= _byte(17)
+CMD_LED_ON			= _byte(18)
+CMD_LED_OFF			= _byte(19)
+CMD_GET_BTNCNT		= _byte(20)
+CMD_GET_SID			= _byte(21)
+CMD_LINK_LED		= _byte(22)
+CMD_SCHEDULE_LED	= _byte(23)
+CMD_GET_LED			= _byte(24)
+CMD_WAIT_LATCHED	= _byte(25)
+CMD_CANCEL_WAIT		= _byte(26)
+CMD_SET_PUSH		= _byte(27)
+CMD_MEASURE_LATENCY	= _byte(28)
+
+# Modes for CMD_SCHEDULE_LED
+led_absolute = 0
+led_relative_t1 = 1
+
+# Flags for CMD_WAIT_LATCHED, and the reply when no photodiode edge occurred
+latch_release = 1
+latch_offset = 2
+no_onset = 0xffffffff
+latch_edges = [u'onset', u'offset']
+
+version = '1.0.2'
+baudrate = 115200
+# The USB vendor IDs of Arduino boards, on which the Boks is built
+arduino_vendor_ids = [0x2341, 0x2a03]
+wait_strategies = [u'block', u'poll', u'hybrid']
+calibration_dir = os.path.join(os.path.expanduser('~'), '.boks',
+	'calibration')
+calibration_max_age = 30 # days
+button_timeout = 255
+button_cancelled = 254
+# Returned instead of a button when a wait is cancelled with cancel_wait()
+cancelled = u'cancelled'
+# While pushing is enabled, the Boks sends push packets (push_state, followed by
+# the button state and the device time) and frames replies (reply_frame,
+# followed by the length and the reply)
+push_state = 0xfe
+reply_frame = 0xfd
+push_struct = struct.Struct('<BI')
+# The maximum number of measurements per CMD_MEASURE_LATENCY
+latency_batch = 65535
+all_buttons = [] # Except the photodiode, which is button 8
+firmware_version_length = 5
+# The oldest firmware that supports scheduled LED pulses
+extended_firmware_version = '1.1.0'
+model_length = 16
+sid_length = 6
+
+# The edges that are reported in button events
+edge_release = 0
+edge_press = 1
+
+# A timestamped button event, as published to event listeners. The device time
+# is the Arduino micros() timestamp, the host time is in milliseconds.
+boks_event = collections.namedtuple('boks_event', ['button', 'edge',
+	'device_time', 'host_time', 'sid'])
+# The fixed-size binary representation of a boks_event
+event_struct = struct.Struct('<BBxxId6sxx')
+
+# The layout of the shared-memory event ring buffer: a header, followed by
+# slots that consist of a sequence number and a packed event.
+ring_magic = b'BOKS'
+ring_version = 1
+ring_header_struct = struct.Struct('<4sHHI4xQ8x')
+ring_head_offset = 16
+ring_seq_struct = struct.Struct('<Q')
+ring_slot_size = ring_seq_struct.size + event_struct.size
+
+# The layout of the datagrams that are sent by the event socket publisher: a
+# header, followed by one or more packed events.
+socket_magic = b'BE'
+socket_version = 1
+socket_header_struct = struct.Struct('<2sBBII')
+
+# The layout of serial-traffic capture files: a header, followed by records
+# that consist of a record header and the bytes that were written or read.
+capture_magic = b'BOKSCAP'
+capture_version = 1
+capture_header_struct = struct.Struct('<7sBd')
+capture_record_struct = struct.Struct('<dBH')
+capture_write = 0
+capture_read = 1
+capture_gap = 2
+# A high-resolution clock for timestamping serial traffic
+capture_clock = getattr(time, 'perf_counter', time.time)
+
+# The number of argument bytes of the commands that have arguments, as read by
+# an emulated_transport
+emulator_arguments = {
+	ord(CMD_SET_TIMEOUT): 4,
+	ord(CMD_SET_BUTTONS): 1,
+	ord(CMD_SET_CONTINUOUS): 1,
+	ord(CMD_SCHEDULE_LED): 14,
+	ord(CMD_WAIT_LATCHED): 1,
+	ord(CMD_SET_PUSH): 1,
+	ord(CMD_MEASURE_LATENCY): 3,
+	}
+# The duration of a press that is scripted without a duration, in microseconds.
+# This is about nine years, which can still be waited for without overflowing
+# the timeout of a lock.
+emulator_forever = 1 << 48
+
+# The layout of session logs: a header, followed by fixed-width event records.
+# The trial index is stored in a separate file, with the extension
+# `log_trials_ext`, that consists of fixed-width trial records.
+log_magic = b'BOKSLOG'
+log_version = 1
+log_header_struct = struct.Struct('<7sBH6s8s16sdddd')
+log_header_size = 128
+log_event_struct = struct.Struct('<IBBxxI4xd')
+log_trial_struct = struct.Struct('<I4xQd')
+log_trials_ext = '.trials'
+
+# A period during which the connection to the Boks was lost, as recorded by
+# [libboks.reconnect]
+boks_outage = collections.namedtuple('boks_outage', ['start', 'end', 'port'])
+
+# Pre-encoded button and timeout settings, as created by [compile_settings]
+settings_packet = collections.namedtuple('settings_packet', ['buttons',
+	'timeout', 'data'])
+
+class boks_exception(Exception):
+
+	"""
+	desc:
+		A custom Exception class for nice error messages.
+	"""
+
+	pass
+
+class boks_connection_error(boks_exception):
+
+	"""
+	desc:
+		Is raised when the connection to the Boks is lost, or when the Boks
+		does not reply in time.
+	"""
+
+	pass
+
+class command_future(object):
+
+	"""
+	desc:
+		The pending result of a command that has been submitted to a
+		[command_executor]. This is returned by commands that are issued with
+		`block=False`.
+	"""
+
+	def __init__(self):
+
+		"""
+		desc:
+			Constructor.
+		"""
+
+		self._event = threading.Event()
+		self._result = None
+		self._exception = None
+
+	def done(self):
+
+		"""
+		desc:
+			Checks whether the command has been executed.
+
+		returns:
+			desc:	True if the command has finished, False otherwise.
+			type:	bool
+		"""
+
+		return self._event.is_set()
+
+	def result(self, timeout=None):
+
+		"""
+		desc:
+			Waits for the command to finish and returns its result. If the
+			command raised an Exception, this Exception is raised again here.
+
+		keywords:
+			timeout:
+				desc:	A timeout in seconds, or `None` to wait indefinitely.
+				type:	[float, int, NoneType]
+
+		returns:
+			desc:	The return value of the command.
+		"""
+
+		if not self._event.wait(timeout):
+			raise boks_exception('Timed out while waiting for a boks command')
+		if self._exception is not None:
+			raise self._exception
+		return self._result
+
+	def set_exception(self, exception):
+
+		"""
+		visible:
+			False
+
+		desc:
+			Marks the command as failed.
+
+		arguments:
+			exception:
+				desc:	The Exception that was raised by the command.
+				type:	Exception
+		"""
+
+		self._exception = exception
+		self._event.set()
+
+	def set_result(self, result):
+
+		"""
+		visible:
+			False
+
+		desc:
+			Marks the command as finished.
+
+		arguments:
+			result:
+				desc:	The return value of the command.
+		"""
+
+		self._result = result
+		self._event.set()
+
+class command_executor(threading.Thread):
+
+	"""
+	desc:
+		A thread that owns the serial port of a single Boks, and executes
+		commands one at a time in the order in which they were submitted. This
+		makes sure that the request and reply bytes of commands that are issued
+		from different threads never interleave.
+	"""
+
+	def __init__(self, msg):
+
+		"""
+		desc:
+			Constructor. The thread is started right away.
+
+		arguments:
+			msg:
+				desc:	A function to print debugging messages.
+				type:	function
+		"""
+
+		threading.Thread.__init__(self, name='libboks-executor')
+		self.daemon = True
+		self.msg = msg
+		self._queue = queue.Queue()
+		self._lock = threading.Lock()
+		self._stopped = False
+		self.busy = False
+		self.start()
+
+	def idle(self):
+
+		"""
+		desc:
+			Checks whether the executor is idle, that is, whether no command is
+			being executed or waiting for execution.
+
+		returns:
+			desc:	True if the executor is idle, False otherwise.
+			type:	bool
+		"""
+
+		return not self.busy and self._queue.empty()
+
+	def run(self):
+
+		"""
+		visible:
+			False
+
+		desc:
+			Executes submitted commands until the executor is stopped.
+		"""
+
+		while True:
+			item = self._queue.get()
+			if item is None:
+				break
+			future, func, args, kwargs = item
+			self.busy = True
+			try:
+				future.set_result(func(*args, **kwargs))
+			except Exception as e:
+				self.msg('command %s failed: %s' % (func.__name__, e))
+				future.set_exception(e)
+			self.busy = False
+
+	def stop(self, timeout=None):
+
+		"""
+		desc:
+			Stops the executor after all commands that have already been
+			submitted have been executed.
+
+		keywords:
+			timeout:
+				desc:	The maximum time in seconds to wait for the executor
+						to finish, or `None` to wait indefinitely.
+				type:	[float, int, NoneType]
+
+		returns:
+			desc:	True if the executor has finished, False if it is still
+					executing a command after the timeout.
+			type:	bool
+		"""
+
+		with self._lock:
+			if not self._stopped:
+				self._stopped = True
+				self._queue.put(None)
+		if threading.current_thread() is not self:
+			self.join(timeout)
+		return not self.is_alive()
+
+	def submit(self, func, *args, **kwargs):
+
+		"""
+		desc:
+			Schedules a command for execution.
+
+		arguments:
+			func:
+				desc:	The function that executes the command.
+				type:	function
+
+		argument-list:
+			args:	Arguments that are passed to `func`.
+
+		keyword-dict:
+			kwargs:	Keywords that are passed to `func`.
+
+		returns:
+			desc:	A future for the result of `func`.
+			type:	command_future
+		"""
+
+		future = command_future()
+		with self._lock:
+			if self._stopped:
+				raise boks_exception('The boks has been closed')
+			self._queue.put((future, func, args, kwargs))
+		return future
+
+class boks_watchdog(threading.Thread):
+
+	"""
+	desc:
+		A thread that checks the connection to a Boks. Whenever there has been
+		no contact with the Boks for a while, and no command is being
+		executed, a heartbeat request is sent. If the heartbeat fails, the
+		Boks reconnects (see [libboks.reconnect]). Heartbeats are never sent
+		while a response is being collected.
+	"""
+
+	def __init__(self, boks, interval=1000):
+
+		"""
+		desc:
+			Constructor. The thread is started right away.
+
+		arguments:
+			boks:
+				desc:	The Boks to check.
+				type:	libboks
+
+		keywords:
+			interval:
+				desc:	The maximum time without contact (in milliseconds)
+						before a heartbeat is sent.
+				type:	[int, float]
+		"""
+
+		threading.Thread.__init__(self, name='libboks-watchdog')
+		self.daemon = True
+		self.boks = boks
+		self.interval = interval
+		self._stop_event = threading.Event()
+		self.start()
+
+	def run(self):
+
+		"""
+		visible:
+			False
+
+		desc:
+			Sends heartbeats until the watchdog is stopped.
+		"""
+
+		while not self._stop_event.wait(.001 * self.interval):
+			boks = self.boks
+			if not boks.executor.idle():
+				continue
+			if boks.last_contact != None and \
+				boks.time() - boks.last_contact < self.interval:
+				continue
+			try:
+				boks.heartbeat(block=False)
+			except boks_exception:
+				# The boks has been closed in the meantime
+				break
+
+	def stop(self):
+
+		"""
+		desc:
+			Stops the watchdog.
+		"""
+
+		self._stop_event.set()
+		if threading.current_thread() is not self:
+			self.join()
+
+def serialised(method):
+
+	"""
+	desc:
+		A decorator that makes sure that a libboks method is executed by the
+		command executor of the Boks, so that it can be safely called from any
+		thread. If the method is called with `block=False`, it is scheduled for
+		execution and a [command_future] is returned right away.
+
+	arguments:
+		method:
+			desc:	The method to decorate.
+			type:	function
+
+	returns:
+		desc:	The decorated method.
+		type:	function
+	"""
+
+	# Reconnect and retry if the connection is lost (see libboks.guarded)
+	@functools.wraps(method)
+	def guarded(self, *args, **kwargs):
+		return self.guarded(method, self, *args, **kwargs)
+
+	@functools.wraps(method)
+	def inner(self, *args, **kwargs):
+		if kwargs.get('block', True):
+			return self.execute(guarded, self, *args, **kwargs)
+		return self.submit(guarded, self, *args, **kwargs)
+	return inner
+
+def pack_event(event):
+
+	"""
+	desc:
+		Converts an event to its fixed-size binary representation.
+
+	arguments:
+		event:
+			desc:	An event.
+			type:	boks_event
+
+	returns:
+		desc:	A string of `event_struct.size` bytes.
+		type:	str
+	"""
+
+	return event_struct.pack(event.button, event.edge, event.device_time,
+		event.host_time, event.sid)
+
+def unpack_event(s, offset=0):
+
+	"""
+	desc:
+		Converts the binary representation of an event back to an event.
+
+	arguments:
+		s:
+			desc:	A buffer that contains a packed event.
+			type:	[str, buffer]
+
+	keywords:
+		offset:
+			desc:	The position of the event in the buffer.
+			type:	int
+
+	returns:
+		desc:	An event.
+		type:	boks_event
+	"""
+
+	button, edge, device_time, host_time, sid = event_struct.unpack_from(s,
+		offset)
+	return boks_event(button, edge, device_time, host_time, sid)
+
+class event_ring_writer(object):
+
+	"""
+	desc: |
+		Publishes events into a ring buffer in shared memory, from which they
+		can be read by any number of other processes on the same computer,
+		using an [event_ring_reader]. There is a single writer, which never
+		waits for readers; readers that fall behind by more than the capacity
+		of the ring buffer lose the oldest events.
+
+		The shared-memory block starts with a header (see `ring_header_struct`)
+		that contains the total number of events that have been written. This
+		is followed by fixed-size slots, each of which consists of a sequence
+		number followed by a packed event. A slot's sequence number is set to
+		zero while the slot is being written, so that readers can detect torn
+		reads without taking a lock.
+
+		Requires Python 3.8 or later.
+
+		__Example__:
+
+		~~~ {.python}
+		exp.boks.add_listener(libboks.event_ring_writer('boks_events'))
+		~~~
+	"""
+
+	def __init__(self, name, capacity=4096):
+
+		"""
+		desc:
+			Constructor. Creates the shared-memory block, replacing a stale
+			block with the same name if necessary.
+
+		arguments:
+			name:
+				desc:	The name of the shared-memory block.
+				type:	str
+
+		keywords:
+			capacity:
+				desc:	The number of events that fit in the ring buffer.
+				type:	int
+		"""
+
+		shared_memory = _import_shared_memory()
+		size = ring_header_struct.size + capacity * ring_slot_size
+		try:
+			self.shm = shared_memory.SharedMemory(name, create=True, size=size)
+		except OSError:
+			stale = shared_memory.SharedMemory(name)
+			stale.close()
+			stale.unlink()
+			self.shm = shared_memory.SharedMemory(name, create=True, size=size)
+		self.name = name
+		self.capacity = capacity
+		self.seq = 0
+		ring_header_struct.pack_into(self.shm.buf, 0, ring_magic,
+			ring_version, ring_slot_size, capacity, 0)
+
+	def close(self):
+
+		"""
+		desc:
+			Closes and removes the shared-memory block.
+		"""
+
+		self.shm.close()
+		self.shm.unlink()
+
+	def publish(self, event):
+
+		"""
+		desc:
+			Writes an event into the ring buffer.
+
+		arguments:
+			event:
+				desc:	An event.
+				type:	boks_event
+		"""
+
+		seq = self.seq + 1
+		offset = ring_header_struct.size + ((seq-1) % self.capacity) * \
+			ring_slot_size
+		buf = self.shm.buf
+		ring_seq_struct.pack_into(buf, offset, 0)
+		event_struct.pack_into(buf, offset+ring_seq_struct.size, event.button,
+			event.edge, event.device_time, event.host_time, event.sid)
+		ring_seq_struct.pack_into(buf, offset, seq)
+		ring_seq_struct.pack_into(buf, ring_head_offset, seq)
+		self.seq = seq
+
+class event_ring_reader(object):
+
+	"""
+	desc: |
+		Reads events from a ring buffer in shared memory that is published by
+		an [event_ring_writer], typically in another process. Reading never
+		blocks the writer.
+
+		__Example__:
+
+		~~~ {.python}
+		reader = event_ring_reader('boks_events')
+		while True:
+			for event in reader.read():
+				print(event.button, event.device_time)
+		~~~
+	"""
+
+	def __init__(self, name, from_start=False):
+
+		"""
+		desc:
+			Constructor. Attaches to an existing shared-memory block.
+
+		arguments:
+			name:
+				desc:	The name of the shared-memory block.
+				type:	str
+
+		keywords:
+			from_start:
+				desc:	Indicates whether events that are still in the ring
+						buffer should be read as well, or only events that are
+						published after the reader attaches.
+				type:	bool
+		"""
+
+		shared_memory = _import_shared_memory()
+		try:
+			self.shm = shared_memory.SharedMemory(name, track=False)
+		except TypeError:
+			# Before Python 3.13, attaching registers the block with the
+			# resource tracker, which would remove it when this process exits.
+			from multiprocessing import resource_tracker
+			self.shm = shared_memory.SharedMemory(name)
+			resource_tracker.unregister(self.shm._name, 'shared_memory')
+		magic, fmt_version, slot_size, capacity, head = \
+			ring_header_struct.unpack_from(self.shm.buf, 0)
+		if magic != ring_magic or fmt_version != ring_version or \
+			slot_size != ring_slot_size:
+			self.shm.close()
+			raise boks_exception( \
+				'%s is not a compatible boks event buffer' % name)
+		self.name = name
+		self.capacity = capacity
+		self.lost = 0
+		if from_start:
+			self.next_seq = max(1, head-capacity+1)
+		else:
+			self.next_seq = head+1
+
+	def close(self):
+
+		"""
+		desc:
+			Detaches from the shared-memory block.
+		"""
+
+		self.shm.close()
+
+	def read(self):
+
+		"""
+		desc:
+			Reads all events that have been published since the last call to
+			`read()`. Events that have been overwritten before they could be
+			read are counted in the `lost` property.
+
+		returns:
+			desc:	A list of events.
+			type:	list
+		"""
+
+		buf = self.shm.buf
+		head = ring_seq_struct.unpack_from(buf, ring_head_offset)[0]
+		if head - self.next_seq >= self.capacity:
+			oldest = head - self.capacity + 1
+			self.lost += oldest - self.next_seq
+			self.next_seq = oldest
+		events = []
+		while self.next_seq <= head:
+			seq = self.next_seq
+			offset = ring_header_struct.size + ((seq-1) % self.capacity) * \
+				ring_slot_size
+			seq1 = ring_seq_struct.unpack_from(buf, offset)[0]
+			event = unpack_event(buf, offset+ring_seq_struct.size)
+			seq2 = ring_seq_struct.unpack_from(buf, offset)[0]
+			if seq1 == seq and seq2 == seq:
+				events.append(event)
+			else:
+				# The slot was overwritten while we were reading it
+				self.lost += 1
+			self.next_seq += 1
+		return events
+
+class event_socket_publisher(object):
+
+	"""
+	desc: |
+		Streams events to external acquisition software over a local socket.
+		If the address is a string, it is interpreted as the path of a
+		Unix-domain datagram socket. If it is a `(host, port)` tuple, events
+		are sent as UDP datagrams.
+
+		Events are put in a bounded queue and sent by a background thread, so
+		publishing never blocks response collection. When events arrive faster
+		than they can be sent, they are combined into a single datagram of at
+		most `max_batch` events. Events that do not fit in the queue, or that
+		cannot be delivered, are dropped and counted in the `dropped` property.
+
+		Each datagram consists of a header (see `socket_header_struct`) with
+		the number of events, the sequence number of the first event, and the
+		total number of dropped events, followed by the packed events. Only
+		events that have been sent get a sequence number, so that a gap in
+		the sequence indicates events that were lost in transit, rather than
+		dropped by the publisher. Use an [event_socket_subscriber] to receive
+		the events.
+
+		__Example__:
+
+		~~~ {.python}
+		exp.boks.add_listener(libboks.event_socket_publisher( \
+			('127.0.0.1', 5555)))
+		~~~
+	"""
+
+	def __init__(self, address, max_batch=64, queue_size=4096):
+
+		"""
+		desc:
+			Constructor. The sender thread is started right away.
+
+		arguments:
+			address:
+				desc:	A socket path or a (host, port) tuple.
+				type:	[str, tuple]
+
+		keywords:
+			max_batch:
+				desc:	The maximum number of events per datagram.
+				type:	int
+			queue_size:
+				desc:	The maximum number of events that are waiting to be
+						sent.
+				type:	int
+		"""
+
+		if max_batch > 255:
+			raise boks_exception('max_batch should be at most 255')
+		self.address = address
+		self.max_batch = max_batch
+		self.sock = _event_socket(address)
+		self.queue = queue.Queue(queue_size)
+		self.seq = 0
+		self.sent = 0
+		self.dropped = 0
+		# Events are dropped by the thread that publishes them and by the
+		# sender thread
+		self.lock = threading.Lock()
+		self.thread = threading.Thread(target=self._send_events,
+			name='libboks-socket-publisher')
+		self.thread.daemon = True
+		self.thread.start()
+
+	def _send_events(self):
+
+		"""
+		visible:
+			False
+
+		desc:
+			Sends queued events in batches until the publisher is closed.
+		"""
+
+		while True:
+			event = self.queue.get()
+			if event is None:
+				break
+			batch = [event]
+			while len(batch) < self.max_batch:
+				try:
+					event = self.queue.get_nowait()
+				except queue.Empty:
+					break
+				if event is None:
+					self.queue.put(None)
+					break
+				batch.append(event)
+			with self.lock:
+				dropped = self.dropped
+			data = socket_header_struct.pack(socket_magic, socket_version,
+				len(batch), self.seq, dropped) + b''.join(batch)
+			try:
+				self.sock.sendto(data, self.address)
+			except socket.error:
+				# Nobody is listening, or the receiver cannot keep up
+				with self.lock:
+					self.dropped += len(batch)
+				continue
+			self.seq += len(batch)
+			self.sent += len(batch)
+
+	def close(self):
+
+		"""
+		desc:
+			Sends all events that are still queued and closes the socket.
+		"""
+
+		while True:
+			try:
+				self.queue.put_nowait(None)
+				break
+			except queue.Full:
+				time.sleep(.001)
+		self.thread.join()
+		self.sock.close()
+
+	def publish(self, event):
+
+		"""
+		desc:
+			Queues an event for sending. This never blocks.
+
+		arguments:
+			event:
+				desc:	An event.
+				type:	boks_event
+		"""
+
+		try:
+			self.queue.put_nowait(pack_event(event))
+		except queue.Full:
+			with self.lock:
+				self.dropped += 1
+
+class event_socket_subscriber(object):
+
+	"""
+	desc: |
+		Receives events that are streamed by an [event_socket_publisher].
+
+		__Example__:
+
+		~~~ {.python}
+		subscriber = event_socket_subscriber(('127.0.0.1', 5555))
+		while True:
+			for event in subscriber.read():
+				print(event.button, event.device_time)
+		~~~
+	"""
+
+	def __init__(self, address):
+
+		"""
+		desc:
+			Constructor. Binds to the address, replacing a stale Unix-domain
+			socket if necessary.
+
+		arguments:
+			address:
+				desc:	A socket path or a (host, port) tuple.
+				type:	[str, tuple]
+		"""
+
+		self.address = address
+		self.sock = _event_socket(address)
+		if not isinstance(address, tuple) and os.path.exists(address):
+			os.remove(address)
+		self.sock.bind(address)
+		self.next_seq = None
+		self.lost = 0
+		self.dropped = 0
+
+	def close(self):
+
+		"""
+		desc:
+			Closes the socket.
+		"""
+
+		self.sock.close()
+		if not isinstance(self.address, tuple) and \
+			os.path.exists(self.address):
+			os.remove(self.address)
+
+	def read(self, timeout=None):
+
+		"""
+		desc:
+			Receives a single datagram. Events that were lost in transit are
+			counted in the `lost` property, and events that were dropped by the
+			publisher are counted in the `dropped` property. No event is
+			counted in both.
+
+		keywords:
+			timeout:
+				desc:	A timeout in seconds, or `None` to wait indefinitely.
+				type:	[float, int, NoneType]
+
+		returns:
+			desc:	A list of events, which is empty if a timeout occurred.
+			type:	list
+		"""
+
+		self.sock.settimeout(timeout)
+		try:
+			data = self.sock.recv(65536)
+		except socket.timeout:
+			return []
+		magic, fmt_version, count, seq, dropped = \
+			socket_header_struct.unpack_from(data)
+		if magic != socket_magic or fmt_version != socket_version:
+			raise boks_exception('Received an incompatible boks datagram')
+		if self.next_seq is not None and seq > self.next_seq:
+			self.lost += seq - self.next_seq
+		self.next_seq = seq + count
+		self.dropped = dropped
+		return [unpack_event(data, socket_header_struct.size + \
+			i * event_struct.size) for i in range(count)]
+
+def _event_socket(address):
+
+	"""
+	visible:
+		False
+
+	desc:
+		Creates a datagram socket for an event socket address.
+
+	arguments:
+		address:
+			desc:	A socket path or a (host, port) tuple.
+			type:	[str, tuple]
+
+	returns:
+		desc:	A datagram socket.
+		type:	socket
+	"""
+
+	if isinstance(address, tuple):
+		return socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+	return socket.socket(socket.AF_UNIX, socket.SOCK_DGRAM)
+
+class capture_transport(object):
+
+	"""
+	desc: |
+		Wraps a serial port and records every byte that is written to or read
+		from it, with a high-resolution timestamp, in an append-only binary
+		capture file. The file is written by a background thread, so that
+		capturing does not slow down communication. To keep memory usage
+		bounded, at most `max_queue` records are waiting to be written; if the
+		background thread falls behind, records are dropped and a gap record is
+		written to the file instead.
+
+		A capture can be read back with [read_capture], and replayed with a
+		[replay_transport].
+
+		__Example__:
+
+		~~~ {.python}
+		b = libboks(capture='session.bokscap')
+		~~~
+	"""
+
+	def __init__(self, dev, path, max_queue=65536):
+
+		"""
+		desc:
+			Constructor.
+
+		arguments:
+			dev:
+				desc:	The serial port to wrap.
+				type:	Serial
+			path:
+				desc:	The path of the capture file. If the file exists, the
+						capture is appended to it.
+				type:	[str, unicode]
+
+		keywords:
+			max_queue:
+				desc:	The maximum number of records that are waiting to be
+						written.
+				type:	int
+		"""
+
+		self.dev = dev
+		self.path = path
+		self.dropped = 0
+		self.queue = queue.Queue(max_queue)
+		self.fd = open(path, 'ab')
+		self.t0 = capture_clock()
+		self.fd.write(capture_header_struct.pack(capture_magic,
+			capture_version, time.time()))
+		self.thread = threading.Thread(target=self._write_records,
+			name='libboks-capture')
+		self.thread.daemon = True
+		self.thread.start()
+
+	def _record(self, t, direction, data):
+
+		"""
+		visible:
+			False
+
+		desc:
+			Queues a record for writing. This never blocks.
+
+		arguments:
+			t:
+				desc:	A timestamp from `capture_clock()`.
+				type:	float
+			direction:
+				desc:	`capture_write` or `capture_read`.
+				type:	int
+			data:
+				desc:	The bytes that were written or read.
+				type:	str
+		"""
+
+		try:
+			self.queue.put_nowait((t-self.t0, direction, data))
+		except queue.Full:
+			self.dropped += 1
+
+	def _write_records(self):
+
+		"""
+		visible:
+			False
+
+		desc:
+			Writes queued records to the capture file until the transport is
+			closed.
+		"""
+
+		dropped = 0
+		while True:
+			record = self.queue.get()
+			if record is None:
+				break
+			t, direction, data = record
+			if self.dropped != dropped:
+				dropped = self.dropped
+				self.fd.write(capture_record_struct.pack(t, capture_gap, 0))
+			self.fd.write(capture_record_struct.pack(t, direction, len(data)))
+			self.fd.write(data)
+		self.fd.close()
+
+	def close(self):
+
+		"""
+		desc:
+			Closes the serial port, and finishes writing the capture file.
+		"""
+
+		self.dev.close()
+		self.queue.put(None)
+		self.thread.join()
+
+	def inWaiting(self):
+
+		"""See Serial."""
+
+		return self.dev.inWaiting()
+
+	def read(self, size=1):
+
+		"""See Serial."""
+
+		data = self.dev.read(size)
+		if data:
+			self._record(capture_clock(), capture_read, data)
+		return data
+
+	@property
+	def timeout(self):
+
+		"""See Serial."""
+
+		return self.dev.timeout
+
+	@timeout.setter
+	def timeout(self, timeout):
+
+		self.dev.timeout = timeout
+
+	def write(self, data):
+
+		"""See Serial."""
+
+		t = capture_clock()
+		self.dev.write(data)
+		self._record(t, capture_write, data)
+
+def read_capture(path):
+
+	"""
+	desc:
+		Reads a capture file that has been written by a [capture_transport].
+		Records are read one at a time, so that large captures do not need to
+		fit in memory. If a capture has been appended to, the header of each
+		subsequent capture is skipped, and its timestamps are offset so that
+		they continue to increase.
+
+	arguments:
+		path:
+			desc:	The path of the capture file.
+			type:	[str, unicode]
+
+	returns:
+		desc:	A generator of (timestamp, direction, data) tuples, where the
+				timestamp is in seconds since the start of the capture, and
+				direction is `capture_write`, `capture_read`, or `capture_gap`.
+		type:	generator
+	"""
+
+	with open(path, 'rb') as fd:
+		offset = 0
+		t = 0
+		while True:
+			s = fd.read(capture_record_struct.size)
+			if len(s) < capture_record_struct.size:
+				# The end of the file, or a partially written record
+				break
+			if s.startswith(capture_magic):
+				s += fd.read(capture_header_struct.size - len(s))
+				magic, fmt_version, start_time = \
+					capture_header_struct.unpack(s)
+				if fmt_version != capture_version:
+					raise boks_exception('%s is not a compatible capture' \
+						% path)
+				offset = t
+				continue
+			t, direction, length = capture_record_struct.unpack(s)
+			t += offset
+			data = fd.read(length)
+			if len(data) < length:
+				break
+			yield t, direction, data
+
+class replay_transport(object):
+
+	"""
+	desc: |
+		Replays a capture file that has been recorded by a
+		[capture_transport], so that libboks can be run without a Boks
+		attached. Reads return the captured bytes in order, whatever libboks
+		writes. Each read is delayed by the time that elapsed between the
+		preceding write and the read in the original capture, divided by
+		`speed`, so that the timing of the device is reproduced at original or
+		accelerated speed.
+
+		In strict mode, the bytes that libboks writes must also be identical
+		to the captured bytes, so that a replay fails as soon as it diverges
+		from the capture. This only holds if libboks is set up exactly as
+		during the capture: event listeners and a debounce filter, for
+		example, make libboks send extra commands after a response. Strict
+		mode is therefore meant for regression tests that replay a capture
+		with the same code and settings.
+
+		__Example__:
+
+		~~~ {.python}
+		b = libboks(transport=replay_transport('session.bokscap', speed=10))
+		~~~
+	"""
+
+	def __init__(self, path, speed=1., strict=False):
+
+		"""
+		desc:
+			Constructor.
+
+		arguments:
+			path:
+				desc:	The path of the capture file.
+				type:	[str, unicode]
+
+		keywords:
+			speed:
+				desc:	The replay speed relative to the original, or `None`
+						to replay without any delays.
+				type:	[float, int, NoneType]
+			strict:
+				desc:	Indicates whether an Exception should be raised when
+						libboks writes other bytes than were captured, or
+						writes them in another order.
+				type:	bool
+		"""
+
+		self.path = path
+		self.speed = speed
+		self.strict = strict
+		self.timeout = None
+		self.records = read_capture(path)
+		self.expected = b''
+		self.pending = b''
+		self.delay = 0
+		self.t_write = capture_clock()
+		self.t_capture = 0
+
+	def _next_read(self):
+
+		"""
+		visible:
+			False
+
+		desc:
+			Advances to the next chunk of captured bytes that were read,
+			consuming the captured writes that precede it.
+
+		returns:
+			desc:	False if the end of the capture has been reached, True
+					otherwise.
+			type:	bool
+		"""
+
+		for t, direction, data in self.records:
+			if direction == capture_write:
+				self.expected += data
+				self.t_capture = t
+			elif direction == capture_read:
+				self.pending += data
+				self.delay = t - self.t_capture
+				self.t_capture = t
+				return True
+		return False
+
+	def close(self):
+
+		"""See Serial."""
+
+		self.records.close()
+
+	def inWaiting(self):
+
+		"""See Serial."""
+
+		if not self.pending and not self._next_read():
+			return 0
+		if self.speed and capture_clock() < self.t_write + \
+			self.delay/self.speed:
+			return 0
+		return len(self.pending)
+
+	def read(self, size=1):
+
+		"""See Serial."""
+
+		data = b''
+		while len(data) < size:
+			if not self.pending and not self._next_read():
+				break
+			if self.speed:
+				dt = self.t_write + self.delay/self.speed - capture_clock()
+				if dt > 0:
+					time.sleep(dt)
+			chunk = self.pending[:size-len(data)]
+			self.pending = self.pending[len(chunk):]
+			data += chunk
+			self.delay = 0
+		return data
+
+	def write(self, data):
+
+		"""See Serial."""
+
+		self.t_write = capture_clock()
+		if not self.strict:
+			self.expected = b''
+			return
+		while len(self.expected) < len(data):
+			if self.pending or not self._next_read():
+				break
+		if not self.expected.startswith(data):
+			raise boks_exception( \
+				'Replay diverged from capture: wrote %r, expected %r' \
+				% (data, self.expected[:len(data)]))
+		self.expected = self.expected[len(data):]
+
+class emulated_transport(object):
+
+	"""
+	desc: |
+		Emulates the firmware of a Boks in software, behind the same interface
+		as a serial port, so that libboks can be run for long periods without
+		a Boks attached, for example to soak-test the I/O and buffering layers.
+		All commands of firmware 1.1.0 are supported.
+
+		The emulated `micros()` clock runs `speed` times faster than real time,
+		and starts at `start`, so that the 32-bit wraparound (every 71.6
+		minutes on a real Boks) can be reached within seconds. Buttons 1 to 7
+		are pressed at random moments, at an average of `rate` presses per
+		second of device time. Random presses don't overlap, and never involve
+		the photodiode. Presses of any button, including the photodiode
+		(button 8), can also be scripted with [press], for example to test
+		latched waits.
+
+		The `commands` and `events` properties count the commands that have
+		been executed, and the waits that have ended with a button.
+
+		__Example__:
+
+		~~~ {.python}
+		# Run 100 times faster than real time, starting 10 s before the
+		# micros() wraparound
+		dev = emulated_transport(speed=100, start=2**32-10000000)
+		b = libboks(transport=dev)
+		~~~
+	"""
+
+	def __init__(self, speed=1., start=0, rate=1., hold=100, buttons=8,
+		sid='EMU000', seed=None):
+
+		"""
+		desc:
+			Constructor.
+
+		keywords:
+			speed:
+				desc:	The speed of the emulated clock relative to real time.
+				type:	[float, int]
+			start:
+				desc:	The value of the emulated `micros()` clock at the start.
+				type:	int
+			rate:
+				desc:	The average number of button presses per second of
+						device time, or 0 to never press a button.
+				type:	[float, int]
+			hold:
+				desc:	The average hold duration of a button press in
+						milliseconds.
+				type:	[float, int]
+			buttons:
+				desc:	The number of buttons that is reported, including the
+						photodiode.
+				type:	int
+			sid:
+				desc:	The serial ID of the emulated Boks.
+				type:	str
+			seed:
+				desc:	A seed for the random-number generator, or `None` for a
+						random seed.
+				type:	[int, NoneType]
+		"""
+
+		self.speed = speed
+		self.start = start
+		self.rate = rate
+		self.hold = hold
+		self.buttons = buttons
+		self.sid = sid
+		self.random = random.Random(seed)
+		self.timeout = None
+		self.commands = 0
+		self.events = 0
+		self.t0 = capture_clock()
+		self.lock = threading.Condition()
+		self.pending = b''
+		self.replies = collections.deque()
+		self.out = b''
+		self.device = start
+		self.presses = collections.deque()
+		self.next_press = start
+		self.linked = False
+		self.wait = None
+		self.pushed = None
+		self.pushed_until = start
+		self.reset()
+
+	def _edge(self, active, press, t, deadline, cont):
+
+		"""
+		visible:
+			False
+
+		desc:
+			Determines when a wait for a button ends, following the same rules
+			as `waitButton()` in the firmware.
+
+		arguments:
+			active:
+				desc:	The buttons that end the wait.
+				type:	list
+			press:
+				desc:	Indicates whether the wait is for a press or a release.
+				type:	bool
+			t:
+				desc:	The start of the wait in unwrapped device time.
+				type:	int
+			deadline:
+				desc:	The end of the timeout in unwrapped device time, or
+						`None` if there is no timeout.
+				type:	[int, NoneType]
+			cont:
+				desc:	Indicates whether continuous mode is enabled.
+				type:	bool
+
+		returns:
+			desc:	A (button, time) tuple, where `button` is `button_timeout`
+					if the timeout passed first, and `time` is `None` if the
+					wait never ends.
+			type:	tuple
+		"""
+
+		self._prune()
+		if cont:
+			for button in active:
+				if self._pressed(button, t) == press:
+					return button, t
+		# Presses are ordered by onset, but scripted presses may overlap, so
+		# the earliest edge is only known at the first press that starts after
+		# it.
+		button, t2 = button_timeout, deadline
+		i = 0
+		while True:
+			while i >= len(self.presses):
+				if not self._generate():
+					return button, t2
+			onset, offset, _button = self.presses[i]
+			i += 1
+			if t2 != None and onset >= t2:
+				return button, t2
+			if press:
+				edge_time = onset
+			else:
+				edge_time = offset
+			if edge_time > t and _button in active and (t2 == None or
+				edge_time < t2):
+				button, t2 = _button, edge_time
+
+	def _execute(self, cmd):
+
+		"""
+		visible:
+			False
+
+		desc:
+			Executes a single command, and queues the reply.
+
+		arguments:
+			cmd:
+				desc:	The command byte, followed by its arguments.
+				type:	bytearray
+		"""
+
+		self.commands += 1
+		c = cmd[0]
+		arg = bytes(cmd[1:])
+		t = self.device
+		if c == ord(CMD_RESET):
+			self.reset()
+		elif c == ord(CMD_IDENTIFY):
+			self._reply(t, extended_firmware_version.encode() +
+				b'emulator'.ljust(model_length))
+		elif c in (ord(CMD_WAIT_PRESS), ord(CMD_WAIT_RELEASE),
+			ord(CMD_WAIT_LATCHED)):
+			if c == ord(CMD_WAIT_LATCHED):
+				# The photodiode edge latches T1, and must be a real change,
+				# also in continuous mode. The timeout then applies again to
+				# the response.
+				flags = ord(arg)
+				button, t2 = self._edge([8], not flags & latch_offset, t,
+					self._deadline(t), False)
+				extra = struct.pack('<I', no_onset)
+				if button != button_timeout:
+					extra = struct.pack('<I', (t2 - self.t1) & 0xffffffff)
+					self.t1 = t2
+					active = [b for b in range(1, 8) if self.mask & 1 << b-1]
+					button, t2 = self._edge(active, not flags & latch_release,
+						t2, self._deadline(t2), self.continuous)
+			else:
+				active = [b for b in range(1, 9) if self.mask & 1 << b-1]
+				button, t2 = self._edge(active, c == ord(CMD_WAIT_PRESS), t,
+					self._deadline(t), self.continuous)
+				extra = b''
+			self.wait = button, t2, extra
+			if t2 != None:
+				self._end_wait(button, t2, extra)
+		elif c == ord(CMD_CANCEL_WAIT):
+			pass
+		elif c == ord(CMD_WAIT_SLEEP):
+			self.device += self.timeout_us
+		elif c == ord(CMD_BUTTON_STATE):
+			state = self._state(t) & self.mask
+			self._reply(t, struct.pack('<B', state))
+		elif c == ord(CMD_SET_T1):
+			self.t1 = t
+		elif c == ord(CMD_SET_T2):
+			self.t2 = t
+		elif c == ord(CMD_SET_TIMEOUT):
+			self.timeout_us = struct.unpack('<I', arg)[0]
+		elif c == ord(CMD_SET_BUTTONS):
+			# All buttons but the photodiode are activated if none are
+			self.mask = (ord(arg) or 0x7f) & (1 << self.buttons) - 1
+		elif c == ord(CMD_SET_CONTINUOUS):
+			self.continuous = ord(arg)
+		elif c == ord(CMD_GET_T1):
+			self._reply(t, struct.pack('<I', self.t1 & 0xffffffff))
+		elif c == ord(CMD_GET_T2):
+			self._reply(t, struct.pack('<I', self.t2 & 0xffffffff))
+		elif c == ord(CMD_GET_TD):
+			self._reply(t, struct.pack('<I', (self.t2-self.t1) & 0xffffffff))
+		elif c == ord(CMD_GET_TIME):
+			self._reply(t, struct.pack('<I', t & 0xffffffff))
+		elif c == ord(CMD_GET_TIMEOUT):
+			self._reply(t, struct.pack('<I', self.timeout_us))
+		elif c == ord(CMD_GET_BUTTONS):
+			self._reply(t, struct.pack('<B', self.mask))
+		elif c in (ord(CMD_LED_ON), ord(CMD_LED_OFF)):
+			self.led = None
+		elif c == ord(CMD_GET_BTNCNT):
+			self._reply(t, struct.pack('<B', self.buttons))
+		elif c == ord(CMD_GET_SID):
+			self._reply(t, self.sid.encode())
+		elif c == ord(CMD_LINK_LED):
+			# The link ends with the next non-zero byte
+			self.linked = True
+		elif c == ord(CMD_SCHEDULE_LED):
+			mode, start, duration, interval, count = \
+				struct.unpack('<BIIIB', arg)
+			if mode == led_relative_t1:
+				start += self.t1
+			# Map the wrapped start time onto the unwrapped device time
+			offset = (start - t) & 0xffffffff
+			if offset >= 1 << 31:
+				offset -= 1 << 32
+			self.led = t + offset, interval, count
+		elif c == ord(CMD_MEASURE_LATENCY):
+			release, count = struct.unpack('<BH', arg)
+			active = [b for b in range(1, 9) if self.mask & 1 << b-1]
+			for i in range(count):
+				self.t1 = self.device
+				button, t2 = self._edge(active, not release, self.t1,
+					self._deadline(self.t1), self.continuous)
+				if t2 == None:
+					# Like a Boks on which no button is pressed, stop
+					# replying
+					break
+				self.t2 = t2
+				if button == button_timeout:
+					latency = no_onset
+				else:
+					self.events += 1
+					latency = t2 - self.t1
+				self._reply(t2, struct.pack('<I', latency))
+				self.device = t2 + 4
+		elif c == ord(CMD_SET_PUSH):
+			# The acknowledgement is framed in both directions, and the
+			# state is pushed right after enabling
+			self.push = True
+			self.pushed = None
+			self.pushed_until = t
+			self._reply(t, arg)
+			self.push = bool(ord(arg))
+		elif c == ord(CMD_GET_LED):
+			emitted = 0
+			onset = 0
+			if self.led != None:
+				start, interval, count = self.led
+				if t >= start and count:
+					emitted = min(count, 1 + (t - start) // max(1, interval))
+					onset = start & 0xffffffff
+			self._reply(t, struct.pack('<BI', emitted, onset))
+		# Executing a command takes some time on a real Boks too
+		self.device += 4
+
+	def _deadline(self, t):
+
+		"""
+		visible:
+			False
+
+		desc:
+			Determines when a wait that starts at `t` times out.
+
+		arguments:
+			t:
+				desc:	The start of the wait in unwrapped device time.
+				type:	int
+
+		returns:
+			desc:	The end of the timeout in unwrapped device time, or `None`
+					if there is no timeout.
+			type:	[int, NoneType]
+		"""
+
+		if not self.timeout_us:
+			return None
+		# The timeout is relative to T1, which may be in the past
+		return max(t, self.t1 + self.timeout_us)
+
+	def _end_wait(self, button, t2, extra):
+
+		"""
+		visible:
+			False
+
+		desc:
+			Queues the reply that ends the current wait.
+
+		arguments:
+			button:
+				desc:	The button, `button_timeout`, or `button_cancelled`.
+				type:	int
+			t2:
+				desc:	The end of the wait in unwrapped device time.
+				type:	int
+			extra:
+				desc:	Bytes that follow the button in the reply.
+				type:	str
+		"""
+
+		self.t2 = t2
+		self.device = t2
+		if button not in (button_timeout, button_cancelled):
+			self.events += 1
+		self._reply(t2, struct.pack('<B', button) + extra)
+
+	def _generate(self):
+
+		"""
+		visible:
+			False
+
+		desc:
+			Generates the next random button press.
+
+		returns:
+			desc:	False if buttons are never pressed, True otherwise.
+			type:	bool
+		"""
+
+		if not self.rate:
+			return False
+		onset = self.next_press + int(1e6 * self.random.expovariate(
+			self.rate))
+		offset = onset + int(1000 * self.hold * self.random.uniform(.5, 1.5))
+		self.presses.append((onset, offset, self.random.randint(1, 7)))
+		self.next_press = offset + 1
+		return True
+
+	def _now(self):
+
+		"""
+		visible:
+			False
+
+		returns:
+			desc:	The current emulated time in unwrapped microseconds.
+			type:	int
+		"""
+
+		return self.start + int(1e6 * self.speed * (capture_clock() - self.t0))
+
+	def _pressed(self, button, t):
+
+		"""
+		visible:
+			False
+
+		desc:
+			Checks whether a button is pressed at a given time.
+
+		arguments:
+			button:
+				desc:	The button.
+				type:	int
+			t:
+				desc:	The time in unwrapped microseconds.
+				type:	int
+
+		returns:
+			desc:	True if the button is pressed, False otherwise.
+			type:	bool
+		"""
+
+		self._prune()
+		while self.rate and self.next_press <= t:
+			self._generate()
+		for onset, offset, _button in self.presses:
+			if onset > t:
+				break
+			if _button == button and offset > t:
+				return True
+		return False
+
+	def _next_push(self):
+
+		"""
+		visible:
+			False
+
+		desc:
+			Determines the next change of the button state that should be
+			pushed.
+
+		returns:
+			desc:	A (time, state) tuple, or `None` if pushing is disabled or
+					buttons are never pressed.
+			type:	[tuple, NoneType]
+		"""
+
+		if not self.push:
+			return None
+		if self.pushed == None:
+			return self.pushed_until, self._state(self.pushed_until)
+		# As in _edge(), presses may overlap, so the search for the earliest
+		# change ends at the first press that starts after it.
+		t = None
+		i = 0
+		while True:
+			if i >= len(self.presses) and not self._generate():
+				break
+			onset, offset, button = self.presses[i]
+			i += 1
+			if t != None and onset >= t:
+				break
+			for edge_time in onset, offset:
+				if edge_time > self.pushed_until and (t == None or
+					edge_time < t):
+					t = edge_time
+		if t == None:
+			return None
+		return t, self._state(t)
+
+	def _prune(self):
+
+		"""
+		visible:
+			False
+
+		desc:
+			Discards button presses that ended before the current device time,
+			and that have been pushed, so that memory usage doesn't grow.
+		"""
+
+		limit = self.device
+		if self.push:
+			limit = min(limit, self.pushed_until)
+		while self.presses and self.presses[0][1] < limit:
+			self.presses.popleft()
+
+	def _release(self):
+
+		"""
+		visible:
+			False
+
+		desc:
+			Moves replies and pushed states that are due according to the
+			emulated clock to the output buffer, after executing commands
+			that were held back by a wait that has ended since.
+		"""
+
+		if self.pending:
+			self._run()
+		now = self._now()
+		while True:
+			# A change that ends a wait is pushed before the reply
+			push = self._next_push()
+			if push != None and push[0] <= now and (not self.replies or
+				push[0] <= self.replies[0][0]):
+				self.pushed_until, self.pushed = push
+				self.out += struct.pack('<B', push_state) + \
+					push_struct.pack(self.pushed, self.pushed_until & \
+					0xffffffff)
+			elif self.replies and self.replies[0][0] <= now:
+				self.out += self.replies.popleft()[1]
+			else:
+				break
+
+	def _reply(self, t, data):
+
+		"""
+		visible:
+			False
+
+		desc:
+			Queues a reply that becomes available at a given time.
+
+		arguments:
+			t:
+				desc:	The time in unwrapped microseconds.
+				type:	int
+			data:
+				desc:	The reply.
+				type:	str
+		"""
+
+		if self.push:
+			data = struct.pack('<BB', reply_frame, len(data)) + data
+		self.replies.append((t, data))
+		self.lock.notify_all()
+
+	def _state(self, t):
+
+		"""
+		visible:
+			False
+
+		desc:
+			Gets the state of all buttons, including the photodiode, at a
+			given time.
+
+		arguments:
+			t:
+				desc:	The time in unwrapped microseconds.
+				type:	int
+
+		returns:
+			desc:	A byte in which bit `i` is set if button `i+1` is pressed.
+			type:	int
+		"""
+
+		state = 0
+		for button in range(1, 9):
+			if self._pressed(button, t):
+				state |= 1 << button-1
+		return state
+
+	def close(self):
+
+		"""See Serial."""
+
+		pass
+
+	def inWaiting(self):
+
+		"""See Serial."""
+
+		with self.lock:
+			self._release()
+			return len(self.out)
+
+	def press(self, button, delay=0, duration=None):
+
+		"""
+		desc: |
+			Scripts a press of a button, or a change of the photodiode (button
+			8). Because the outcome of a wait is determined when the wait
+			starts, a press has to be scripted before the wait that should
+			detect it. Scripted presses may overlap, but they should not be
+			combined with random presses, so `rate` should be 0.
+
+		arguments:
+			button:
+				desc:	The button (1-8).
+				type:	int
+
+		keywords:
+			delay:
+				desc:	The time until the press in milliseconds of device
+						time.
+				type:	[int, float]
+			duration:
+				desc:	The duration of the press in milliseconds, or `None`
+						to keep the button pressed.
+				type:	[int, float, NoneType]
+
+		example: |
+			dev = emulated_transport(rate=0)
+			b = libboks(transport=dev)
+			# The display appears after 50 ms, and is followed by a response
+			dev.press(8, 50, 100)
+			dev.press(1, 300, 100)
+			button, t2, onset = b.get_button_press(latch='onset')
+		"""
+
+		with self.lock:
+			onset = max(self.device, self._now()) + int(1000 * delay)
+			if duration == None:
+				offset = onset + emulator_forever
+			else:
+				offset = onset + int(1000 * duration)
+			# Keep the presses ordered by onset. A deque only supports
+			# insert() as of Python 3.5.
+			i = len(self.presses)
+			while i > 0 and self.presses[i-1][0] > onset:
+				i -= 1
+			self.presses.rotate(-i)
+			self.presses.appendleft((onset, offset, button))
+			self.presses.rotate(i)
+			self.lock.notify_all()
+
+	def read(self, size=1):
+
+		"""See Serial."""
+
+		with self.lock:
+			if self.timeout != None:
+				until = capture_clock() + self.timeout
+			while True:
+				self._release()
+				if len(self.out) >= size:
+					break
+				due = []
+				push = self._next_push()
+				if push != None:
+					due.append(push[0])
+				if self.replies:
+					due.append(self.replies[0][0])
+				if due:
+					dt = (min(due) - self._now()) / (1e6 * self.speed)
+				else:
+					dt = None
+				if self.timeout != None:
+					remaining = until - capture_clock()
+					if remaining <= 0:
+						break
+					if dt == None or dt > remaining:
+						dt = remaining
+				if dt == None or dt > 0:
+					self.lock.wait(dt)
+			data = self.out[:size]
+			self.out = self.out[len(data):]
+			return data
+
+	def reset(self):
+
+		"""
+		desc:
+			Resets the emulated Boks to its initial state, as CMD_RESET does.
+		"""
+
+		self.t1 = 0
+		self.t2 = 0
+		self.timeout_us = 0
+		self.mask = 0x7f
+		self.continuous = 0
+		self.led = None
+		self.push = False
+
+	def write(self, data):
+
+		"""See Serial."""
+
+		with self.lock:
+			self.pending += data
+			self._run()
+
+	def _run(self):
+
+		"""
+		visible:
+			False
+
+		desc:
+			Executes the commands that have been written, as far as they are
+			complete and no wait is in progress.
+		"""
+
+		while self.pending:
+			cmd = bytearray(self.pending)
+			now = self._now()
+			self.device = max(self.device, now)
+			if self.linked:
+				self.linked = cmd[0] == 0
+				self.pending = self.pending[1:]
+				continue
+			if self.wait != None and self.wait[1] != None and \
+				self.wait[1] <= now:
+				self.wait = None
+			if self.wait != None:
+				# Like the firmware, only consume a cancellation while
+				# waiting. Other commands are executed after the wait. A
+				# cancellation replaces the reply that has been queued for
+				# the end of the wait.
+				if cmd[0] != ord(CMD_CANCEL_WAIT):
+					break
+				self.pending = self.pending[1:]
+				button, t2, extra = self.wait
+				if t2 != None:
+					self.replies.pop()
+					if button not in (button_timeout, button_cancelled):
+						self.events -= 1
+				self.wait = None
+				self.device = now
+				self._end_wait(button_cancelled, now, extra)
+				continue
+			length = 1 + emulator_arguments.get(cmd[0], 0)
+			if len(cmd) < length:
+				break
+			self.pending = self.pending[length:]
+			self._execute(cmd[:length])
+
+class push_transport(object):
+
+	"""
+	desc: |
+		Wraps the serial port while the Boks pushes its button state (see
+		[libboks.set_push]). A background thread reads everything that the Boks
+		sends. Pushed button states are kept in the `mirror` property, and
+		replies are passed on to libboks with their frames removed. The
+		`changes` property counts the pushed states.
+	"""
+
+	def __init__(self, dev, poll=.05):
+
+		"""
+		desc:
+			Constructor.
+
+		arguments:
+			dev:
+				desc:	The serial port to wrap.
+				type:	Serial
+
+		keywords:
+			poll:
+				desc:	The timeout in seconds of reads from the serial port,
+						which determines how quickly the background thread
+						stops.
+				type:	float
+		"""
+
+		self.dev = dev
+		self.timeout = dev.timeout
+		self.mirror = None
+		self.changes = 0
+		self.error = None
+		self.replies = b''
+		self.last = False
+		self.running = True
+		self.lock = threading.Condition()
+		dev.timeout = poll
+		self.thread = threading.Thread(target=self._read_packets,
+			name='libboks-push')
+		self.thread.daemon = True
+		self.thread.start()
+
+	def _read_exactly(self, size):
+
+		"""
+		visible:
+			False
+
+		desc:
+			Reads a number of bytes from the serial port, while the transport
+			is running.
+
+		arguments:
+			size:
+				desc:	The number of bytes.
+				type:	int
+
+		returns:
+			desc:	The bytes, or fewer bytes if the transport was stopped.
+			type:	str
+		"""
+
+		data = b''
+		while len(data) < size and self.running:
+			data += self.dev.read(size - len(data))
+		return data
+
+	def _read_packets(self):
+
+		"""
+		visible:
+			False
+
+		desc:
+			Reads push packets and reply frames until the transport is
+			stopped, or until the last frame has been read (see
+			[last_frame]).
+		"""
+
+		try:
+			while self.running:
+				marker = self.dev.read(1)
+				if not marker:
+					continue
+				if ord(marker) == push_state:
+					data = self._read_exactly(push_struct.size)
+					if len(data) < push_struct.size:
+						break
+					with self.lock:
+						# A single assignment, so that readers never see a
+						# state with the timestamp of another state
+						self.mirror = push_struct.unpack(data)
+						self.changes += 1
+						self.lock.notify_all()
+				elif ord(marker) == reply_frame:
+					length = self._read_exactly(1)
+					if not length:
+						break
+					data = self._read_exactly(ord(length))
+					with self.lock:
+						self.replies += data
+						self.lock.notify_all()
+					if self.last:
+						break
+				else:
+					raise serial.SerialException( \
+						'Unexpected byte %r while the boks was pushing' \
+						% marker)
+		except Exception as e:
+			with self.lock:
+				self.error = e
+				self.lock.notify_all()
+
+	def close(self):
+
+		"""See Serial."""
+
+		self.detach().close()
+
+	def detach(self):
+
+		"""
+		desc:
+			Stops the background thread.
+
+		returns:
+			desc:	The wrapped serial port, with its original timeout.
+			type:	Serial
+		"""
+
+		self.running = False
+		self.thread.join()
+		self.dev.timeout = self.timeout
+		return self.dev
+
+	def inWaiting(self):
+
+		"""See Serial."""
+
+		return len(self.replies)
+
+	def last_frame(self):
+
+		"""
+		desc:
+			Indicates that the next reply frame is the last one, because
+			pushing is being disabled. The background thread then stops after
+			this frame, so that it doesn't read the replies that follow.
+		"""
+
+		self.last = True
+
+	def read(self, size=1):
+
+		"""See Serial."""
+
+		with self.lock:
+			if self.timeout != None:
+				until = capture_clock() + self.timeout
+			while len(self.replies) < size:
+				if self.error != None:
+					raise serial.SerialException(str(self.error))
+				if self.timeout == None:
+					self.lock.wait()
+					continue
+				remaining = until - capture_clock()
+				if remaining <= 0:
+					break
+				self.lock.wait(remaining)
+			data = self.replies[:size]
+			self.replies = self.replies[len(data):]
+			return data
+
+	def wait_mirror(self, timeout):
+
+		"""
+		desc:
+			Waits until the first state has been pushed.
+
+		arguments:
+			timeout:
+				desc:	The timeout in milliseconds.
+				type:	[int, float]
+
+		returns:
+			desc:	True if a state has been pushed, False otherwise.
+			type:	bool
+		"""
+
+		until = capture_clock() + .001 * timeout
+		with self.lock:
+			while self.mirror == None and self.error == None:
+				remaining = until - capture_clock()
+				if remaining <= 0:
+					break
+				self.lock.wait(remaining)
+			return self.mirror != None
+
+	def write(self, data):
+
+		"""See Serial."""
+
+		self.dev.write(data)
+
+class session_log(object):
+
+	"""
+	desc: |
+		Writes all button events of a session to a binary log file, which can
+		be read efficiently with a [session_log_reader], also while the session
+		is still running. A session log consists of two files:
+
+		- The event file starts with a header (see `log_header_struct`) that
+		  describes the Boks (SID, firmware version, model) and the clock-sync
+		  parameters (see `libboks.sync_clock()`). This is followed by fixed-width
+		  event records (see `log_event_struct`).
+		- The trial index, which has the same name followed by `.trials`,
+		  consists of fixed-width records that specify the trial number, the
+		  index of the first event of the trial, and the onset of the trial.
+
+		Both files are only ever appended to, and the number of records is
+		derived from the file size. Therefore, if a session crashes, at most
+		the last, partially written record is lost. Partially written records
+		are ignored by [session_log_reader], and removed when a log is opened
+		for appending.
+
+		__Example__:
+
+		~~~ {.python}
+		log = libboks.session_log('subject1.bokslog', exp.boks)
+		exp.boks.add_listener(log)
+		log.start_trial(1)
+		~~~
+	"""
+
+	def __init__(self, path, boks=None, append=False):
+
+		"""
+		desc:
+			Constructor.
+
+		arguments:
+			path:
+				desc:	The path of the event file.
+				type:	[str, unicode]
+
+		keywords:
+			boks:
+				desc:	The Boks that is described in the header, or `None`.
+				type:	[libboks, NoneType]
+			append:
+				desc:	Indicates whether an existing log should be appended
+						to, after recovering it if it was not neatly closed.
+						Otherwise, an existing log is overwritten.
+				type:	bool
+		"""
+
+		self.path = path
+		self.boks = boks
+		self.trial = 0
+		self.start_time = time.time()
+		# Events are published by the command executor, whereas the header
+		# and the trial index are written by the user's thread
+		self.lock = threading.RLock()
+		if append and os.path.exists(path):
+			self.n_events = recover_session_log(path)
+			self.fd = open(path, 'r+b')
+			self.fd.seek(0, os.SEEK_END)
+			self.fd_trials = open(path + log_trials_ext, 'ab')
+			# Keep the existing header if there is no Boks to describe
+			if boks != None:
+				self.write_header()
+		else:
+			self.n_events = 0
+			self.fd = open(path, 'w+b')
+			self.fd.write(b'\x00' * log_header_size)
+			self.fd_trials = open(path + log_trials_ext, 'wb')
+			self.write_header()
+
+	def close(self):
+
+		"""
+		desc:
+			Updates the header and closes the log.
+		"""
+
+		with self.lock:
+			if self.boks != None:
+				self.write_header()
+			self.fd.close()
+			self.fd_trials.close()
+
+	def flush(self):
+
+		"""
+		desc:
+			Writes all buffered records to disk.
+		"""
+
+		with self.lock:
+			self.fd.flush()
+			self.fd_trials.flush()
+
+	def publish(self, event):
+
+		"""
+		desc:
+			Appends an event to the log, as part of the current trial.
+
+		arguments:
+			event:
+				desc:	An event.
+				type:	boks_event
+		"""
+
+		with self.lock:
+			self.fd.write(log_event_struct.pack(self.trial, event.button,
+				event.edge, event.device_time, event.host_time))
+			self.n_events += 1
+
+	def start_trial(self, trial, onset=None):
+
+		"""
+		desc:
+			Starts a new trial. All subsequent events are part of this trial.
+			This also flushes the log, so that all previous trials are safely
+			on disk.
+
+		arguments:
+			trial:
+				desc:	The trial number.
+				type:	int
+
+		keywords:
+			onset:
+				desc:	The onset of the trial in milliseconds, or `None` to
+						use the current time of the Boks.
+				type:	[float, NoneType]
+		"""
+
+		if onset == None:
+			if self.boks != None:
+				onset = self.boks.time()
+			else:
+				onset = 1000. * time.time()
+		with self.lock:
+			self.trial = trial
+			self.fd_trials.write(log_trial_struct.pack(trial, self.n_events,
+				onset))
+			self.flush()
+
+	def write_header(self):
+
+		"""
+		desc:
+			(Re)writes the header, for example after the clock has been
+			synchronized.
+		"""
+
+		sid = firmware_version = model = b''
+		device_ref, host_ref, rate = 0, 0, 1
+		if self.boks != None:
+			sid = self.boks.sid
+			firmware_version = self.boks.firmware_version
+			model = self.boks.model
+			if self.boks.clock_sync != None:
+				device_ref, host_ref, rate = self.boks.clock_sync
+		with self.lock:
+			pos = self.fd.tell()
+			self.fd.seek(0)
+			self.fd.write(log_header_struct.pack(log_magic, log_version,
+				log_event_struct.size, sid, firmware_version, model,
+				device_ref, host_ref, rate, self.start_time))
+			self.fd.seek(pos)
+			self.flush()
+
+class session_log_reader(object):
+
+	"""
+	desc: |
+		Reads a session log that has been written by a [session_log]. Events
+		are accessed through a `numpy.memmap`, so that arbitrary trials can be
+		read from very large logs without loading the entire log into memory.
+		Requires numpy.
+
+		__Example__:
+
+		~~~ {.python}
+		log = session_log_reader('subject1.bokslog')
+		for trial in log.trial_numbers():
+			events = log.trial(trial)
+			print(trial, events['button'], events['host_time'])
+		~~~
+	"""
+
+	def __init__(self, path):
+
+		"""
+		desc:
+			Constructor. Sets the `events` property to a memory-mapped record
+			array of all events, and the `trials` property to a record array
+			of the trial index.
+
+		arguments:
+			path:
+				desc:	The path of the event file.
+				type:	[str, unicode]
+		"""
+
+		import numpy as np
+		event_dtype, trial_dtype = log_dtypes()
+		self.path = path
+		with open(path, 'rb') as fd:
+			header = log_header_struct.unpack(
+				fd.read(log_header_struct.size))
+		magic, fmt_version, record_size, self.sid, self.firmware_version, \
+			self.model, device_ref, host_ref, rate, self.start_time = header
+		if magic != log_magic or fmt_version != log_version or \
+			record_size != log_event_struct.size:
+			raise boks_exception('%s is not a compatible session log' % path)
+		self.sid = self.sid.rstrip(b'\x00')
+		self.firmware_version = self.firmware_version.rstrip(b'\x00')
+		self.model = self.model.rstrip(b'\x00')
+		self.clock_sync = device_ref, host_ref, rate
+		n = (os.path.getsize(path) - log_header_size) // \
+			log_event_struct.size
+		if n > 0:
+			self.events = np.memmap(path, dtype=event_dtype, mode='r',
+				offset=log_header_size, shape=(n,))
+		else:
+			self.events = np.zeros(0, dtype=event_dtype)
+		trials_path = path + log_trials_ext
+		if os.path.exists(trials_path):
+			n = os.path.getsize(trials_path) // log_trial_struct.size
+			self.trials = np.fromfile(trials_path, dtype=trial_dtype,
+				count=n)
+		else:
+			self.trials = np.zeros(0, dtype=trial_dtype)
+
+	def trial(self, trial):
+
+		"""
+		desc:
+			Gets all events of a trial. If a trial number occurs more than once,
+			the events of the last occurrence are returned.
+
+		arguments:
+			trial:
+				desc:	A trial number.
+				type:	int
+
+		returns:
+			desc:	A record array of events, which is a view on the
+					memory-mapped file.
+			type:	memmap
+		"""
+
+		import numpy as np
+		i = np.nonzero(self.trials['trial'] == trial)[0]
+		if len(i) == 0:
+			raise boks_exception('Trial %s is not in %s' % (trial, self.path))
+		i = i[-1]
+		first = int(self.trials['first_event'][i])
+		if i+1 < len(self.trials):
+			last = int(self.trials['first_event'][i+1])
+		else:
+			last = len(self.events)
+		return self.events[first:last]
+
+	def trial_numbers(self):
+
+		"""
+		desc:
+			Gets all trial numbers in the order in which they were started.
+
+		returns:
+			desc:	A list of trial numbers.
+			type:	list
+		"""
+
+		return self.trials['trial'].tolist()
+
+def log_dtypes():
+
+	"""
+	desc:
+		Gets the numpy dtypes that correspond to the event and trial records of
+		a session log.
+
+	returns:
+		desc:	An (event_dtype, trial_dtype) tuple.
+		type:	tuple
+	"""
+
+	import numpy as np
+	event_dtype = np.dtype({
+		'names': ['trial', 'button', 'edge', 'device_time', 'host_time'],
+		'formats': ['<u4', 'u1', 'u1', '<u4', '<f8'],
+		'offsets': [0, 4, 5, 8, 16],
+		'itemsize': log_event_struct.size})
+	trial_dtype = np.dtype({
+		'names': ['trial', 'first_event', 'onset'],
+		'formats': ['<u4', '<u8', '<f8'],
+		'offsets': [0, 8, 16],
+		'itemsize': log_trial_struct.size})
+	return event_dtype, trial_dtype
+
+def recover_session_log(path):
+
+	"""
+	desc:
+		Recovers a session log that was not neatly closed, by removing
+		partially written records from the event file and the trial index.
+		If the session crashed while the header was written for the first
+		time, the header is replaced by one that doesn't describe a Boks,
+		and that has the time of the last change as its start time.
+
+	arguments:
+		path:
+			desc:	The path of the event file.
+			type:	[str, unicode]
+
+	returns:
+		desc:	The number of events in the log.
+		type:	int
+	"""
+
+	for _path, offset, size in [
+		(path, log_header_size, log_event_struct.size),
+		(path + log_trials_ext, 0, log_trial_struct.size)]:
+		if not os.path.exists(_path):
+			continue
+		n = max(0, (os.path.getsize(_path) - offset) // size)
+		with open(_path, 'r+b') as fd:
+			fd.truncate(offset + n * size)
+	with open(path, 'r+b') as fd:
+		header = log_header_struct.unpack(fd.read(log_header_struct.size))
+		if header[:3] != (log_magic, log_version, log_event_struct.size):
+			fd.seek(0)
+			fd.write(log_header_struct.pack(log_magic, log_version,
+				log_event_struct.size, b'', b'', b'', 0, 0, 1,
+				os.path.getmtime(path)))
+	return (os.path.getsize(path) - log_header_size) // log_event_struct.size
+
+def wrap_device_time(dt):
+
+	"""
+	desc:
+		Corrects a difference between two device timestamps for the
+		wrap-around of the device clock, which occurs every 2^32 microseconds.
+
+	arguments:
+		dt:
+			desc:	A difference between two device timestamps.
+			type:	int
+
+	returns:
+		desc:	The difference in microseconds, between -2^31 and 2^31.
+		type:	int
+	"""
+
+	return (dt + 2**31) % 2**32 - 2**31
+
+def encode_buttons(buttons):
+
+	"""
+	desc:
+		Encodes a list of buttons into the bitmask that is used by the
+		firmware.
+
+	arguments:
+		buttons:
+			desc:	A list of buttons, where each button is an integer, or
+					`None` to enable all buttons (except for the photodiode).
+			type:	[list, NoneType]
+
+	returns:
+		desc:	A bitmask between 0 and 255.
+		type:	int
+	"""
+
+	if buttons == None:
+		buttons = all_buttons
+	try:
+		buttons = list(buttons)
+	except:
+		raise boks_exception( \
+			'Expecting a list of integers, or similar parameter')
+	v = 0
+	for button in buttons:
+		try:
+			button = int(button)
+		except:
+			raise boks_exception( \
+				'Expecting a list of integers, or similar parameter')
+		if button < 1:
+			raise boks_exception( \
+				'Expecting button numbers between 1 and 8')
+		v |= 1 << (button-1)
+	if v > 255:
+		raise boks_exception( \
+			'Expecting button numbers between 1 and 8')
+	return v
+
+def encode_timeout(timeout):
+
+	"""
+	desc:
+		Checks a timeout, and converts it to the microseconds that are used by
+		the firmware.
+
+	arguments:
+		timeout:
+			desc:	A value in milliseconds. Use 0 or `None` to disable
+					timeout.
+			type:	[int, NoneType]
+
+	returns:
+		desc:	The timeout in microseconds.
+		type:	int
+	"""
+
+	if timeout == None:
+		timeout = 0
+	try:
+		timeout = int(timeout)
+	except:
+		raise boks_exception('Expecting a numeric value or None')
+	if timeout < 0:
+		raise boks_exception( \
+			'Expecting a non-negative numeric value or None')
+	return 1000*timeout
+
+def compile_settings(buttons, timeout):
+
+	"""
+	desc: |
+		Checks and encodes button and timeout settings into a single,
+		immutable command packet, which can be sent to the Boks with
+		[libboks.apply_settings]. This moves all parsing and encoding out of
+		the timing-critical part of an experiment.
+
+	arguments:
+		buttons:
+			desc:	A list of buttons, as accepted by [libboks.set_buttons].
+			type:	[list, NoneType]
+		timeout:
+			desc:	A timeout, as accepted by [libboks.set_timeout].
+			type:	[int, NoneType]
+
+	returns:
+		desc:	A `(buttons, timeout, data)` named tuple, where `data` are the
+				encoded commands.
+		type:	settings_packet
+
+	example: |
+		# During the prepare phase
+		settings = libboks.compile_settings([1,2], 2000)
+		# During the run phase
+		exp.boks.apply_settings(settings)
+		button, t = exp.boks.get_button_press()
+	"""
+
+	mask = encode_buttons(buttons)
+	us = encode_timeout(timeout)
+	if buttons != None:
+		buttons = tuple([int(button) for button in buttons])
+	data = struct.pack('<BBBI', ord(CMD_SET_BUTTONS), mask,
+		ord(CMD_SET_TIMEOUT), us)
+	return settings_packet(buttons, us // 1000, data)
+
+def serial_ports(arduino=False):
+
+	"""
+	desc:
+		Lists the serial ports to which a Boks may be connected. Whether there
+		actually is a Boks on these ports is not checked.
+
+	keywords:
+		arduino:
+			desc:	Indicates whether only ports of USB devices with an
+					Arduino vendor ID (see `arduino_vendor_ids`) should be
+					listed, so that nothing is written to other devices. This
+					requires `serial.tools.list_ports`.
+			type:	bool
+
+	returns:
+		desc:	A list of port names.
+		type:	list
+
+	example: |
+		from libboks import serial_ports
+		print(serial_ports())
+	"""
+
+	if arduino:
+		if list_ports == None:
+			raise boks_exception( \
+				'Arduino ports can only be recognized with serial.tools')
+		# The hardware ID is formatted as 'USB VID:PID=2341:0043 ...'
+		ports = []
+		for info in list_ports.comports():
+			m = re.search(r'VID:PID=([0-9a-fA-F]+):', info[2])
+			if m != None and int(m.group(1), 16) in arduino_vendor_ids:
+				ports.append(info[0])
+		return ports
+	if list_ports != None:
+		return [info[0] for info in list_ports.comports()]
+	if os.name == 'posix':
+		return sorted(glob.glob('/dev/ttyACM*') + glob.glob('/dev/ttyUSB*'))
+	return ['COM%d' % i for i in range(1, 21)]
+
+def open_port(port, baudrate=baudrate, timeout=None):
+
+	"""
+	desc:
+		Opens a serial port to which a Boks is connected.
+
+	arguments:
+		port:
+			desc:	The port.
+			type:	[str, unicode]
+
+	keywords:
+		baudrate:
+			desc:	The baudrate.
+			type:	int
+		timeout:
+			desc:	The read timeout in seconds, or `None` to block.
+			type:	[float, NoneType]
+
+	returns:
+		desc:	The serial port.
+		type:	Serial
+	"""
+
+	# Opening and closing the serial port unfreezes the Boks when it has
+	# not been neatly closed.
+	serial.Serial(port).close()
+	return serial.Serial(port, baudrate=baudrate, timeout=timeout)
+
+def _median(l):
+
+	"""
+	visible:
+		False
+
+	desc:
+		Gets the median of a non-empty list of numbers.
+	"""
+
+	l = sorted(l)
+	i = len(l) // 2
+	if len(l) % 2:
+		return l[i]
+	return .5 * (l[i-1] + l[i])
+
+def _text(s):
+
+	"""
+	visible:
+		False
+
+	desc:
+		Converts a value that was read from the Boks to text.
+	"""
+
+	if isinstance(s, bytes) and not isinstance(s, str):
+		return s.decode('ascii', 'replace')
+	return s
+
+def _libc():
+
+	"""
+	visible:
+		False
+
+	desc:
+		Loads the C library, for system calls that Python doesn't expose.
+
+	returns:
+		desc:	The C library, or `None` if this is not Linux.
+		type:	[CDLL, NoneType]
+	"""
+
+	if platform.system() != 'Linux':
+		return None
+	path = ctypes.util.find_library('c')
+	if path == None:
+		return None
+	return ctypes.CDLL(path, use_errno=True)
+
+def _import_shared_memory():
+
+	"""
+	visible:
+		False
+
+	desc:
+		Imports the shared_memory module, which is only available as of
+		Python 3.8.
+
+	returns:
+		desc:	The `multiprocessing.shared_memory` module.
+		type:	module
+	"""
+
+	try:
+		from multiprocessing import shared_memory
+	except ImportError:
+		raise boks_exception( \
+			'Shared-memory event buffers require Python 3.8 or later')
+	return shared_memory
+
+class simulated_participant(object):
+
+	"""
+	desc: |
+		Generates responses for a dummy Boks, so that experiments can be run
+		end-to-end in a fraction of the time that a real participant would
+		need, for example to check logging and counterbalancing. Responses are
+		returned instantly, but the simulated clock of the dummy Boks advances
+		by the simulated response times (see `dummy.lead`).
+
+		Response times (for presses) are drawn from an ex-Gaussian
+		distribution, and hold durations (for releases) from a normal
+		distribution. Responses that exceed the timeout result in a timeout.
+
+		__Example__:
+
+		~~~ {.python}
+		participant = simulated_participant(accuracy=.9, seed=1)
+		b = libboks('dummy', participant=participant, timeout=2000)
+		participant.correct = 1
+		button, t = b.get_button_press()
+		~~~
+	"""
+
+	def __init__(self, rt_mu=400, rt_sigma=50, rt_tau=100, rt_min=100,
+		accuracy=.95, hold_mean=150, hold_sd=30, seed=None):
+
+		"""
+		desc:
+			Constructor.
+
+		keywords:
+			rt_mu:
+				desc:	The mean of the normal component of the response times
+						in milliseconds.
+				type:	[float, int]
+			rt_sigma:
+				desc:	The standard deviation of the normal component of the
+						response times in milliseconds.
+				type:	[float, int]
+			rt_tau:
+				desc:	The mean of the exponential component of the response
+						times in milliseconds.
+				type:	[float, int]
+			rt_min:
+				desc:	The minimum response time in milliseconds.
+				type:	[float, int]
+			accuracy:
+				desc:	The proportion of responses that are correct, i.e. that
+						match the `correct` property. If `correct` is `None`,
+						responses are chosen randomly.
+				type:	float
+			hold_mean:
+				desc:	The mean hold duration in milliseconds.
+				type:	[float, int]
+			hold_sd:
+				desc:	The standard deviation of the hold durations in
+						milliseconds.
+				type:	[float, int]
+			seed:
+				desc:	A seed for the random-number generator, or `None` for a
+						random seed.
+				type:	[int, NoneType]
+		"""
+
+		self.rt_mu = rt_mu
+		self.rt_sigma = rt_sigma
+		self.rt_tau = rt_tau
+		self.rt_min = rt_min
+		self.accuracy = accuracy
+		self.hold_mean = hold_mean
+		self.hold_sd = hold_sd
+		self.random = random.Random(seed)
+		self.correct = None
+		self.last_button = None
+
+	def respond(self, buttons, timeout, edge=edge_press):
+
+		"""
+		desc:
+			Generates a single response.
+
+		arguments:
+			buttons:
+				desc:	The list of active buttons.
+				type:	list
+			timeout:
+				desc:	The timeout in milliseconds, or 0 or `None` for no
+						timeout.
+				type:	[float, int, NoneType]
+
+		keywords:
+			edge:
+				desc:	`edge_press` or `edge_release`.
+				type:	int
+
+		returns:
+			desc:	A (button, rt) tuple, where `button` is `None` if a timeout
+					occurred, and `rt` is in milliseconds.
+			type:	tuple
+		"""
+
+		if edge == edge_release:
+			rt = max(0, self.random.gauss(self.hold_mean, self.hold_sd))
+			if self.last_button in buttons:
+				button = self.last_button
+			else:
+				button = self.random.choice(buttons)
+		else:
+			rt = max(self.rt_min, self.random.gauss(self.rt_mu,
+				self.rt_sigma) + self.random.expovariate(1. / self.rt_tau))
+			if self.correct in buttons and self.random.random() < \
+				self.accuracy:
+				button = self.correct
+			else:
+				incorrect = [b for b in buttons if b != self.correct]
+				if not incorrect:
+					incorrect = buttons
+				button = self.random.choice(incorrect)
+		if timeout and rt > timeout:
+			return None, timeout
+		self.last_button = button
+		return button, rt
+
+class debounce_filter(object):
+
+	"""
+	desc: |
+		Suppresses spurious button events, which are caused by bouncing of
+		mechanical switches, and by flicker of the display in the case of the
+		photodiode (button 8).
+
+		An edge is only accepted if the button has been stable, that is, if
+		no other edge has occurred on the same button, for at least
+		`min_stable` ms. The first edge of a burst of bounces is therefore
+		accepted right away, so that filtering doesn't delay responses. In
+		addition, photodiode offsets (releases of button 8) can be filtered
+		with hysteresis, in which case an offset is only accepted if the
+		photodiode then stays dark for at least `hysteresis` ms. If not, the
+		offset and the onset that ends it are both suppressed, because
+		together they are a glitch. Because this requires looking ahead, the
+		last offset of a batch is held back until a later batch shows that
+		the photodiode has stayed dark, or until [flush] is called. Onsets
+		are never held back.
+
+		Batches of events are filtered with [filter], which is vectorised,
+		and accepts lists of [boks_event]s as well as numpy arrays of
+		session-log events (see [log_dtypes]). Single events, such as
+		responses that are collected by a Boks with a debounce filter, are
+		filtered with [accept], which doesn't apply hysteresis. A Boks only
+		reports the edges that end a wait, so the opposite edge, such as the
+		release between two presses, can go unseen. In that case, [missed]
+		returns True, and the edge should only be passed to [accept] if the
+		button is still in the same state after `min_stable` ms, because it
+		may be a bounce of the unseen edge. Otherwise, it is passed to
+		[reject]. The number of suppressed edges for each button is counted
+		in the `suppressed` property, which is a list that is indexed by
+		button number.
+
+	example: |
+		f = libboks.debounce_filter(min_stable=5, hysteresis=20)
+		reader = libboks.event_ring_reader('boks')
+		events = f.filter(reader.read())
+		print('Suppressed %d edges' % sum(f.suppressed))
+	"""
+
+	def __init__(self, min_stable=5, hysteresis=0):
+
+		"""
+		desc:
+			Constructor.
+
+		keywords:
+			min_stable:
+				desc:	The minimum time (in milliseconds) that a button needs
+						to be stable before an edge is accepted, or a dict
+						with a separate value for each button number.
+				type:	[int, float, dict]
+			hysteresis:
+				desc:	The minimum time (in milliseconds) that the photodiode
+						needs to stay dark after an offset, or 0 to disable
+						hysteresis.
+				type:	[int, float]
+		"""
+
+		if isinstance(min_stable, dict):
+			self.min_stable = [int(1000*min_stable.get(button, 0)) \
+				for button in range(9)]
+		else:
+			self.min_stable = [int(1000*min_stable)] * 9
+		self.hysteresis = int(1000*hysteresis)
+		self.last_time = [None] * 9
+		self.last_edge = [None] * 9
+		self.suppressed = [0] * 9
+		self.pending = None
+
+	def accept(self, button, edge, device_time):
+
+		"""
+		desc:
+			Checks whether a single edge should be accepted. The lockout
+			applies from the last edge on the same button, in either
+			direction.
 
-version = '1.0.2'
-baudrate = 115200
-button_timeout = 255
-all_buttons = [] # Except the photodiode, which is button 8
-firmware_version_length = 5
-model_length = 16
-sid_length = 6
+		arguments:
+			button:
+				desc:	The button.
+				type:	int
+			edge:
+				desc:	The edge, `edge_press` or `edge_release`.
+				type:	int
+			device_time:
+				desc:	The device timestamp of the edge.
+				type:	int
 
-class boks_exception(Exception):
+		returns:
+			desc:	True if the edge is accepted, False if it is suppressed.
+			type:	bool
+		"""
 
-	"""
-	desc:
-		A custom Exception class for nice error messages.
-	"""
+		last = self.last_time[button]
+		self.last_time[button] = device_time
+		self.last_edge[button] = edge
+		if last != None and wrap_device_time(device_time - last) < \
+			self.min_stable[button]:
+			self.suppressed[button] += 1
+			return False
+		return True
 
-	pass
+	def missed(self, button, edge):
+
+		"""
+		desc:
+			Checks whether the edge that should have come before an edge has
+			gone unseen, that is, whether the last edge on the same button
+			was in the same direction.
+
+		arguments:
+			button:
+				desc:	The button.
+				type:	int
+			edge:
+				desc:	The edge, `edge_press` or `edge_release`.
+				type:	int
+
+		returns:
+			desc:	True if the opposite edge has been missed.
+			type:	bool
+		"""
+
+		return self.last_edge[button] == edge
+
+	def reject(self, button, edge, device_time):
+
+		"""
+		desc:
+			Suppresses an edge that has turned out to be a bounce, because
+			the button was back in its previous state by `device_time`. The
+			lockout then applies from `device_time`.
+
+		arguments:
+			button:
+				desc:	The button.
+				type:	int
+			edge:
+				desc:	The edge, `edge_press` or `edge_release`.
+				type:	int
+			device_time:
+				desc:	The device time at which the button was back in its
+						previous state.
+				type:	int
+		"""
+
+		self.last_time[button] = device_time
+		self.last_edge[button] = edge_press + edge_release - edge
+		self.suppressed[button] += 1
+
+	def filter(self, events):
+
+		"""
+		desc:
+			Filters a batch of events, which should be in chronological order.
+
+		arguments:
+			events:
+				desc:	A list of [boks_event]s, or a numpy array of session-log
+						events.
+				type:	[list, ndarray]
+
+		returns:
+			desc:	The accepted events, including an offset that has been
+					held back from the previous batch, in the same format as
+					`events`.
+			type:	[list, ndarray]
+		"""
+
+		import numpy as np
+		if isinstance(events, np.ndarray):
+			button = events['button'].astype(np.intp)
+			edge = events['edge']
+			t = events['device_time'].astype(np.int64)
+		else:
+			events = list(events)
+			button = np.array([e.button for e in events], dtype=np.intp)
+			edge = np.array([e.edge for e in events], dtype=np.uint8)
+			t = np.array([e.device_time for e in events], dtype=np.int64)
+		n = len(events)
+		# Sort the events by button, while keeping them in chronological order
+		# for each button, and get the previous and next edge on the same
+		# button. -1 indicates that there is no such edge.
+		order = np.argsort(button, kind='mergesort')
+		b = button[order]
+		ts = t[order]
+		es = edge[order]
+		first = np.ones(n, dtype=bool)
+		first[1:] = b[1:] != b[:-1]
+		last = np.ones(n, dtype=bool)
+		last[:-1] = first[1:]
+		last_time = np.array([-1 if lt == None else lt \
+			for lt in self.last_time], dtype=np.int64)
+		prev = np.empty(n, dtype=np.int64)
+		prev[1:] = ts[:-1]
+		prev[first] = last_time[b[first]]
+		keep = (prev < 0) | ((ts - prev + 2**31) % 2**32 - 2**31 >= \
+			np.array(self.min_stable)[b])
+		held = np.zeros(n, dtype=bool)
+		if self.hysteresis:
+			offset = (b == 8) & (es == edge_release)
+			following = (np.roll(ts, -1) - ts + 2**31) % 2**32 - 2**31
+			keep[offset] = ~last[offset] & \
+				(following[offset] >= self.hysteresis)
+			held = offset & last
+			# The onset that ends a suppressed offset is part of the glitch
+			glitch = np.flatnonzero(offset & ~keep & ~last) + 1
+			keep[glitch[es[glitch] == edge_press]] = False
+		# Resolve an offset that has been held back from a previous batch.
+		# Without photodiode edges, the photodiode has stayed dark at least
+		# until the last event. Without any events, nothing is known yet, and
+		# the offset stays pending.
+		accepted = []
+		if self.pending is not None and n:
+			i = np.searchsorted(b, 8)
+			if i < n and b[i] == 8:
+				dark = wrap_device_time(int(ts[i]) - self.last_time[8])
+				if dark < self.hysteresis:
+					self.suppressed[8] += 1
+					if es[i] == edge_press:
+						keep[i] = False
+					self.pending = None
+			else:
+				dark = wrap_device_time(int(t[-1]) - self.last_time[8])
+			if self.pending is not None and dark >= self.hysteresis:
+				accepted = self.pending
+				self.pending = None
+		# Update the state
+		for _button, _t, _edge in zip(b[last], ts[last], es[last]):
+			self.last_time[_button] = int(_t)
+			self.last_edge[_button] = int(_edge)
+		for _button, count in enumerate(np.bincount(b[~keep & ~held],
+			minlength=9)):
+			self.suppressed[_button] += int(count)
+		mask = np.empty(n, dtype=bool)
+		mask[order] = keep
+		if isinstance(events, np.ndarray):
+			if held.any():
+				self.pending = events[order[held]]
+			if len(accepted):
+				return np.concatenate([accepted, events[mask]])
+			return events[mask]
+		if held.any():
+			self.pending = [events[order[held][0]]]
+		return accepted + [e for e, m in zip(events, mask) if m]
+
+	def flush(self):
+
+		"""
+		desc:
+			Accepts an offset that has been held back, because no further
+			edges have occurred. This should only be called when at least
+			`hysteresis` ms have passed since the last batch.
+
+		returns:
+			desc:	The offset, if any, in the same format as the last batch.
+			type:	[list, ndarray]
+		"""
+
+		pending = self.pending
+		self.pending = None
+		if pending is None:
+			return []
+		return pending
 
 class libboks(object):
 
@@ -84,6 +3294,13 @@ class libboks(object):
 		exp.set('response_time', t2-t1)
 		~~~
 
+		All functions can be safely called from multiple threads, because
+		commands are executed one at a time by a single thread that owns the
+		serial port. Commands that do not return a value, such as [set_led]
+		and [set_buttons], can be issued with `block=False`, in which case
+		they return right away without waiting for the command to be written
+		to the Boks.
+
 		__Function list:__
 
 		%--
@@ -98,11 +3315,79 @@ class libboks(object):
 				A (button, timestamp) tuple. If a timeout occured, `button` is
 				`None`, otherwise `button` is an integers. `timestamp` is a
 				float value in milliseconds.
+			kw_latch: |
+				'onset' or 'offset' to start the response interval on the next
+				onset or offset of the photodiode (button 8), rather than right
+				away, or `None` to start right away. The photodiode edge must
+				be a real change, also in continuous mode. The timeout applies
+				separately to the wait for the photodiode and to the wait for
+				the response. This requires firmware 1.1.0 or later.
+			ret_latch: |
+				If `latch` is specified, a (button, timestamp, onset) tuple,
+				where `onset` is the timestamp of the photodiode edge, or
+				`None` if no edge was detected, in which case `button` is also
+				`None`. Subtracting `onset` from `timestamp` gives a response
+				time that is measured entirely by the Boks, and is therefore
+				free of USB latency and display lag. The photodiode is not
+				used as a response button.
+			ret_cancelled: |
+				If the wait is cancelled with `cancel_wait()`, `button` is
+				`cancelled`, and the timestamp is the moment at which the
+				cancellation took effect on the Boks.
+			kw_block: |
+				Indicates whether the function should wait until the command
+				has been executed. If `False`, the command is scheduled for
+				execution and a [command_future] is returned right away.
 		--%
+
+		__Event listeners:__
+
+		Every button event that is collected is also published to all event
+		listeners that have been added with [add_listener], for example an
+		[event_ring_writer] that shares events with other processes, or an
+		[event_socket_publisher] that streams events over a local socket.
+
+		__Connection recovery:__
+
+		When the Boks is connected to a serial port, and `heartbeat` is
+		specified, a watchdog checks the connection with heartbeat requests
+		whenever the Boks is idle. If the connection is lost, or if the Boks
+		stops replying, the Boks is reconnected automatically, even if it has
+		been moved to another port, and the command that failed is executed
+		once more. A response that is collected again still ends at the
+		original timeout. The buttons, timeout, continuous mode, LED, and
+		clock synchronization are restored, and the outage is recorded in the
+		`outages` property. Button events that occur during an outage are
+		lost.
 	"""
 
+	executor = None
+	watchdog = None
+	capture = None
+	clock_sync = None
+	calibration = None
+	response_latency = 0
+	display_lag = 0
+	auto_reconnect = False
+	last_contact = None
+	read_poll = None
+	stall_timeout = 250
+	probe_timeout = 2000
+	reconnect_timeout = 10000
+	close_timeout = 1000
+	wait_strategy = u'block'
+	spin_time = 2
+	_reconnecting = False
+	_closing = False
+	_armed = False
+	_cancelled = False
+	push = None
+	active_mask = 0x7f
+
 	def __init__(self, port=None, experiment=None, baudrate=115200,
-		buttons=None, timeout=None, led=False):
+		buttons=None, timeout=None, led=False, transport=None, capture=None,
+		calibration=False, participant=None, auto_reconnect=True,
+		heartbeat=None, wait_strategy=u'block', debounce=None):
 
 		"""
 		desc:
@@ -112,8 +3397,8 @@ class libboks(object):
 		keywords:
 			port:
 				desc:	The port to which the device is connected, `None`
-						for autodetect, or 'dummy' to use the keyboard as
-						dummy-boks.
+						for autodetect, or 'dummy' to use the keyboard (or a
+						simulated participant) as dummy-boks.
 				type:	[str, unicode, NoneType]
 			experiment:
 				desc:	An OpenSesame experiment, or `None` to run in plain
@@ -133,6 +3418,62 @@ class libboks(object):
 			led:
 				desc:	Indicates whether the LED should be switched on.
 				type:	bool
+			transport:
+				desc:	An object with the same interface as a serial port, to
+						use instead of opening `port`, such as a
+						[replay_transport] or an [emulated_transport], or
+						`None` to use the serial port.
+				type:	[object, NoneType]
+			capture:
+				desc:	The path of a file to which all serial traffic is
+						captured (see [capture_transport]), or `None` to
+						disable capturing.
+				type:	[str, unicode, NoneType]
+			calibration:
+				desc:	Indicates whether the calibration profile of this Boks
+						should be loaded (see [load_calibration]). Because
+						the display lag of the profile is subtracted from the
+						response times, this should only be enabled when
+						response times are measured from the timestamp of a
+						display.
+				type:	bool
+			participant:
+				desc:	In dummy mode, a [simulated_participant] that generates
+						responses instead of the keyboard, or `None` to use
+						the keyboard. With a simulated participant, dummy mode
+						also works in plain Python mode.
+				type:	[simulated_participant, NoneType]
+			auto_reconnect:
+				desc:	Indicates whether the Boks should reconnect
+						automatically when the connection is lost. This only
+						applies when no `transport` is specified.
+				type:	bool
+			heartbeat:
+				desc:	The maximum time without contact (in milliseconds)
+						before the watchdog checks the connection, or `None`
+						to disable the watchdog. This only applies when
+						`auto_reconnect` is enabled. Heartbeats are sent
+						through the command executor, so code that accesses
+						the serial port directly should only enable them if
+						it does so on the command executor.
+				type:	[int, float, NoneType]
+			wait_strategy:
+				desc:	The strategy that is used to wait for replies from the
+						Boks (see [set_wait_strategy]).
+				type:	[str, unicode]
+			debounce:
+				desc:	A [debounce_filter] that is applied to all responses,
+						or `None` to disable filtering. A response that is
+						suppressed doesn't end the response interval; instead,
+						the Boks keeps waiting without resetting the start of
+						the response interval, so response times and the
+						timeout are unaffected. This costs one extra request
+						per response. When the previous edge on the same
+						button was in the same direction, so that the edge in
+						between went unseen, the response is only returned
+						once the button has been stable (see
+						[debounce_filter]).
+				type:	[debounce_filter, NoneType]
 
 		example: |
 			# Collect a response with a 2000ms timeout
@@ -145,12 +3486,12 @@ class libboks(object):
 
 		# In dummy mode, we morph into the dummy class
 		if port == 'dummy':
-			if experiment == None:
+			if experiment == None and participant == None:
 				raise boks_exception( \
 					'In order to use dummy mode, libboks must be used in OpenSesame mode')
 			self.__class__ = dummy
 			self.__init__(experiment=experiment, timeout=timeout, buttons= \
-				buttons)
+				buttons, participant=participant)
 			return
 
 		# Use OpenSesame if possible
@@ -161,6 +3502,14 @@ class libboks(object):
 			self.experiment = experiment
 
 		self.msg('initializing')
+		self.listeners = []
+		self.outages = []
+		self.device_state = {}
+		self.baudrate = baudrate
+		self.debounce = debounce
+		self._wait_lock = threading.Lock()
+		self._pending_waits = []
+		self._state_lists = {}
 
 		# Autodetect the port
 		if port == None:
@@ -170,52 +3519,295 @@ class libboks(object):
 				self.port = 'COM3'
 		else:
 			self.port = port
-		self.msg('port: %s' % self.port)
-		# Opening and closing the serial port unfreezes the Boks when it has not
-		# been neatly closed.
-		serial.Serial(self.port).close()
-		self.dev = serial.Serial(self.port, baudrate=baudrate)
+		if transport != None:
+			self.msg('transport: %s' % transport.__class__.__name__)
+			self.dev = transport
+		else:
+			self.msg('port: %s' % self.port)
+			if auto_reconnect:
+				# Poll the serial port, so that stalls can be detected
+				self.auto_reconnect = True
+				self.read_poll = .05
+			self.dev = self.open_port(self.port)
+		if capture != None:
+			self.msg('capturing to %s' % capture)
+			self.capture = capture_transport(self.dev, capture)
+			self.dev = self.capture
+		self.executor = command_executor(self.msg)
+		self.set_wait_strategy(wait_strategy)
 
 		# Set up link
 		self.identify()
+		if calibration:
+			self.load_calibration()
 		self.set_buttons(buttons)
 		self.set_timeout(timeout)
 		self.set_led(on=led)
+		if self.auto_reconnect and heartbeat:
+			self.watchdog = boks_watchdog(self, heartbeat)
 		self.msg('ready')		
 
-	def _get_button(self, cmd_byte):
+	def _get_button(self, cmd_byte, latch=None, block=True):
+
+		"""
+		visible:
+			False
+
+		desc:
+			Collect a button press or release, depending on value. The wait
+			is registered in the calling thread, so that it can be cancelled
+			with cancel_wait() as soon as this function returns a future,
+			also if the executor hasn't started it yet.
+
+		arguments:
+			cmd_byte:
+				desc:	CMD_WAIT_PRESS or CMD_WAIT_RELEASE
+				type:	int
+
+		keywords:
+			latch:
+				desc:	"%kw_latch"
+				type:	[str, unicode, NoneType]
+			block:
+				desc:	"%kw_block"
+				type:	bool
+
+		returns:
+			desc:	"%ret_button"
+			type:	tuple
+		"""
+
+		if cmd_byte == CMD_WAIT_PRESS:
+			edge = edge_press
+		else:
+			edge = edge_release
+		flags = None
+		if latch != None:
+			if latch not in latch_edges:
+				raise boks_exception('Expecting one of %s as latch' % \
+					', '.join(latch_edges))
+			self.require_firmware(extended_firmware_version)
+			flags = 0
+			if edge == edge_release:
+				flags |= latch_release
+			if latch == u'offset':
+				flags |= latch_offset
+		# From here on, the wait can be cancelled with cancel_wait(). Waits
+		# are executed in the order in which they are registered, so a
+		# cancellation applies to the oldest pending wait.
+		token = object()
+		with self._wait_lock:
+			self._pending_waits.append(token)
+
+		# The start of the response interval, which is kept if the wait is
+		# retried after a reconnect
+		origin = []
+
+		def collect():
+			try:
+				return self.guarded(self._collect, cmd_byte, edge, latch,
+					flags, origin)
+			finally:
+				with self._wait_lock:
+					self._pending_waits.remove(token)
+					self._cancelled = False
+
+		try:
+			if block:
+				return self.execute(collect)
+			return self.submit(collect)
+		except:
+			with self._wait_lock:
+				if token in self._pending_waits:
+					self._pending_waits.remove(token)
+			raise
+
+	def _collect(self, cmd_byte, edge, latch, flags, origin=None):
 
 		"""
 		visible:
 			False
 
 		desc:
-			Collect a button press or release, depending on value.
+			Collects a button press or release, after the arguments have been
+			checked by _get_button().
 
 		arguments:
 			cmd_byte:
 				desc:	CMD_WAIT_PRESS or CMD_WAIT_RELEASE
 				type:	int
+			edge:
+				desc:	The edge that is reported to event listeners.
+				type:	int
+			latch:
+				desc:	"%kw_latch"
+				type:	[str, unicode, NoneType]
+			flags:
+				desc:	The flags for CMD_WAIT_LATCHED, or `None`.
+				type:	[int, NoneType]
+
+		keywords:
+			origin:
+				desc:	A list to which the start of the response interval
+						is appended. If it already contains a start, the
+						wait is a retry after a reconnect.
+				type:	[list, NoneType]
 
 		returns:
 			desc:	"%ret_button"
 			type:	tuple
 		"""
 
+		# When the wait is retried after a reconnect, the Boks has lost the
+		# original start of the response interval. The timeout is then
+		# shortened, so that the response interval still ends in time.
+		timeout = self.device_state.get(u'timeout')
+		if origin and timeout:
+			remaining = int(origin[0] + timeout - self.time())
+			if remaining <= 0:
+				if latch != None:
+					return None, origin[0] + timeout, None
+				return None, origin[0] + timeout
+			self.msg('retrying wait with %d ms left' % remaining)
+			self.set_timeout(remaining)
+			try:
+				return self._collect(cmd_byte, edge, latch, flags)
+			finally:
+				self.set_timeout(timeout)
 		# Mark the start of the response interval
 		start_time = self.time()
+		if origin != None:
+			origin.append(start_time)
 		self.dev.write(CMD_SET_T1)
-		# Wait for a response
-		self.dev.write(cmd_byte)
-		button = self.read_byte()
+		device_time = None
+		if latch != None:
+			# Wait for the photodiode, which latches T1, and then for a
+			# response. The onset is reported relative to the original T1.
+			button = self._wait(CMD_WAIT_LATCHED + _byte(flags), waits=2)
+			latency = self.read_ulong()
+			if latency == no_onset:
+				self.dev.write(CMD_GET_TD)
+				time = start_time + .001 * self.read_ulong()
+				if button == button_cancelled:
+					return cancelled, time, None
+				return None, time, None
+			onset = start_time + .001 * latency - self.response_latency
+			start_time += .001 * latency
+		while True:
+			# Wait for a response. When the response interval is latched on
+			# the photodiode, the first wait has already happened.
+			if latch == None or device_time != None:
+				button = self._wait(cmd_byte)
+			if button in (button_timeout, button_cancelled) or \
+				self.debounce == None:
+				break
+			# Suppressed responses are bounces or glitches. In that case, we
+			# keep waiting without resetting T1.
+			self.dev.write(CMD_GET_T2)
+			device_time = self.read_ulong()
+			if (not self.debounce.missed(button, edge) or \
+				self._stable(button, edge, device_time)) and \
+				self.debounce.accept(button, edge, device_time):
+				break
+			self.msg('suppressed response %d' % button)
 		# Get the response time and use this to determine the end time
 		self.dev.write(CMD_GET_TD)
 		time = start_time + .001 * self.read_ulong()
 		# Return
-		if button == button_timeout:
-			return None, time
+		if button in (button_timeout, button_cancelled):
+			if button == button_timeout:
+				button = None
+			else:
+				button = cancelled
+			if latch != None:
+				return button, time, onset
+			return button, time
+		# Correct for the systematic offsets in the calibration profile. The
+		# display lag doesn't apply when the onset has been measured.
+		time -= self.response_latency
+		if button != 8 and latch == None:
+			time -= self.display_lag
+		if self.listeners:
+			if latch != None:
+				self.dev.write(CMD_GET_T1)
+				photodiode_edge = edge_press
+				if latch == u'offset':
+					photodiode_edge = edge_release
+				self.publish(boks_event(8, photodiode_edge, self.read_ulong(),
+					onset, self.sid))
+			if device_time == None:
+				self.dev.write(CMD_GET_T2)
+				device_time = self.read_ulong()
+			self.publish(boks_event(button, edge, device_time, time,
+				self.sid))
+		if latch != None:
+			return button, time, onset
 		return button, time
 
+	def _stable(self, button, edge, device_time):
+
+		"""
+		visible:
+			False
+
+		desc:
+			Waits until a button should have been stable after an edge, and
+			checks whether it is still in the state that the edge led to. If
+			not, the edge was a bounce of an unseen edge in the opposite
+			direction, and it is rejected by the debounce filter.
+
+		arguments:
+			button:
+				desc:	The button.
+				type:	int
+			edge:
+				desc:	The edge, `edge_press` or `edge_release`.
+				type:	int
+			device_time:
+				desc:	The device timestamp of the edge.
+				type:	int
+
+		returns:
+			desc:	True if the button is stable.
+			type:	bool
+		"""
+
+		while True:
+			self.dev.write(CMD_GET_TIME)
+			now = self.read_ulong()
+			if wrap_device_time(now - device_time) >= \
+				self.debounce.min_stable[button]:
+				break
+			time.sleep(.001)
+		self.dev.write(CMD_BUTTON_STATE)
+		pressed = button in self.byte_to_list(self.read_byte())
+		if pressed == (edge == edge_press):
+			return True
+		self.debounce.reject(button, edge, now)
+		return False
+
+	def add_listener(self, listener):
+
+		"""
+		desc:
+			Adds an event listener, to which all button events are published.
+			A listener is an object with a `publish(event)` function, which
+			receives a [boks_event], and a `close()` function, which is called
+			when the Boks is closed. Listeners are called from the thread that
+			collects the response, and should therefore return quickly.
+
+		arguments:
+			listener:
+				desc:	An event listener.
+				type:	object
+
+		example: |
+			import libboks
+			exp.boks.add_listener(libboks.event_ring_writer('boks_events'))
+		"""
+
+		self.listeners = self.listeners + [listener]
+
 	def byte_to_list(self, b):
 
 		"""
@@ -242,6 +3834,32 @@ class libboks(object):
 				l.append(i+1)
 		return l
 	
+	@serialised
+	def apply_settings(self, settings, block=True):
+
+		"""
+		desc:
+			Sends button and timeout settings that have been encoded with
+			[compile_settings] in a single write. This is equivalent to, but
+			faster than, calling [set_buttons] and [set_timeout].
+
+		arguments:
+			settings:
+				desc:	Settings as returned by [compile_settings].
+				type:	settings_packet
+
+		keywords:
+			block:
+				desc:	"%kw_block"
+				type:	bool
+		"""
+
+		self.dev.write(settings.data)
+		self.device_state[u'buttons'] = settings.buttons
+		self.active_mask = bytearray(settings.data)[1] or 0x7f
+		self.device_state[u'timeout'] = settings.timeout
+
+	@serialised
 	def button_count(self):
 		
 		"""
@@ -262,6 +3880,207 @@ class libboks(object):
 		self.dev.write(CMD_GET_BTNCNT)
 		return self.read_byte()
 
+	def calibrate(self, n=100, button=None, show=None, hide=None):
+
+		"""
+		desc: |
+			Measures the systematic offsets in the timestamps of this Boks, and
+			stores them in a calibration profile for this Boks (identified by
+			its serial ID and firmware version) and this computer. The profile
+			is then applied right away, and loaded the next time that the Boks
+			is opened with `calibration=True`. The continuous mode and the
+			active buttons are restored afterwards.
+
+			- The response latency is the median time it takes the Boks to
+			  detect a continuously pressed button. This requires a button to
+			  be held down during the measurement.
+			- The display lag is the median time between the moment that a
+			  display is shown, according to the host, and the moment that the
+			  photodiode detects it. This is only measured if `show` and `hide`
+			  functions are specified, and requires the photodiode to be held to
+			  the top-left of the display.
+
+		keywords:
+			n:
+				desc:	The number of measurements.
+				type:	int
+			button:
+				desc:	The button that is held down during the latency
+						measurement, or `None` to use all buttons.
+				type:	[int, NoneType]
+			show:
+				desc:	A function that shows a white display and returns the
+						timestamp of the display, or `None` to skip the
+						display-lag measurement.
+				type:	[function, NoneType]
+			hide:
+				desc:	A function that shows a black display.
+				type:	[function, NoneType]
+
+		returns:
+			desc:	The calibration profile.
+			type:	dict
+
+		example: |
+			from openexp.canvas import canvas
+			white = canvas(exp, bgcolor='white')
+			black = canvas(exp, bgcolor='black')
+			exp.boks.calibrate(button=1, show=white.show, hide=black.show)
+		"""
+
+		buttons = self.get_buttons()
+		continuous = self.device_state.get(u'continuous', False)
+		self.set_continuous(True)
+		if button == None:
+			self.set_buttons(None)
+		else:
+			self.set_buttons([button])
+		latency = []
+		for i in range(n):
+			latency.append(.001 * self._measure_latency())
+		response_latency = _median(latency)
+		display_lag = []
+		if show != None:
+			self.set_buttons([8])
+			for i in range(n):
+				if hide != None:
+					hide()
+				t1 = show()
+				button, t2 = self.get_button_press()
+				# Undo the correction by the current profile, and apply the new
+				# response latency instead.
+				display_lag.append(t2 + self.response_latency -
+					response_latency - t1)
+		self.set_continuous(continuous)
+		self.set_buttons(buttons)
+		profile = {
+			'sid': _text(self.sid),
+			'firmware_version': _text(self.firmware_version),
+			'model': _text(self.model),
+			'host': platform.node(),
+			'timestamp': time.time(),
+			'n': n,
+			'response_latency': response_latency,
+			'display_lag': _median(display_lag) if display_lag else 0
+			}
+		path = self.calibration_path()
+		if not os.path.exists(os.path.dirname(path)):
+			os.makedirs(os.path.dirname(path))
+		with open(path, 'w') as fd:
+			json.dump(profile, fd, indent=1)
+		self.msg('calibration profile written to %s' % path)
+		self.apply_calibration(profile)
+		return profile
+
+	def apply_calibration(self, profile):
+
+		"""
+		desc:
+			Applies a calibration profile, so that the systematic offsets are
+			subtracted from all reported timestamps. The response latency is
+			subtracted from the timestamps of all buttons. The display lag is
+			also subtracted from the timestamps of the response buttons (but
+			not the photodiode), so that response times relative to the
+			timestamp of a display are corrected for display lag.
+
+		arguments:
+			profile:
+				desc:	A calibration profile as returned by [calibrate], or
+						`None` to remove the calibration.
+				type:	[dict, NoneType]
+		"""
+
+		self.calibration = profile
+		if profile == None:
+			self.response_latency = 0
+			self.display_lag = 0
+			return
+		self.response_latency = profile['response_latency']
+		self.display_lag = profile['display_lag']
+		self.msg( \
+			'calibration: response latency = %.3f ms, display lag = %.3f ms' \
+			% (self.response_latency, self.display_lag))
+
+	def calibration_path(self):
+
+		"""
+		desc:
+			Gets the path of the calibration profile for this Boks and this
+			computer.
+
+		returns:
+			desc:	The path to a json file, which may not exist.
+			type:	str
+		"""
+
+		return os.path.join(calibration_dir, '%s-%s-%s.json' % (
+			_text(self.sid), _text(self.firmware_version), platform.node()))
+
+	def cancel_wait(self):
+
+		"""
+		desc: |
+			Cancels a `get_button_press()` or `get_button_release()` that is in
+			progress in another thread, or that has been submitted with
+			`block=False`, without waiting for the timeout. If several waits
+			have been submitted, the oldest one is cancelled. The settings of
+			the Boks are not affected. This function bypasses the
+			command executor, so that it can be called while a wait is
+			blocking it.
+
+			If the wait has already ended by the time that the cancellation
+			reaches the Boks, the response is returned as usual. Firmware
+			older than 1.1.0 cannot cancel a wait once the Boks is waiting,
+			and only waits that haven't been started yet are cancelled.
+
+		returns:
+			desc:	`True` if a wait was in progress and has been cancelled,
+					`False` otherwise.
+			type:	bool
+
+		example: |
+			# Abort the response interval when a trigger arrives
+			future = exp.boks.get_button_press(block=False)
+			wait_for_trigger()
+			exp.boks.cancel_wait()
+			button, timestamp = future.result()
+			if button == libboks.cancelled:
+				exp.set('response', 'aborted')
+		"""
+
+		with self._wait_lock:
+			if not self._pending_waits:
+				return False
+			# If the Boks isn't waiting right now, for example because a
+			# bounce is being processed, the wait is not re-armed.
+			if self._armed:
+				# Older firmware would take the cancellation for a command
+				# after the wait
+				if not self.has_firmware(extended_firmware_version):
+					return False
+				self.dev.write(CMD_CANCEL_WAIT)
+			self._cancelled = True
+		self.msg('cancelling wait')
+		return True
+
+	def candidate_ports(self):
+
+		"""
+		visible:
+			False
+
+		desc:
+			Lists the serial ports on which the Boks may be found, starting
+			with the last known port.
+
+		returns:
+			desc:	A list of port names.
+			type:	list
+		"""
+
+		ports = [self.port] + serial_ports()
+		return [port for i, port in enumerate(ports) if port not in ports[:i]]
+
 	def close(self):
 
 		"""
@@ -275,29 +4094,169 @@ class libboks(object):
 		"""
 
 		self.msg('closing')
+		if self.watchdog is not None:
+			self.watchdog.stop()
+		# A pending wait without a timeout would keep the executor busy
+		# forever. Waits that haven't been started yet end right away.
+		with self._wait_lock:
+			self._closing = True
+		self.cancel_wait()
+		# Leave the Boks in its default mode, so that it can be opened again
+		if self.push is not None:
+			self.set_push(False, block=False)
+		if self.executor is not None and \
+			not self.executor.stop(timeout=.001 * self.close_timeout):
+			# This happens with firmware that doesn't support cancellation
+			self.msg('executor did not stop within %d ms' % \
+				self.close_timeout)
 		self.dev.close()
+		for listener in self.listeners:
+			listener.close()
+		self.listeners = []
 		self.msg('closed')
 
+	def close_port(self):
+
+		"""
+		visible:
+			False
+
+		desc:
+			Closes the serial port, ignoring errors, but leaves the capture
+			file (if any) open.
+		"""
+
+		dev = self.dev
+		if self.capture != None:
+			dev = self.capture.dev
+		try:
+			dev.close()
+		except Exception as e:
+			self.msg('failed to close port: %s' % e)
+		# Stop reading pushed states. Pushing is enabled again by
+		# restore_state().
+		if self.push != None:
+			self.push.running = False
+			self.push = None
+
 	def connection_error(self):
 
-		"""
-		visible:
-			False
+		"""
+		visible:
+			False
+
+		desc:
+			Raises an exception to indicate a connection error.
+		"""
+
+		raise boks_connection_error( \
+			'There was an error connecting to the boks')
+
+	def device_to_host(self, device_time):
+
+		"""
+		desc:
+			Converts a device timestamp to host time, using the clock-sync
+			parameters that have been estimated by [sync_clock]. Device
+			timestamps wrap around every 71.6 minutes, so the conversion is
+			only valid within 35 minutes of the synchronization.
+
+		arguments:
+			device_time:
+				desc:	A device timestamp in microseconds.
+				type:	int
+
+		returns:
+			desc:	A host timestamp in milliseconds.
+			type:	float
+
+		example: |
+			exp.boks.sync_clock()
+			print(exp.boks.device_to_host(event.device_time))
+		"""
+
+		if self.clock_sync == None:
+			raise boks_exception('The clock has not been synchronized')
+		device_ref, host_ref, rate = self.clock_sync
+		return host_ref + .001 * rate * wrap_device_time(device_time -
+			device_ref)
+
+	def host_to_device(self, host_time):
+
+		"""
+		desc:
+			Converts a host timestamp to a device timestamp, using the
+			clock-sync parameters that have been estimated by [sync_clock].
+			This is the inverse of [device_to_host].
+
+		arguments:
+			host_time:
+				desc:	A host timestamp in milliseconds.
+				type:	[int, float]
+
+		returns:
+			desc:	A device timestamp in microseconds.
+			type:	int
+
+		example: |
+			exp.boks.sync_clock()
+			# Flash the LED 100 ms from now
+			exp.boks.schedule_led(exp.boks.host_to_device(self.time()+100))
+		"""
+
+		if self.clock_sync == None:
+			raise boks_exception('The clock has not been synchronized')
+		device_ref, host_ref, rate = self.clock_sync
+		return int(round(device_ref + 1000 * (host_time - host_ref) / \
+			rate)) % 2**32
+
+	def execute(self, func, *args, **kwargs):
+
+		"""
+		visible:
+			False
+
+		desc:
+			Executes a function on the command executor and waits for the
+			result. If there is no executor, or if we are already on the
+			executor thread, the function is executed right away.
+
+		arguments:
+			func:
+				desc:	The function to execute.
+				type:	function
+
+		argument-list:
+			args:	Arguments that are passed to `func`.
+
+		keyword-dict:
+			kwargs:	Keywords that are passed to `func`.
 
-		desc:
-			Raises an exception to indicate a connection error.
+		returns:
+			desc:	The return value of `func`.
 		"""
 
-		raise boks_exception('There was an error connecting to the boks')
+		if self.executor is None or \
+			threading.current_thread() is self.executor:
+			return func(*args, **kwargs)
+		return self.executor.submit(func, *args, **kwargs).result()
 
-	def get_button_press(self):
+	def get_button_press(self, latch=None, block=True):
 
 		"""
 		desc:
 			Collects a button press.
 
+		keywords:
+			latch:
+				desc:	"%kw_latch"
+				type:	[str, unicode, NoneType]
+			block:
+				desc:	"%kw_block"
+				type:	bool
+
 		returns:
-			desc:	"%ret_button"
+			desc:	"%ret_button %ret_latch %ret_cancelled"
 			type:	tuple
 		
 		example: |
@@ -307,18 +4266,29 @@ class libboks(object):
 			button, t2 = exp.boks.get_button_press()
 			exp.set('response', button)
 			exp.set('response_time', t2-t1)
+			# Collect a response relative to the actual onset of the display
+			button, t2, onset = exp.boks.get_button_press(latch='onset')
+			exp.set('response_time', t2-onset)
 		"""
 
-		return self._get_button(CMD_WAIT_PRESS)
+		return self._get_button(CMD_WAIT_PRESS, latch=latch, block=block)
 
-	def get_button_release(self):
+	def get_button_release(self, latch=None, block=True):
 
 		"""
 		desc:
 			Collects a button release.
 
+		keywords:
+			latch:
+				desc:	"%kw_latch"
+				type:	[str, unicode, NoneType]
+			block:
+				desc:	"%kw_block"
+				type:	bool
+
 		returns:
-			desc:	"%ret_button"
+			desc:	"%ret_button %ret_latch %ret_cancelled"
 			type:	tuple
 
 		example: |
@@ -330,17 +4300,31 @@ class libboks(object):
 			exp.set('response_time', t2-t1)
 		"""
 
-		return self._get_button(CMD_WAIT_RELEASE)
+		return self._get_button(CMD_WAIT_RELEASE, latch=latch, block=block)
 
-	def get_button_state(self):
+	def get_button_state(self, timestamp=False):
 
 		"""
-		desc:
+		desc: |
 			Checks which buttons are currently pressed.
 
+			If pushing is enabled (see [set_push]), the state that has last
+			been pushed by the Boks is returned without any communication, so
+			that this function can be polled at any rate, from any thread. In
+			that case, the same list is returned for the same state, and it
+			should therefore not be modified.
+
+		keywords:
+			timestamp:
+				desc:	Indicates whether the device time of the last change
+						of the button state should be returned as well.
+				type:	bool
+
 		returns:
-			desc:	A list of buttons that are currently pressed.
-			type:	list
+			desc:	A list of buttons that are currently pressed, or, if
+					`timestamp` is True, a (buttons, device time) tuple, where
+					the device time is `None` if pushing is disabled.
+			type:	[list, tuple]
 
 		example: |
 			l = exp.boks.get_button_state()
@@ -348,9 +4332,39 @@ class libboks(object):
 				print('Button 1 is pressed')
 		"""
 
+		push = self.push
+		if push == None or push.mirror == None:
+			l = self._get_button_state()
+			device_time = None
+		else:
+			state, device_time = push.mirror
+			state &= self.active_mask
+			l = self._state_lists.get(state)
+			if l == None:
+				l = self._state_lists[state] = self.byte_to_list(state)
+		if timestamp:
+			return l, device_time
+		return l
+
+	@serialised
+	def _get_button_state(self):
+
+		"""
+		visible:
+			False
+
+		desc:
+			Requests the button state from the Boks.
+
+		returns:
+			desc:	A list of buttons that are currently pressed.
+			type:	list
+		"""
+
 		self.dev.write(CMD_BUTTON_STATE)
 		return self.byte_to_list(self.read_byte())
 
+	@serialised
 	def get_buttons(self):
 
 		"""
@@ -371,6 +4385,33 @@ class libboks(object):
 		self.dev.write(CMD_GET_BUTTONS)
 		return self.byte_to_list(self.read_byte())
 	
+	@serialised
+	def get_led_pulses(self):
+
+		"""
+		desc:
+			Gets the number of LED pulses that have been emitted since the last
+			call to [schedule_led], and the actual onset of the first pulse.
+			Later pulses follow at exactly the scheduled interval.
+
+		returns:
+			desc:	A (count, device_time) tuple, where `device_time` is the
+					onset of the first pulse in microseconds on the device
+					clock (see [device_to_host]).
+			type:	tuple
+
+		example: |
+			exp.boks.schedule_led(500, duration=10, relative=True)
+			button, t = exp.boks.get_button_press()
+			count, onset = exp.boks.get_led_pulses()
+		"""
+
+		self.require_firmware(extended_firmware_version)
+		self.dev.write(CMD_GET_LED)
+		count = self.read_byte()
+		return count, self.read_ulong()
+
+	@serialised
 	def get_sid(self):
 		
 		"""
@@ -387,8 +4428,9 @@ class libboks(object):
 		"""
 		
 		self.dev.write(CMD_GET_SID)
-		return self.dev.read(sid_length)
+		return self.read(sid_length)
 
+	@serialised
 	def get_timeout(self):
 
 		"""
@@ -410,6 +4452,92 @@ class libboks(object):
 		self.dev.write(CMD_GET_TIMEOUT)
 		return .001 * self.read_ulong()
 
+	def guarded(self, func, *args, **kwargs):
+
+		"""
+		visible:
+			False
+
+		desc:
+			Executes a function. If the connection to the Boks is lost, and
+			`auto_reconnect` is enabled, the Boks is reconnected and the
+			function is executed once more.
+
+		arguments:
+			func:
+				desc:	The function to execute.
+				type:	function
+
+		argument-list:
+			args:	Arguments that are passed to `func`.
+
+		keyword-dict:
+			kwargs:	Keywords that are passed to `func`.
+
+		returns:
+			desc:	The return value of `func`.
+		"""
+
+		try:
+			return func(*args, **kwargs)
+		except (boks_connection_error, serial.SerialException) as e:
+			if not self.auto_reconnect or self._reconnecting or \
+				self._closing:
+				raise
+			self.msg('connection lost: %s' % e)
+		self._reconnect()
+		return func(*args, **kwargs)
+
+	def has_firmware(self, version):
+
+		"""
+		visible:
+			False
+
+		desc:
+			Checks whether the firmware is at least a given version.
+
+		arguments:
+			version:
+				desc:	The version.
+				type:	str
+
+		returns:
+			desc:	True if the firmware is at least `version`.
+			type:	bool
+		"""
+
+		try:
+			current = [int(i) for i in \
+				_text(self.firmware_version).split('.')]
+		except ValueError:
+			current = []
+		return current >= [int(i) for i in version.split('.')]
+
+	@serialised
+	def heartbeat(self, block=True):
+
+		"""
+		desc:
+			Checks the connection by requesting the device time. This is done
+			automatically by the watchdog when the Boks is idle.
+
+		keywords:
+			block:
+				desc:	"%kw_block"
+				type:	bool
+
+		returns:
+			desc:	The round-trip time in milliseconds.
+			type:	float
+		"""
+
+		t0 = self.time()
+		self.dev.write(CMD_GET_TIME)
+		self.read_ulong()
+		return self.time() - t0
+
+	@serialised
 	def identify(self):
 
 		"""
@@ -425,14 +4553,19 @@ class libboks(object):
 		while True:
 			self.dev.write(CMD_IDENTIFY)
 			s = self.dev.read(firmware_version_length)
-			if s != '':
+			if s != b'':
 				break
+		self.dev.timeout = self.read_poll
+		if len(s) < firmware_version_length:
+			s += self.read(firmware_version_length - len(s))
 		self.firmware_version = s
-		self.msg('firmware version: %s' % s)
-		s = self.dev.read(model_length).strip()
+		self.msg('firmware version: %s' % _text(s))
+		s = self.read(model_length).strip()
 		self.model = s
-		self.msg('model: %s' % s)
-		self.dev.timeout = None
+		self.msg('model: %s' % _text(s))
+		self.dev.write(CMD_GET_SID)
+		self.sid = self.read(sid_length)
+		self.msg('sid: %s' % _text(self.sid))
 
 	def info(self):
 
@@ -453,6 +4586,77 @@ class libboks(object):
 
 		return self.firmware_version, self.model
 
+	def load_calibration(self):
+
+		"""
+		desc:
+			Loads and applies the calibration profile for this Boks and this
+			computer, if it exists. A warning is given if the profile is older
+			than `calibration_max_age` days.
+
+		returns:
+			desc:	The calibration profile, or `None` if there is none.
+			type:	[dict, NoneType]
+		"""
+
+		path = self.calibration_path()
+		if not os.path.exists(path):
+			self.msg('no calibration profile (%s)' % path)
+			return None
+		with open(path) as fd:
+			profile = json.load(fd)
+		age = (time.time() - profile['timestamp']) / 86400
+		if age > calibration_max_age:
+			warnings.warn( \
+				'The calibration profile of boks %s is %d days old, please recalibrate' \
+				% (_text(self.sid), age))
+		self.apply_calibration(profile)
+		return profile
+
+	def locate(self):
+
+		"""
+		visible:
+			False
+
+		desc:
+			Looks for the Boks on all candidate ports, by opening each port and
+			comparing the serial ID with that of the Boks. The port on which
+			the Boks has been found is left open.
+
+		returns:
+			desc:	The port, or `None` if the Boks has not been found.
+			type:	[str, NoneType]
+		"""
+
+		for port in self.candidate_ports():
+			try:
+				dev = self.open_port(port)
+			except (serial.SerialException, OSError):
+				continue
+			if self.capture != None:
+				self.capture.dev = dev
+				self.dev = self.capture
+			else:
+				self.dev = dev
+			# A Boks that resets when the port is opened doesn't reply until it
+			# has booted.
+			sid = None
+			deadline = self.time() + self.probe_timeout
+			while sid == None and self.time() < deadline:
+				try:
+					self.dev.write(CMD_GET_SID)
+					sid = self.read(sid_length)
+				except boks_connection_error:
+					pass
+				except serial.SerialException:
+					break
+			if sid == self.sid:
+				return port
+			self.msg('no matching boks on %s' % port)
+			self.close_port()
+		return None
+
 	def msg(self, msg):
 
 		"""
@@ -471,7 +4675,182 @@ class libboks(object):
 
 		print('libboks: %s' % msg)
 
-	def read_byte(self):
+	@serialised
+	def _measure_latency(self):
+
+		"""
+		visible:
+			False
+
+		desc:
+			Measures the time between the start of the response interval and
+			the detection of a response on the device clock.
+
+		returns:
+			desc:	The latency in microseconds.
+			type:	int
+		"""
+
+		self.dev.write(CMD_SET_T1)
+		self.dev.write(CMD_WAIT_PRESS)
+		self.read_byte(timeout=self._wait_timeout())
+		self.dev.write(CMD_GET_TD)
+		return self.read_ulong()
+
+	@serialised
+	def measure_latency(self, n=1000, release=False, block=True):
+
+		"""
+		desc: |
+			Measures the response latency `n` times in a row on the Boks
+			itself, and returns all measurements at once. Each measurement is
+			the time between the start of a wait (T1) and the detection of a
+			button, as for [get_button_press] or [get_button_release] with the
+			current buttons, timeout, and continuous mode. Because the host is
+			not involved in the individual measurements, this is much faster
+			than measuring the latency with [get_button_press], and reflects
+			only the latency of the firmware. This requires firmware 1.1.0 or
+			later, and numpy.
+
+		keywords:
+			n:
+				desc:	The number of measurements.
+				type:	int
+			release:
+				desc:	Indicates whether button releases rather than presses
+						should be detected.
+				type:	bool
+			block:
+				desc:	"%kw_block"
+				type:	bool
+
+		returns:
+			desc:	An array of latencies in milliseconds, where timeouts are
+					`nan`.
+			type:	ndarray
+
+		example: |
+			# The minimum response latency to a button that is held down
+			exp.boks.set_continuous(True)
+			a = exp.boks.measure_latency(10000)
+			print('Median latency: %.3f ms' % np.median(a))
+		"""
+
+		import numpy as np
+		self.require_firmware(extended_firmware_version)
+		data = []
+		while n > 0:
+			k = min(n, latency_batch)
+			self.dev.write(CMD_MEASURE_LATENCY + struct.pack('<BH',
+				int(bool(release)), k))
+			# Allow for k waits and the transfer of k measurements of 4 bytes
+			# (at 10 bits per byte)
+			timeout = self._wait_timeout(k)
+			if timeout:
+				timeout += k * 40000. / (self.baudrate or baudrate)
+			data.append(self.read(4 * k, timeout=timeout))
+			n -= k
+		a = np.frombuffer(b''.join(data), dtype='<u4')
+		latency = .001 * a
+		latency[a == no_onset] = np.nan
+		return latency
+
+	def open_port(self, port):
+
+		"""
+		visible:
+			False
+
+		desc:
+			Opens a serial port.
+
+		arguments:
+			port:
+				desc:	The port.
+				type:	[str, unicode]
+
+		returns:
+			desc:	The serial port.
+			type:	Serial
+		"""
+
+		return open_port(port, self.baudrate, self.read_poll)
+
+	def publish(self, event):
+
+		"""
+		visible:
+			False
+
+		desc:
+			Publishes an event to all event listeners.
+
+		arguments:
+			event:
+				desc:	An event.
+				type:	boks_event
+		"""
+
+		for listener in self.listeners:
+			try:
+				listener.publish(event)
+			except Exception as e:
+				self.msg('failed to publish event: %s' % e)
+
+	def read(self, size, timeout=None):
+
+		"""
+		visible:
+			False
+
+		desc:
+			Reads a number of bytes from the Boks. A connection error is raised
+			if the serial port fails, or if the Boks does not reply within
+			the timeout.
+
+		arguments:
+			size:
+				desc:	The number of bytes.
+				type:	int
+
+		keywords:
+			timeout:
+				desc:	The timeout in milliseconds, 0 to wait indefinitely, or
+						`None` to use the `stall_timeout` property. The timeout
+						only applies when the serial port is polled (see
+						`read_poll`), otherwise reads block indefinitely.
+				type:	[int, float, NoneType]
+
+		returns:
+			desc:	The bytes.
+			type:	str
+		"""
+
+		if timeout == None:
+			timeout = self.stall_timeout
+		if self.read_poll == None:
+			timeout = 0
+		t0 = self.time()
+		v = b''
+		while True:
+			if self.wait_strategy != u'block':
+				self._spin(size - len(v), t0, timeout)
+			try:
+				v += self.dev.read(size - len(v))
+			except serial.SerialException as e:
+				raise boks_connection_error( \
+					'There was an error connecting to the boks: %s' % e)
+			if len(v) == size:
+				break
+			if self.read_poll == None:
+				self.connection_error()
+			if timeout and self.time() - t0 > timeout:
+				raise boks_connection_error( \
+					'The boks did not reply within %d ms' % timeout)
+		self.last_contact = self.time()
+		return v
+
+	def read_byte(self, timeout=None):
 
 		"""
 		visible:
@@ -480,17 +4859,19 @@ class libboks(object):
 		desc:
 			Reads a single byte from the Boks.
 
+		keywords:
+			timeout:
+				desc:	See [read].
+				type:	[int, float, NoneType]
+
 		returns:
 			desc:	An integer between 0 and 255.
 			type:	int
 		"""
 
-		v = self.dev.read(1)
-		if v == '':
-			self.connection_error()
-		return ord(v)
+		return ord(self.read(1, timeout=timeout))
 
-	def read_ulong(self):
+	def read_ulong(self, timeout=None):
 
 		"""
 		visible:
@@ -500,17 +4881,225 @@ class libboks(object):
 			Reads a single unsigned long from the Boks, which consists of 4
 			bytes.
 
-		returns:
-			desc:	An integer between 0 and 4,294,967,295.
-			type:	int
+		keywords:
+			timeout:
+				desc:	See [read].
+				type:	[int, float, NoneType]
+
+		returns:
+			desc:	An integer between 0 and 4,294,967,295.
+			type:	int
+		"""
+
+		return struct.unpack('I', self.read(4, timeout=timeout))[0]
+
+	def reconnect(self):
+
+		"""
+		desc: |
+			Reconnects to the Boks after the connection has been lost. The
+			last known port is tried first, followed by all other serial
+			ports, until a Boks with the same serial ID has been found. The
+			buttons, timeout, continuous mode, and LED are then restored. If
+			the clock has been synchronized, the offset is estimated again
+			(because the device clock may have been reset), while the
+			estimated rate is kept.
+
+			This function is called automatically when a command fails (see
+			`auto_reconnect`), and generally does not need to be called
+			directly.
+
+		returns:
+			desc:	A `(start, end, port)` named tuple, where `start` is the
+					last time that the Boks replied before the outage, and
+					`end` is the time at which the connection was restored.
+					The outage is also appended to the `outages` property.
+			type:	boks_outage
+
+		example: |
+			for outage in exp.boks.outages:
+				print('Lost connection for %.1f ms' % (outage.end-outage.start))
+		"""
+
+		return self.execute(self._reconnect)
+
+	def _reconnect(self):
+
+		"""
+		visible:
+			False
+
+		desc:
+			Reconnects to the Boks. See [reconnect].
+
+		returns:
+			desc:	The outage.
+			type:	boks_outage
+		"""
+
+		start = self.last_contact
+		if start == None:
+			start = self.time()
+		self.msg('reconnecting to %s' % _text(self.sid))
+		self._reconnecting = True
+		try:
+			self.close_port()
+			deadline = self.time() + self.reconnect_timeout
+			while True:
+				port = self.locate()
+				if port != None:
+					break
+				if self.time() > deadline:
+					raise boks_connection_error( \
+						'Failed to reconnect to boks %s' % _text(self.sid))
+				time.sleep(.05)
+			self.port = port
+			self.identify()
+			self.restore_state()
+			if self.clock_sync != None:
+				rate = self.clock_sync[2]
+				self.clock_sync = None
+				device_ref, host_ref, _rate = self.sync_clock()
+				self.clock_sync = device_ref, host_ref, rate
+		finally:
+			self._reconnecting = False
+		outage = boks_outage(start, self.time(), port)
+		self.outages.append(outage)
+		self.msg('reconnected to %s after %.1f ms' % (port,
+			outage.end - outage.start))
+		return outage
+
+	def remove_listener(self, listener):
+
+		"""
+		desc:
+			Removes an event listener. The listener is not closed.
+
+		arguments:
+			listener:
+				desc:	An event listener that has been added with
+						[add_listener].
+				type:	object
+		"""
+
+		self.listeners = [l for l in self.listeners if l is not listener]
+
+	def require_firmware(self, version):
+
+		"""
+		visible:
+			False
+
+		desc:
+			Checks whether the firmware is at least a given version, and
+			raises an exception if not.
+
+		arguments:
+			version:
+				desc:	The version.
+				type:	str
+		"""
+
+		if not self.has_firmware(version):
+			raise boks_exception( \
+				'This function requires firmware %s or later (found %s)' \
+				% (version, _text(self.firmware_version)))
+
+	def restore_state(self):
+
+		"""
+		visible:
+			False
+
+		desc:
+			Sends the buttons, timeout, continuous mode, LED state, and push
+			mode that have last been set to the Boks again.
+		"""
+
+		state = self.device_state.copy()
+		if u'buttons' in state:
+			self.set_buttons(state[u'buttons'])
+		if u'timeout' in state:
+			self.set_timeout(state[u'timeout'])
+		if u'continuous' in state:
+			self.set_continuous(state[u'continuous'])
+		if u'led' in state:
+			self.set_led(state[u'led'])
+		if state.get(u'push', False):
+			self.set_push(True)
+
+	@serialised
+	def schedule_led(self, start, duration=10, interval=None, count=1,
+		relative=False, block=True):
+
+		"""
+		desc: |
+			Schedules one or more LED pulses, which are emitted by the Boks
+			itself with microsecond precision, also while a response is being
+			collected. This is useful to mark events in video or EEG
+			recordings. Scheduling new pulses cancels pulses that have not
+			been emitted yet, and so does [set_led]. Use [get_led_pulses] to
+			get the actual onset of the first pulse.
+
+			Pulses are not emitted during `CMD_LINK_LED`, and are delayed during
+			`CMD_WAIT_SLEEP`. This function requires firmware 1.1.0 or later.
+
+		arguments:
+			start:
+				desc:	The onset of the first pulse, either as a device
+						timestamp in microseconds (see [host_to_device]), or,
+						if `relative` is True, in milliseconds after the start
+						of the last response interval (T1).
+				type:	[int, float]
+
+		keywords:
+			duration:
+				desc:	The duration of each pulse in milliseconds.
+				type:	[int, float]
+			interval:
+				desc:	The interval between the onsets of subsequent pulses in
+						milliseconds, or `None` for twice the duration.
+				type:	[int, float, NoneType]
+			count:
+				desc:	The number of pulses (1-255).
+				type:	int
+			relative:
+				desc:	Indicates whether `start` is relative to T1.
+				type:	bool
+			block:
+				desc:	"%kw_block"
+				type:	bool
+
+		example: |
+			# Emit three 5 ms pulses at 20 ms intervals, starting 100 ms after
+			# the response interval has started
+			exp.boks.schedule_led(100, duration=5, interval=20, count=3,
+				relative=True)
+			button, t = exp.boks.get_button_press()
 		"""
 
-		v = self.dev.read(4)
-		if v == '':
-			self.connection_error()
-		return struct.unpack('I', v)[0]
+		self.require_firmware(extended_firmware_version)
+		if interval == None:
+			interval = 2 * duration
+		if not 1 <= count <= 255:
+			raise boks_exception('Expecting a pulse count between 1 and 255')
+		if duration <= 0 or interval <= duration:
+			raise boks_exception( \
+				'Expecting a positive duration that is shorter than the interval')
+		if relative:
+			mode = led_relative_t1
+			start = int(1000 * start)
+		else:
+			mode = led_absolute
+		self.dev.write(CMD_SCHEDULE_LED + _byte(mode))
+		self.write_ulong(int(start) % 2**32)
+		self.write_ulong(int(1000 * duration))
+		self.write_ulong(int(1000 * interval))
+		self.dev.write(_byte(count))
+		self.device_state[u'led'] = False
 
-	def set_buttons(self, buttons):
+	@serialised
+	def set_buttons(self, buttons, block=True):
 
 		"""
 		desc:
@@ -524,6 +5113,11 @@ class libboks(object):
 						`None`.
 				type:	[list, NoneType]
 
+		keywords:
+			block:
+				desc:	"%kw_block"
+				type:	bool
+
 		example: |
 			# Only use buttons 1 and 2
 			exp.boks.set_buttons([1,2])
@@ -533,29 +5127,16 @@ class libboks(object):
 			exp.boks.set_buttons([8])
 		"""
 
-		if buttons == None:
-			buttons = all_buttons
-		try:
-			buttons = list(buttons)
-		except:
-			raise boks_exception( \
-				'Expecting a list of integers, or similar parameter')
-		v = 0
-		for button in buttons:
-			try:
-				button = int(button)
-			except:
-				raise boks_exception( \
-					'Expecting a list of integers, or similar parameter')
-			v += 1 << (button-1)
-		if v > 255:
-			raise boks_exception( \
-				'Expecting button numbers between 1 and 8')
+		v = encode_buttons(buttons)
 		self.msg('Setting buttons %s with value %s' % (buttons, bin(v)))
 		self.dev.write(CMD_SET_BUTTONS)
-		self.dev.write(chr(v))
+		self.dev.write(_byte(v))
+		self.device_state[u'buttons'] = buttons
+		# Without buttons, the Boks activates all buttons but the photodiode
+		self.active_mask = v or 0x7f
 
-	def set_continuous(self, continuous=True):
+	@serialised
+	def set_continuous(self, continuous=True, block=True):
 
 		"""
 		desc:
@@ -572,6 +5153,9 @@ class libboks(object):
 			continuous:
 				desc:	True for continuous, False for discontinuous.
 				type:	bool
+			block:
+				desc:	"%kw_block"
+				type:	bool
 							
 		example: |
 			exp.boks.set_continuous(True)
@@ -584,20 +5168,26 @@ class libboks(object):
 
 		self.dev.write(CMD_SET_CONTINUOUS)
 		if continuous:
-			self.dev.write(chr(1))
+			self.dev.write(_byte(1))
 		else:
-			self.dev.write(chr(0))
+			self.dev.write(_byte(0))
+		self.device_state[u'continuous'] = continuous
 			
-	def set_led(self, on=True):
+	@serialised
+	def set_led(self, on=True, block=True):
 		
 		"""
 		desc:
-			Turns the LED on or off.
+			Turns the LED on or off. This also cancels pulses that have been
+			scheduled with [schedule_led].
 
 		keywords:
 			"on":
 				desc:	Indicates whether the LED should be on or off.
 				type:	bool
+			block:
+				desc:	"%kw_block"
+				type:	bool
 
 		example: |
 			# Blink LED five time
@@ -606,14 +5196,149 @@ class libboks(object):
 				self.sleep(500)
 				exp.boks.set_led(False)
 				self.sleep(500)
+			# Switch the LED on without waiting for the serial write
+			exp.boks.set_led(True, block=False)
 		"""
 		
 		if on:
 			self.dev.write(CMD_LED_ON)
 		else:
 			self.dev.write(CMD_LED_OFF)
+		self.device_state[u'led'] = on
+
+	@serialised
+	def set_push(self, push=True, block=True):
+
+		"""
+		desc: |
+			Enables or disables push mode, in which the Boks sends its button
+			state whenever it changes, and libboks keeps a local mirror of it.
+			[get_button_state] then returns the mirrored state without any
+			communication. While pushing is enabled, a background thread reads
+			from the serial port (see [push_transport]), and each reply of the
+			Boks costs two extra bytes. This requires firmware 1.1.0 or later.
+
+		keywords:
+			push:
+				desc:	Indicates whether pushing should be enabled.
+				type:	bool
+			block:
+				desc:	"%kw_block"
+				type:	bool
+
+		example: |
+			exp.boks.set_push(True)
+			# Polling is now free
+			while 1 not in exp.boks.get_button_state():
+				pass
+			buttons, device_time = exp.boks.get_button_state(timestamp=True)
+		"""
+
+		if bool(push) == (self.push != None):
+			return
+		self.require_firmware(extended_firmware_version)
+		if push:
+			self.msg('enabling push mode')
+			self.push = push_transport(self.dev)
+			self.dev = self.push
+			self.dev.write(CMD_SET_PUSH + _byte(1))
+			self.read_byte()
+			if not self.push.wait_mirror(self.stall_timeout):
+				raise boks_connection_error( \
+					'The boks did not push its state within %d ms' \
+					% self.stall_timeout)
+		else:
+			self.msg('disabling push mode')
+			self.push.last_frame()
+			self.dev.write(CMD_SET_PUSH + _byte(0))
+			self.read_byte()
+			self.dev = self.push.detach()
+			self.push = None
+		self.device_state[u'push'] = bool(push)
+
+	@serialised
+	def set_realtime(self, cpu=None, priority=None, lock_memory=False,
+		block=True):
+
+		"""
+		desc: |
+			Configures the thread that communicates with the Boks for low
+			latency, by pinning it to a dedicated CPU core, giving it
+			real-time (`SCHED_FIFO`) priority, and/or locking the memory of
+			the process into RAM, so that it is never swapped out. These
+			settings require Linux, and real-time priority and memory locking
+			generally require root privileges (or the `CAP_SYS_NICE` and
+			`CAP_IPC_LOCK` capabilities). Settings that are not permitted are
+			skipped with a debug message.
+
+		keywords:
+			cpu:
+				desc:	The CPU core to pin the thread to, or `None` to leave
+						the CPU affinity unchanged.
+				type:	[int, NoneType]
+			priority:
+				desc:	The `SCHED_FIFO` priority (1-99), or `None` to leave
+						the scheduling policy unchanged.
+				type:	[int, NoneType]
+			lock_memory:
+				desc:	Indicates whether the memory of the process should be
+						locked.
+				type:	bool
+			block:
+				desc:	"%kw_block"
+				type:	bool
+
+		returns:
+			desc:	A dict that indicates for each of `cpu`, `priority`, and
+					`lock_memory` whether it has been applied.
+			type:	dict
+
+		example: |
+			applied = exp.boks.set_realtime(cpu=3, priority=50,
+				lock_memory=True)
+			if not applied['priority']:
+				print('Failed to enable real-time scheduling')
+		"""
+
+		applied = {u'cpu': False, u'priority': False, u'lock_memory': False}
+		# The system calls are made through ctypes, because Python 2 doesn't
+		# expose them. On Linux, pid 0 refers to the calling thread.
+		libc = _libc()
+		if libc == None:
+			self.msg('real-time settings are only supported on Linux')
+			return applied
+		if cpu != None:
+			# A cpu_set_t is an array of unsigned longs with 1024 bits
+			bits = 8 * ctypes.sizeof(ctypes.c_ulong)
+			cpu_set = (ctypes.c_ulong * (1024 // bits))()
+			if 0 <= cpu < 1024:
+				cpu_set[cpu // bits] = 1 << (cpu % bits)
+			if libc.sched_setaffinity(0, ctypes.sizeof(cpu_set),
+				cpu_set) == 0:
+				applied[u'cpu'] = True
+			else:
+				self.msg('failed to set cpu affinity: %s' % \
+					os.strerror(ctypes.get_errno()))
+		if priority != None:
+			# A sched_param consists of a single int. 1 is SCHED_FIFO.
+			param = ctypes.c_int(priority)
+			if libc.sched_setscheduler(0, 1, ctypes.byref(param)) == 0:
+				applied[u'priority'] = True
+			else:
+				self.msg('failed to set real-time priority: %s' % \
+					os.strerror(ctypes.get_errno()))
+		if lock_memory:
+			# MCL_CURRENT | MCL_FUTURE
+			if libc.mlockall(3) == 0:
+				applied[u'lock_memory'] = True
+			else:
+				self.msg('failed to lock memory: %s' % \
+					os.strerror(ctypes.get_errno()))
+		self.msg('real-time settings: %s' % applied)
+		return applied
 
-	def set_timeout(self, timeout):
+	@serialised
+	def set_timeout(self, timeout, block=True):
 
 		"""
 		desc:
@@ -625,6 +5350,11 @@ class libboks(object):
 				desc:	A value in milliseconds. Use 0 or `None` to disable
 						timeout (i.e. to wait infinitely).
 				type:	[int, NoneType]
+
+		keywords:
+			block:
+				desc:	"%kw_block"
+				type:	bool
 							
 		example: |
 			exp.boks.set_timeout(2000)
@@ -632,18 +5362,184 @@ class libboks(object):
 			print('The Boks timeout is currently set to %d ms' % t)
 		"""
 
-		if timeout == None:
-			timeout = 0
-		try:
-			timeout = int(timeout)
-		except:
-			raise boks_exception('Expecting a numeric value or None')
-		if timeout < 0:
-			raise boks_exception( \
-				'Expecting a non-negative numeric value or None')
-		self.msg('Setting timeout to %d' % timeout)
+		us = encode_timeout(timeout)
+		self.msg('Setting timeout to %d' % (us // 1000))
 		self.dev.write(CMD_SET_TIMEOUT)
-		self.write_ulong(1000*timeout)
+		self.write_ulong(us)
+		self.device_state[u'timeout'] = us // 1000
+
+	def set_wait_strategy(self, strategy, spin_time=None):
+
+		"""
+		desc: |
+			Sets how libboks waits for replies from the Boks. This is a
+			trade-off between CPU usage and how quickly replies are picked up:
+
+			- `block` sleeps in the serial port until a reply arrives, which
+			  uses no CPU, but wake-up latency depends on the scheduler.
+			- `poll` continuously checks whether a reply has arrived, which
+			  minimizes latency, but fully occupies one CPU core, also while
+			  waiting for a button press. The polling thread yields the
+			  interpreter lock after every check, so that other Python
+			  threads, such as the one that updates the display, keep
+			  running, but they do compete with it for the interpreter lock,
+			  and may therefore be scheduled slightly later.
+			- `hybrid` polls for `spin_time` ms and then blocks, which picks
+			  up the replies to most commands right away without occupying
+			  the CPU during long waits.
+
+			The `wait` test component of the Boks test suite reports the
+			latency distribution for each strategy.
+
+		arguments:
+			strategy:
+				desc:	'block', 'poll', or 'hybrid'.
+				type:	[str, unicode]
+
+		keywords:
+			spin_time:
+				desc:	The time (in milliseconds) to poll before blocking in
+						hybrid mode, or `None` to leave it unchanged.
+				type:	[int, float, NoneType]
+
+		example: |
+			exp.boks.set_wait_strategy('hybrid', spin_time=5)
+		"""
+
+		if strategy not in wait_strategies:
+			raise boks_exception('Expecting one of %s as wait strategy' \
+				% ', '.join(wait_strategies))
+		if spin_time != None:
+			self.spin_time = spin_time
+		self.wait_strategy = strategy
+		self.msg('wait strategy: %s' % strategy)
+
+	def _spin(self, size, t0, timeout):
+
+		"""
+		visible:
+			False
+
+		desc:
+			Polls the serial port until a number of bytes is available, or
+			until polling should stop because of the wait strategy or the
+			timeout.
+
+		arguments:
+			size:
+				desc:	The number of bytes.
+				type:	int
+			t0:
+				desc:	The start of the read.
+				type:	float
+			timeout:
+				desc:	See [read].
+				type:	[int, float]
+		"""
+
+		if self.wait_strategy == u'hybrid':
+			until = self.time() + self.spin_time
+		else:
+			until = None
+		while self.dev.inWaiting() < size:
+			t = self.time()
+			if until != None and t > until:
+				break
+			if timeout and t - t0 > timeout:
+				break
+			# Release the interpreter lock, so that the main thread isn't
+			# blocked while polling
+			time.sleep(0)
+
+	def submit(self, func, *args, **kwargs):
+
+		"""
+		visible:
+			False
+
+		desc:
+			Schedules a function for execution on the command executor, without
+			waiting for the result. If there is no executor, the function is
+			executed right away.
+
+		arguments:
+			func:
+				desc:	The function to execute.
+				type:	function
+
+		argument-list:
+			args:	Arguments that are passed to `func`.
+
+		keyword-dict:
+			kwargs:	Keywords that are passed to `func`.
+
+		returns:
+			desc:	A future for the return value of `func`.
+			type:	command_future
+		"""
+
+		if self.executor is not None:
+			return self.executor.submit(func, *args, **kwargs)
+		future = command_future()
+		try:
+			future.set_result(func(*args, **kwargs))
+		except Exception as e:
+			future.set_exception(e)
+		return future
+
+	@serialised
+	def sync_clock(self, n=25):
+
+		"""
+		desc:
+			Estimates the relation between the device clock (in microseconds)
+			and the host clock (in milliseconds), by repeatedly requesting the
+			device time. Each device timestamp is paired with the midpoint of
+			the host timestamps before and after the request, and the half of
+			the requests with the shortest round trip is used to estimate the
+			offset between the clocks. The first synchronization assumes that
+			both clocks run at the same rate. When the clock is synchronized
+			again at least 10 s (but less than 71 minutes) later, the rate is
+			estimated from the drift between both synchronizations.
+
+		keywords:
+			n:
+				desc:	The number of requests.
+				type:	int
+
+		returns:
+			desc:	A (device_ref, host_ref, rate) tuple, such that a device
+					time `d` corresponds to host time
+					`host_ref + .001 * rate * (d - device_ref)`. This tuple is
+					also stored as the `clock_sync` property.
+			type:	tuple
+
+		example: |
+			exp.boks.sync_clock()
+			print('Clock sync: %s' % str(exp.boks.clock_sync))
+		"""
+
+		if self.clock_sync == None:
+			prev_device, prev_host, rate = None, None, 1.
+		else:
+			prev_device, prev_host, rate = self.clock_sync
+		pairs = []
+		for i in range(n):
+			t0 = self.time()
+			self.dev.write(CMD_GET_TIME)
+			d = self.read_ulong()
+			t1 = self.time()
+			pairs.append((t1-t0, d, .5*(t0+t1)))
+		pairs = sorted(pairs)[:max(1, n//2)]
+		device_ref = pairs[0][1]
+		host_ref = sum([h - .001 * rate * wrap_device_time(d - device_ref) \
+			for rtt, d, h in pairs]) / len(pairs)
+		if prev_host != None and host_ref - prev_host >= 10000:
+			rate = (host_ref - prev_host) / (.001 * ((device_ref -
+				prev_device) % 2**32))
+		self.clock_sync = device_ref, host_ref, rate
+		self.msg('clock sync: %s' % str(self.clock_sync))
+		return self.clock_sync
 
 	def time(self):
 
@@ -662,6 +5558,72 @@ class libboks(object):
 
 		return 1000. * time.time()
 
+	def _wait(self, cmd, waits=1):
+
+		"""
+		visible:
+			False
+
+		desc:
+			Sends a wait command, and reads the button that ends the wait, such
+			that the wait can be cancelled with `cancel_wait()`.
+
+		arguments:
+			cmd:
+				desc:	The wait command, including its arguments.
+				type:	str
+
+		keywords:
+			waits:
+				desc:	The number of consecutive waits that the command
+						consists of.
+				type:	int
+
+		returns:
+			desc:	The button, `button_timeout`, or `button_cancelled`.
+			type:	int
+		"""
+
+		with self._wait_lock:
+			if self._cancelled or self._closing:
+				# Mark the moment of cancellation, so that it is reflected
+				# in the response time
+				self.dev.write(CMD_SET_T2)
+				return button_cancelled
+			self.dev.write(cmd)
+			self._armed = True
+		try:
+			return self.read_byte(timeout=self._wait_timeout(waits))
+		finally:
+			with self._wait_lock:
+				self._armed = False
+
+	def _wait_timeout(self, waits=1):
+
+		"""
+		visible:
+			False
+
+		desc:
+			Determines how long to wait for the reply to a wait command, which
+			is the timeout of the Boks plus the `stall_timeout`.
+
+		keywords:
+			waits:
+				desc:	The number of consecutive waits that the command
+						consists of.
+				type:	int
+
+		returns:
+			desc:	A timeout in milliseconds, or 0 to wait indefinitely.
+			type:	[int, float]
+		"""
+
+		timeout = self.device_state.get(u'timeout', 0)
+		if not timeout:
+			return 0
+		return waits * timeout + self.stall_timeout
+
 	def write_ulong(self, l):
 
 		"""
@@ -683,59 +5645,171 @@ class dummy(libboks):
 	
 	"""
 	desc:
-		Emulates libboks using the keyboard. Only works when an OpenSesame
-		experiment is available.
+		Emulates libboks using the keyboard, which only works when an
+		OpenSesame experiment is available, or using a [simulated_participant].
+
+		With a simulated participant, all timestamps come from a simulated
+		clock, which runs ahead of the experiment clock by the `lead`
+		property (in milliseconds). Every response advances the simulated
+		clock by the simulated response time, so that host and device
+		timestamps never run backwards, even though responses are returned
+		instantly. To get response times, the start of the response interval
+		must be shifted by the `lead` at the start of the interval.
 	"""
 
-	def __init__(self, experiment, buttons, timeout):
+	lead = 0
+
+	def __init__(self, experiment, buttons, timeout, participant=None):
 		
 		"""See libboks."""
 
-		from libopensesame import debug
+		if experiment != None:
+			from libopensesame import debug
+			self.msg = debug.msg
 		self.experiment = experiment
-		self.msg = debug.msg
-		self.time = experiment.time
-		self.buttons = buttons
-		self.timeout = timeout
+		self.participant = participant
+		self.keyboard = None
+		self.set_timeout(timeout)
+		self.listeners = []
 		self.msg('initializing dummy mode')
+		self.set_buttons(buttons)
 		self.identify()
 
+	def cancel_wait(self):
+
+		"""
+		desc:
+			Keyboard waits cannot be interrupted, so there is never a wait to
+			cancel.
+		"""
+
+		return False
+
 	def close(self):
 		
 		"""See libboks."""
 
-		pass
+		for listener in self.listeners:
+			listener.close()
+		self.listeners = []
 
-	def get_button_press(self):
-		
-		"""See libboks."""
+	def _get_button(self, edge):
+
+		"""
+		visible:
+			False
 
-		from openexp.keyboard import keyboard
-		_buttons = [str(b) for b in self.buttons]
-		kb = keyboard(self.experiment, keylist=_buttons, timeout=self.timeout)
-		key, timestamp = kb.get_key()
+		desc:
+			Collects a key press, and publishes it as a button event.
+
+		arguments:
+			edge:
+				desc:	The edge that is reported to event listeners.
+				type:	int
+
+		returns:
+			desc:	"%ret_button"
+			type:	tuple
+		"""
+
+		if self.participant != None:
+			# The simulated participant responds instantly, and the device
+			# clock advances by the simulated response time.
+			# The photodiode is only used if no other buttons are active
+			buttons = [int(b) for b in self.buttons if int(b) != 8]
+			if not buttons:
+				buttons = [int(b) for b in self.buttons]
+			key, rt = self.participant.respond(buttons, self.timeout, edge)
+			timestamp = self.time() + rt
+			self.lead += rt
+		else:
+			_buttons = [str(b) for b in self.buttons]
+			key, timestamp = self.get_keyboard().get_key(keylist=_buttons,
+				timeout=self.timeout)
+		# The device clock is derived from the same (simulated) clock
+		device_time = int(1000*timestamp) & 0xffffffff
 		# Make sure that we return `int`s instead of `str`s
 		if key != None:
 			key = int(key)
+			if self.listeners:
+				self.publish(boks_event(key, edge, device_time, timestamp,
+					self.sid))
 		return key, timestamp
 
-	def get_button_release(self):
+	def get_keyboard(self):
+
+		"""
+		visible:
+			False
+
+		desc:
+			Gets a keyboard object, which is created only once.
+
+		returns:
+			desc:	A keyboard object.
+			type:	keyboard
+		"""
+
+		if self.keyboard == None:
+			from openexp.keyboard import keyboard
+			self.keyboard = keyboard(self.experiment)
+		return self.keyboard
+
+	def get_button_press(self, latch=None, block=True):
 		
 		"""See libboks."""
 
-		return self.get_button_press()
+		if block:
+			return self._latch(edge_press, latch)
+		# There is no executor, so this returns a completed future
+		return self.submit(self._latch, edge_press, latch)
 
-	def get_button_state(self):
+	def get_button_release(self, latch=None, block=True):
 		
 		"""See libboks."""
 
-		from openexp.keyboard import keyboard
-		_buttons = [str(b) for b in self.buttons]
-		kb = keyboard(self.experiment, keylist=_buttons, timeout=0)
-		key, timestamp = kb.get_key()
-		if key == None:
-			return []
-		return [int(key)]
+		if block:
+			return self._latch(edge_release, latch)
+		# There is no executor, so this returns a completed future
+		return self.submit(self._latch, edge_release, latch)
+
+	def _latch(self, edge, latch):
+
+		"""
+		visible:
+			False
+
+		desc:
+			Collects a response, and if `latch` is specified, reports the start
+			of the response interval as the onset, because dummy mode has no
+			photodiode.
+		"""
+
+		if latch == None:
+			return self._get_button(edge)
+		if latch not in latch_edges:
+			raise boks_exception('Expecting one of %s as latch' % \
+				', '.join(latch_edges))
+		onset = self.time()
+		button, timestamp = self._get_button(edge)
+		return button, timestamp, onset
+
+	def get_button_state(self, timestamp=False):
+		
+		"""See libboks."""
+
+		if self.participant != None:
+			l = []
+		else:
+			_buttons = [str(b) for b in self.buttons]
+			key, t = self.get_keyboard().get_key(keylist=_buttons, timeout=0)
+			if key == None:
+				l = []
+			else:
+				l = [int(key)]
+		if timestamp:
+			return l, None
+		return l
 
 	def get_buttons(self):
 		
@@ -747,7 +5821,7 @@ class dummy(libboks):
 		
 		"""See libboks."""
 		
-		return 'AA0000'
+		return b'AA0000'
 
 	def get_timeout(self):
 		
@@ -759,10 +5833,18 @@ class dummy(libboks):
 		
 		"""See libboks."""
 
-		self.firmware_version = '0.0.0'
-		self.model = 'dummy.boks'
+		self.firmware_version = b'0.0.0'
+		self.model = b'dummy.boks'
+		self.sid = self.get_sid()
+
+	def apply_settings(self, settings, block=True):
+
+		"""See libboks."""
+
+		self.set_buttons(settings.buttons)
+		self.set_timeout(settings.timeout)
 
-	def set_buttons(self, buttons):
+	def set_buttons(self, buttons, block=True):
 		
 		"""See libboks."""
 
@@ -772,20 +5854,79 @@ class dummy(libboks):
 		else:
 			self.buttons = buttons
 
-	def set_continuous(self, continuous=True):
+	def set_continuous(self, continuous=True, block=True):
 		
 		"""See libboks."""
 
 		pass
 
-	def set_led(self, on=True):
+	def set_led(self, on=True, block=True):
 		
 		"""See libboks."""
 
 		pass
 
-	def set_timeout(self, timeout):
+	def measure_latency(self, n=1000, release=False, block=True):
+
+		"""
+		desc:
+			Dummy mode has no response latency that could be measured, so
+			this raises an exception rather than returning simulated values.
+		"""
+
+		raise boks_exception( \
+			'The response latency cannot be measured in dummy mode')
+
+	def set_push(self, push=True, block=True):
+
+		"""See libboks."""
+
+		pass
+
+	def set_realtime(self, cpu=None, priority=None, lock_memory=False,
+		block=True):
+
+		"""See libboks."""
+
+		return {u'cpu': False, u'priority': False, u'lock_memory': False}
+
+	def schedule_led(self, start, duration=10, interval=None, count=1,
+		relative=False, block=True):
+
+		"""See libboks."""
+
+		pass
+
+	def get_led_pulses(self):
+
+		"""See libboks."""
+
+		return 0, 0
+
+	def set_timeout(self, timeout, block=True):
 		
 		"""See libboks."""
 
-		self.timeout = timeout
+		# Like the Boks, treat 0 as no timeout, which is also how
+		# compile_settings() encodes an infinite timeout. The keyboard would
+		# otherwise return right away.
+		self.timeout = timeout or None
+
+	def time(self):
+
+		"""
+		visible:
+			False
+
+		desc:
+			The experiment clock (or the libboks clock in plain Python mode),
+			plus the `lead` of the simulated clock.
+
+		returns:
+			desc:	A timestamp in milliseconds.
+			type:	float
+		"""
+
+		if self.experiment != None:
+			return self.experiment.time() + self.lead
+		return libboks.time(self) + self.lead
@@ -0,0 +1,95 @@
+#!/usr/bin/env python
+
+# This file is part of boks.
+#
+# boks is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# boks is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with boks. If not, see <http://www.gnu.org/licenses/>.
+
+"""
+Tests of boksanalysis, which run on session logs that are written by the
+tests themselves.
+"""
+
+import os
+import sys
+import shutil
+import tempfile
+import unittest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)),
+	'..', 'opensesame', 'boks'))
+try:
+	import numpy as np
+	import boksanalysis
+except ImportError:
+	boksanalysis = None
+import libboks
+
+# (trial, button, edge, device time in ms) tuples. Trial 1 has more events
+# than the chunk size that is used below, and button 3 is held from trial 1
+# into trial 2.
+events = [
+	(1, 8, 1, 0), (1, 8, 0, 10), (1, 1, 1, 300), (1, 1, 0, 400),
+	(1, 2, 1, 500), (1, 2, 0, 600), (1, 1, 1, 700), (1, 1, 0, 800),
+	(1, 3, 1, 900),
+	(2, 8, 1, 1000), (2, 1, 1, 1300), (2, 1, 0, 1400), (2, 3, 0, 1500),
+	]
+
+@unittest.skipIf(boksanalysis is None, 'numpy is not available')
+class test_summarize_log(unittest.TestCase):
+
+	def setUp(self):
+
+		self.dir = tempfile.mkdtemp()
+		self.path = os.path.join(self.dir, 'session.bokslog')
+		log = libboks.session_log(self.path)
+		trial = None
+		for _trial, button, edge, t in events:
+			if _trial != trial:
+				trial = _trial
+				log.start_trial(trial, onset=t)
+			log.publish(libboks.boks_event(button, edge, 1000*t, t, None))
+		log.close()
+
+	def tearDown(self):
+
+		shutil.rmtree(self.dir)
+
+	def test_chunks(self):
+
+		"""Trials that don't fit into a chunk are not split."""
+
+		log = libboks.session_log_reader(self.path)
+		chunks = [len(events) for events, trials in \
+			boksanalysis.iter_chunks(log, 4)]
+		self.assertEqual(chunks, [9, 4])
+
+	def test_chunk_size(self):
+
+		"""The summaries don't depend on the chunk size."""
+
+		for chunk_size in 1, 4:
+			button_summary, session_summary = boksanalysis.summarize_log(
+				self.path, chunk_size=chunk_size)
+			self.assertEqual(session_summary['n_responses'][0], 2)
+			self.assertEqual(session_summary['n_misses'][0], 0)
+			self.assertEqual(session_summary['mean_rt'][0], 300)
+			rows = dict((row['button'], row) for row in button_summary)
+			self.assertEqual(rows[1]['n_responses'], 2)
+			self.assertEqual(rows[1]['mean_hold'], 100)
+			# The hold that spans both trials
+			self.assertEqual(rows[3]['mean_hold'], 600)
+
+if __name__ == '__main__':
+
+	unittest.main()
@@ -0,0 +1,768 @@
+#!/usr/bin/env python
+
+# This file is part of boks.
+#
+# boks is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# boks is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with boks. If not, see <http://www.gnu.org/licenses/>.
+
+"""
+Tests of libboks that don't need a Boks. Unlike the `unittest` script, these
+tests are not interactive, and run against a dummy Boks, an emulated Boks, or
+no Boks at all.
+"""
+
+import os
+import sys
+import time
+import types
+import shutil
+import socket
+import tempfile
+import threading
+import unittest
+import serial
+
+try:
+	import numpy
+except ImportError:
+	numpy = None
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)),
+	'..', 'opensesame', 'boks'))
+import libboks
+
+class fake_keyboard(object):
+
+	"""
+	A keyboard that records the timeout of every get_key() call, and never
+	returns a key.
+	"""
+
+	def __init__(self):
+
+		self.timeouts = []
+
+	def get_key(self, keylist=None, timeout=None):
+
+		self.timeouts.append(timeout)
+		return None, 0.
+
+class fake_experiment(object):
+
+	"""An OpenSesame experiment that only provides a clock."""
+
+	def time(self):
+
+		return 0.
+
+class test_dummy(unittest.TestCase):
+
+	"""Tests the keyboard-based dummy Boks."""
+
+	def setUp(self):
+
+		# The dummy prints debug messages through OpenSesame
+		debug = types.ModuleType('debug')
+		debug.msg = lambda msg: None
+		libopensesame = types.ModuleType('libopensesame')
+		libopensesame.debug = debug
+		sys.modules['libopensesame'] = libopensesame
+		sys.modules['libopensesame.debug'] = debug
+		self.boks = libboks.libboks('dummy', experiment=fake_experiment())
+		self.boks.keyboard = fake_keyboard()
+
+	def tearDown(self):
+
+		del sys.modules['libopensesame']
+		del sys.modules['libopensesame.debug']
+
+	def test_infinite_timeout(self):
+
+		"""An infinite timeout must not make the keyboard return right away."""
+
+		# This is how the boks item compiles timeout = 'infinite'
+		settings = libboks.compile_settings(None, None)
+		self.boks.apply_settings(settings)
+		self.boks.get_button_press()
+		self.boks.set_timeout(0)
+		self.boks.get_button_press()
+		self.assertEqual(self.boks.keyboard.timeouts, [None, None])
+
+	def test_timeout(self):
+
+		settings = libboks.compile_settings([1, 2], 2000)
+		self.boks.apply_settings(settings)
+		self.boks.get_button_press()
+		self.assertEqual(self.boks.keyboard.timeouts, [2000])
+
+	def test_future(self):
+
+		future = self.boks.get_button_press(block=False)
+		self.assertEqual(future.result(), (None, 0.))
+
+	def test_measure_latency(self):
+
+		"""Dummy mode doesn't pretend to have a latency of 0."""
+
+		self.assertRaises(libboks.boks_exception, self.boks.measure_latency,
+			10)
+
+def photodiode(*edges):
+
+	"""
+	Creates photodiode events.
+
+	Arguments:
+	*edges	--	(edge, device time in ms) tuples
+	"""
+
+	return [libboks.boks_event(8, edge, 1000*t, None, None) \
+		for edge, t in edges]
+
+class test_executor(unittest.TestCase):
+
+	"""Tests executing commands on an emulated Boks from other threads."""
+
+	def setUp(self):
+
+		self.dev = libboks.emulated_transport(rate=0)
+		self.boks = libboks.libboks(transport=self.dev)
+		self.boks.set_timeout(1000)
+
+	def tearDown(self):
+
+		self.boks.close()
+
+	def test_future(self):
+
+		self.dev.press(1, 100, 50)
+		t0 = self.boks.time()
+		future = self.boks.get_button_press(block=False)
+		self.assertFalse(future.done())
+		# Commands are queued behind the wait
+		self.assertEqual(self.boks.get_timeout(), 1000)
+		self.assertTrue(future.done())
+		button, t1 = future.result()
+		self.assertEqual(button, 1)
+		self.assertAlmostEqual(t1 - t0, 100, delta=20)
+
+	def test_threads(self):
+
+		"""Commands from several threads don't interleave."""
+
+		results = []
+
+		def request():
+			for i in range(20):
+				results.append((self.boks.get_timeout(),
+					self.boks.get_sid()))
+
+		threads = [threading.Thread(target=request) for i in range(4)]
+		for thread in threads:
+			thread.start()
+		for thread in threads:
+			thread.join()
+		self.assertEqual(results, [(1000, b'EMU000')] * 80)
+
+@unittest.skipIf(numpy is None, 'numpy is not available')
+class test_debounce_filter(unittest.TestCase):
+
+	"""Tests hysteresis on photodiode offsets."""
+
+	def setUp(self):
+
+		self.filter = libboks.debounce_filter(min_stable=5, hysteresis=20)
+
+	def test_glitch(self):
+
+		"""A glitch is suppressed as a whole, so that onsets don't repeat."""
+
+		events = self.filter.filter(photodiode((1, 0), (0, 100), (1, 105),
+			(0, 300), (1, 400)))
+		self.assertEqual([(e.edge, e.device_time) for e in events],
+			[(1, 0), (0, 300000), (1, 400000)])
+		self.assertEqual(self.filter.suppressed[8], 2)
+
+	def test_glitch_across_batches(self):
+
+		events = self.filter.filter(photodiode((1, 0), (0, 100)))
+		self.assertEqual([e.device_time for e in events], [0])
+		self.assertEqual(self.filter.filter(photodiode((1, 105), (0, 300))),
+			[])
+		self.assertEqual([e.device_time for e in self.filter.flush()],
+			[300000])
+
+	def test_empty_batch(self):
+
+		"""An empty batch doesn't show whether the photodiode stayed dark."""
+
+		self.filter.filter(photodiode((1, 0), (0, 100)))
+		self.assertEqual(self.filter.filter([]), [])
+		self.assertEqual(self.filter.filter(photodiode((1, 105))), [])
+		self.filter.filter(photodiode((0, 200)))
+		# Other buttons do show that the photodiode stayed dark
+		events = self.filter.filter([libboks.boks_event(1, 1, 300000, None,
+			None)])
+		self.assertEqual([(e.button, e.device_time) for e in events],
+			[(8, 200000), (1, 300000)])
+
+class test_debounce(unittest.TestCase):
+
+	"""Tests the debounce filter on responses that are collected live."""
+
+	def test_release_bounce(self):
+
+		"""
+		A press that is caused by bouncing on release is suppressed, although
+		the release itself is never reported.
+		"""
+
+		dev = libboks.emulated_transport(rate=0)
+		debounce = libboks.debounce_filter(min_stable=5)
+		boks = libboks.libboks(transport=dev, calibration=False,
+			heartbeat=None, debounce=debounce)
+		boks.set_timeout(2000)
+		t = dev._now() + 100000
+		dev.presses.extend([(t, t + 100000, 1), (t + 101000, t + 102000, 1),
+			(t + 300000, t + 400000, 1)])
+		self.assertEqual(boks.get_button_press()[0], 1)
+		self.assertEqual(debounce.last_time[1], t)
+		self.assertEqual(boks.get_button_press()[0], 1)
+		self.assertEqual(debounce.last_time[1], t + 300000)
+		self.assertEqual(debounce.suppressed[1], 1)
+		boks.close()
+
+class test_led_schedule(unittest.TestCase):
+
+	"""Tests LED pulses that are scheduled on an emulated Boks."""
+
+	def test_relative(self):
+
+		boks = libboks.libboks(transport=libboks.emulated_transport(rate=0))
+		boks.sync_clock()
+		boks.set_timeout(100)
+		t0 = boks.time()
+		boks.get_button_press()
+		# Relative to the start of the last response interval
+		boks.schedule_led(200, duration=5, interval=20, count=3,
+			relative=True)
+		self.assertEqual(boks.get_led_pulses()[0], 0)
+		boks.set_timeout(300)
+		boks.get_button_press()
+		count, onset = boks.get_led_pulses()
+		self.assertEqual(count, 3)
+		self.assertAlmostEqual(boks.device_to_host(onset) - t0, 200,
+			delta=20)
+		boks.close()
+
+class test_latch(unittest.TestCase):
+
+	"""Tests latching the response interval on the emulated photodiode."""
+
+	def setUp(self):
+
+		self.dev = libboks.emulated_transport(rate=0)
+		self.boks = libboks.libboks(transport=self.dev)
+		self.boks.set_timeout(1000)
+
+	def tearDown(self):
+
+		self.boks.close()
+
+	def test_onset(self):
+
+		self.dev.press(8, 50, 100)
+		self.dev.press(1, 150, 50)
+		t0 = self.boks.time()
+		button, t1, onset = self.boks.get_button_press(latch=u'onset')
+		self.assertEqual(button, 1)
+		self.assertAlmostEqual(onset - t0, 50, delta=20)
+		self.assertAlmostEqual(t1 - onset, 100, delta=1)
+
+	def test_offset(self):
+
+		"""Responses before the photodiode edge are ignored."""
+
+		self.dev.press(8, 0, 100)
+		self.dev.press(2, 20, 50)
+		self.dev.press(3, 200, 50)
+		button, t1, onset = self.boks.get_button_release(latch=u'offset')
+		self.assertEqual(button, 3)
+		self.assertAlmostEqual(t1 - onset, 150, delta=1)
+
+	def test_no_onset(self):
+
+		self.boks.set_timeout(50)
+		self.dev.press(1, 10, 10)
+		button, t1, onset = self.boks.get_button_press(latch=u'onset')
+		self.assertEqual(button, None)
+		self.assertEqual(onset, None)
+
+class test_cancel(unittest.TestCase):
+
+	"""Tests cancelling waits on an emulated Boks."""
+
+	def setUp(self):
+
+		dev = libboks.emulated_transport(rate=0)
+		self.boks = libboks.libboks(transport=dev, calibration=False,
+			heartbeat=None)
+		self.boks.set_timeout(3000)
+
+	def tearDown(self):
+
+		self.boks.close()
+
+	def test_cancel_idle(self):
+
+		self.assertFalse(self.boks.cancel_wait())
+
+	def test_cancel_submitted(self):
+
+		"""A wait can be cancelled before the executor has started it."""
+
+		t0 = time.time()
+		future = self.boks.get_button_press(block=False)
+		self.assertTrue(self.boks.cancel_wait())
+		self.assertEqual(future.result()[0], libboks.cancelled)
+		self.assertLess(time.time() - t0, 1)
+		self.assertFalse(self.boks.cancel_wait())
+
+	def test_cancel_armed(self):
+
+		future = self.boks.get_button_press(block=False)
+		while not self.boks._armed:
+			time.sleep(.001)
+		# Older firmware cannot cancel a wait that has been armed
+		self.boks.firmware_version = b'1.0.2'
+		self.assertFalse(self.boks.cancel_wait())
+		self.boks.firmware_version = libboks.extended_firmware_version
+		self.assertTrue(self.boks.cancel_wait())
+		self.assertEqual(future.result()[0], libboks.cancelled)
+
+	def test_command_during_wait(self):
+
+		"""A command that is sent during a wait is executed after it."""
+
+		def wait_and_request():
+			self.boks.dev.write(libboks.CMD_WAIT_PRESS +
+				libboks.CMD_GET_TIMEOUT)
+			return self.boks.read_byte(), self.boks.read_ulong()
+
+		self.boks.set_timeout(100)
+		self.assertEqual(self.boks.execute(wait_and_request),
+			(libboks.button_timeout, 100000))
+
+class test_push(unittest.TestCase):
+
+	"""Tests mirroring the button state of an emulated Boks."""
+
+	def test_mirror(self):
+
+		dev = libboks.emulated_transport(rate=0)
+		boks = libboks.libboks(transport=dev)
+		boks.set_timeout(500)
+		boks.set_push(True)
+		dev.press(2, 50, 100)
+		self.assertEqual(boks.get_button_state(), [])
+		time.sleep(.1)
+		self.assertEqual(boks.get_button_state(), [2])
+		# Replies are framed while pushing
+		self.assertEqual(boks.get_timeout(), 500)
+		time.sleep(.1)
+		self.assertEqual(boks.get_button_state(), [])
+		boks.set_push(False)
+		self.assertEqual(boks.get_timeout(), 500)
+		boks.close()
+
+@unittest.skipIf(sys.version_info < (3, 8),
+	'Shared-memory event buffers require Python 3.8 or later')
+class test_event_ring(unittest.TestCase):
+
+	"""Tests publishing events in shared memory."""
+
+	def setUp(self):
+
+		self.name = 'boks_test_%d' % os.getpid()
+		self.writer = libboks.event_ring_writer(self.name, capacity=4)
+		self.reader = libboks.event_ring_reader(self.name)
+
+	def tearDown(self):
+
+		self.reader.close()
+		if self.writer != None:
+			self.writer.close()
+
+	def test_wraparound(self):
+
+		"""Readers that fall behind lose the oldest events."""
+
+		events = [libboks.boks_event(1, libboks.edge_press, i, float(i),
+			b'EMU000') for i in range(10)]
+		for event in events[:3]:
+			self.writer.publish(event)
+		self.assertEqual(self.reader.read(), events[:3])
+		for event in events[3:]:
+			self.writer.publish(event)
+		self.assertEqual(self.reader.read(), events[6:])
+		self.assertEqual(self.reader.lost, 3)
+
+	def test_listener(self):
+
+		dev = libboks.emulated_transport(rate=0)
+		boks = libboks.libboks(transport=dev)
+		boks.add_listener(self.writer)
+		boks.set_timeout(1000)
+		dev.press(1, 10, 10)
+		button, t = boks.get_button_press()
+		events = self.reader.read()
+		self.assertEqual([(e.button, e.edge) for e in events],
+			[(1, libboks.edge_press)])
+		self.assertEqual(events[0].host_time, t)
+		# Listeners are closed with the boks
+		boks.close()
+		self.writer = None
+
+@unittest.skipIf(not hasattr(socket, 'AF_UNIX'),
+	'Unix-domain sockets are not available')
+class test_event_socket(unittest.TestCase):
+
+	"""Tests streaming events over a Unix-domain socket."""
+
+	def setUp(self):
+
+		self.dir = tempfile.mkdtemp()
+		self.path = os.path.join(self.dir, 'events')
+		self.subscriber = libboks.event_socket_subscriber(self.path)
+		self.publisher = libboks.event_socket_publisher(self.path)
+
+	def tearDown(self):
+
+		self.publisher.close()
+		self.subscriber.close()
+		shutil.rmtree(self.dir)
+
+	def publish(self, n):
+
+		for i in range(n):
+			self.publisher.publish(libboks.boks_event(1, libboks.edge_press,
+				i, 0., b'EMU000'))
+
+	def test_dropped(self):
+
+		"""Events that the publisher drops are not also counted as lost."""
+
+		self.publish(1)
+		self.assertEqual(len(self.subscriber.read(timeout=1)), 1)
+		# Nobody is listening while the socket has been moved
+		os.rename(self.path, self.path + '.moved')
+		self.publish(3)
+		while self.publisher.dropped < 3:
+			time.sleep(.001)
+		os.rename(self.path + '.moved', self.path)
+		self.publish(1)
+		events = self.subscriber.read(timeout=1)
+		self.assertEqual([e.device_time for e in events], [0])
+		self.assertEqual(self.subscriber.dropped, 3)
+		self.assertEqual(self.subscriber.lost, 0)
+
+class test_replay(unittest.TestCase):
+
+	"""Tests replaying traffic that was captured from an emulated Boks."""
+
+	def setUp(self):
+
+		self.dir = tempfile.mkdtemp()
+		self.path = os.path.join(self.dir, 'session.bokscap')
+		boks = libboks.libboks(transport=libboks.emulated_transport(rate=0),
+			capture=self.path)
+		self.results = self.session(boks)
+
+	def tearDown(self):
+
+		shutil.rmtree(self.dir)
+
+	def session(self, boks):
+
+		boks.set_timeout(20)
+		results = [boks.get_button_press()[0], boks.get_timeout(),
+			boks.get_sid()]
+		boks.close()
+		return results
+
+	def test_replay(self):
+
+		for strict in False, True:
+			boks = libboks.libboks(transport=libboks.replay_transport(
+				self.path, speed=None, strict=strict))
+			self.assertEqual(self.session(boks), self.results)
+
+	def test_diverged(self):
+
+		"""In strict mode, other commands than were captured raise."""
+
+		boks = libboks.libboks(transport=libboks.replay_transport(self.path,
+			speed=None, strict=True))
+		self.assertRaises(libboks.boks_exception, boks.set_timeout, 30)
+		boks.close()
+
+class test_session_log(unittest.TestCase):
+
+	"""Tests recovering session logs after a crash."""
+
+	def setUp(self):
+
+		self.dir = tempfile.mkdtemp()
+		self.path = os.path.join(self.dir, 'session.bokslog')
+
+	def tearDown(self):
+
+		shutil.rmtree(self.dir)
+
+	def write_log(self, n):
+
+		log = libboks.session_log(self.path)
+		log.start_trial(1, onset=0)
+		for i in range(n):
+			log.publish(libboks.boks_event(1, libboks.edge_press, i, 0.,
+				None))
+		log.close()
+
+	def read_log(self):
+
+		with open(self.path, 'rb') as fd:
+			fd.seek(libboks.log_header_size)
+			data = fd.read()
+		return [libboks.log_event_struct.unpack_from(data, i)[3] for i in \
+			range(0, len(data), libboks.log_event_struct.size)]
+
+	def test_partial_records(self):
+
+		self.write_log(3)
+		for path in self.path, self.path + libboks.log_trials_ext:
+			with open(path, 'ab') as fd:
+				fd.write(b'\x01\x02\x03')
+		self.assertEqual(libboks.recover_session_log(self.path), 3)
+		self.assertEqual(self.read_log(), [0, 1, 2])
+		self.assertEqual(os.path.getsize(self.path + libboks.log_trials_ext),
+			libboks.log_trial_struct.size)
+
+	def test_partial_header(self):
+
+		"""A log that crashed while the header was written is reset."""
+
+		self.write_log(0)
+		with open(self.path, 'r+b') as fd:
+			fd.truncate(20)
+		self.assertEqual(libboks.recover_session_log(self.path), 0)
+		log = libboks.session_log(self.path, append=True)
+		log.publish(libboks.boks_event(1, libboks.edge_press, 5, 0., None))
+		log.close()
+		self.assertEqual(self.read_log(), [5])
+		with open(self.path, 'rb') as fd:
+			header = libboks.log_header_struct.unpack(
+				fd.read(libboks.log_header_struct.size))
+		self.assertEqual(header[:3], (libboks.log_magic, libboks.log_version,
+			libboks.log_event_struct.size))
+
+class test_calibration(unittest.TestCase):
+
+	"""Tests calibrating an emulated Boks."""
+
+	def setUp(self):
+
+		self.calibration_dir = libboks.calibration_dir
+		libboks.calibration_dir = tempfile.mkdtemp()
+
+	def tearDown(self):
+
+		shutil.rmtree(libboks.calibration_dir)
+		libboks.calibration_dir = self.calibration_dir
+
+	def test_calibrate(self):
+
+		dev = libboks.emulated_transport(rate=0)
+		boks = libboks.libboks(transport=dev)
+		boks.set_timeout(1000)
+		boks.set_continuous(True)
+		# Button 1 is held down, and the display is detected by the
+		# photodiode 10 ms after it is shown. It is hidden before the next
+		# measurement, which would otherwise end right away in continuous
+		# mode.
+
+		def show():
+			dev.press(8, 10, 5)
+			return boks.time()
+
+		def hide():
+			time.sleep(.01)
+
+		dev.press(1)
+		profile = boks.calibrate(n=5, button=1, show=show, hide=hide)
+		self.assertLess(profile['response_latency'], 1)
+		self.assertAlmostEqual(profile['display_lag'], 10, delta=2)
+		# The settings from before the calibration are restored
+		self.assertEqual(dev.continuous, 1)
+		self.assertEqual(boks.get_buttons(), list(range(1, 8)))
+		boks.close()
+		# The profile is only applied when calibration is enabled
+		boks = libboks.libboks(transport=libboks.emulated_transport(rate=0))
+		self.assertEqual(boks.display_lag, 0)
+		boks.close()
+		boks = libboks.libboks(transport=libboks.emulated_transport(rate=0),
+			calibration=True)
+		self.assertEqual(boks.display_lag, profile['display_lag'])
+		boks.close()
+
+class unpluggable_transport(libboks.emulated_transport):
+
+	"""An emulated Boks that can be unplugged."""
+
+	unplugged = False
+
+	def read(self, size=1):
+
+		if self.unplugged:
+			raise serial.SerialException('The boks has been unplugged')
+		return libboks.emulated_transport.read(self, size)
+
+	def write(self, data):
+
+		if self.unplugged:
+			raise serial.SerialException('The boks has been unplugged')
+		libboks.emulated_transport.write(self, data)
+
+class emulated_boks(libboks.libboks):
+
+	"""
+	A Boks that opens an emulated Boks on every port, like a Boks that is
+	plugged in again.
+	"""
+
+	def candidate_ports(self):
+
+		return [self.port]
+
+	def open_port(self, port):
+
+		dev = unpluggable_transport(rate=0)
+		dev.timeout = self.read_poll
+		return dev
+
+class test_reconnect(unittest.TestCase):
+
+	"""Tests reconnecting to an emulated Boks."""
+
+	def setUp(self):
+
+		self.boks = emulated_boks(port='emulator', calibration=False)
+
+	def tearDown(self):
+
+		self.boks.close()
+
+	def test_command(self):
+
+		self.boks.set_timeout(500)
+		self.boks.dev.unplugged = True
+		self.assertEqual(self.boks.get_timeout(), 500)
+		self.assertEqual(len(self.boks.outages), 1)
+
+	def test_wait(self):
+
+		"""A wait that is retried still ends at the original timeout."""
+
+		self.boks.set_timeout(1000)
+		t0 = self.boks.time()
+		future = self.boks.get_button_press(block=False)
+		time.sleep(.3)
+		self.boks.dev.unplugged = True
+		button, t1 = future.result()
+		self.assertEqual(button, None)
+		self.assertAlmostEqual(t1 - t0, 1000, delta=150)
+		self.assertEqual(len(self.boks.outages), 1)
+		self.assertEqual(self.boks.get_timeout(), 1000)
+
+class fake_list_ports(object):
+
+	"""Lists an Arduino Uno, an FTDI adapter, and a built-in port."""
+
+	def comports(self):
+
+		return [
+			('/dev/ttyACM0', 'Arduino Uno', 'USB VID:PID=2341:0043 SNR=1'),
+			('/dev/ttyUSB0', 'FT232R', 'USB VID:PID=0403:6001 SNR=2'),
+			('/dev/ttyS0', 'ttyS0', 'PNP0501'),
+			]
+
+class test_serial_ports(unittest.TestCase):
+
+	def setUp(self):
+
+		self.list_ports = libboks.list_ports
+		libboks.list_ports = fake_list_ports()
+
+	def tearDown(self):
+
+		libboks.list_ports = self.list_ports
+
+	def test_arduino(self):
+
+		self.assertEqual(libboks.serial_ports(), ['/dev/ttyACM0',
+			'/dev/ttyUSB0', '/dev/ttyS0'])
+		self.assertEqual(libboks.serial_ports(arduino=True),
+			['/dev/ttyACM0'])
+
+class test_realtime(unittest.TestCase):
+
+	"""Tests the wait strategies and real-time settings."""
+
+	def setUp(self):
+
+		dev = libboks.emulated_transport(rate=0)
+		self.boks = libboks.libboks(transport=dev, calibration=False,
+			heartbeat=None)
+
+	def tearDown(self):
+
+		self.boks.close()
+
+	def test_set_realtime(self):
+
+		# Nothing is requested, so nothing is applied
+		applied = self.boks.set_realtime(block=False).result()
+		self.assertEqual(applied, {u'cpu': False, u'priority': False,
+			u'lock_memory': False})
+
+	def test_poll(self):
+
+		"""
+		Polling doesn't keep other threads from waking up. Without yielding
+		the interpreter lock, Python 3 only switches threads every 5 ms.
+		"""
+
+		self.boks.set_wait_strategy(u'poll')
+		self.boks.set_timeout(200)
+		future = self.boks.get_button_press(block=False)
+		delays = []
+		while not future.done():
+			t0 = time.time()
+			time.sleep(.0005)
+			delays.append(time.time() - t0 - .0005)
+		self.assertEqual(future.result()[0], None)
+		delays.sort()
+		self.assertLess(delays[len(delays) // 2], .003)
+
+if __name__ == '__main__':
+
+	unittest.main()